@@ -0,0 +1,96 @@
+"""Постраничная статистика для администратора"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Лимит Telegram — 4096 символов; оставляем запас под шапку и подвал
+PAGE_CHARS = 3000
+PAGE_LINES = 40
+
+
+class StatsPages:
+    """
+    Индекс статистики: строки участников (по алфавиту) и пар, заранее
+    разбитые на страницы. Индекс строится заново только когда меняется
+    версия данных в хранилище, готовые страницы кэшируются, поэтому
+    открытие страницы не зависит от числа участников.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.header = ""
+        self.pages = []  # список страниц, страница — список строк
+        self.rendered = {}  # номер страницы -> текст
+
+    async def rebuild(self, db):
+        version = db.version
+        stats = await db.get_stats()
+        participants = await db.get_all()
+        pairs = await db.get_pairs() if db.distribution_done else {}
+
+        self.header = (
+            f"📊 **Детальная статистика:**\n\n"
+            f"👥 Всего участников: {stats['total']}\n"
+            f"🎁 Распределение: {'✅ Выполнено' if db.distribution_done else '❌ Не выполнено'}\n"
+            f"🔔 Получили уведомления: {stats['notified']}/{stats['total']}\n"
+        )
+
+        lines = []
+        if participants:
+            lines.append("\n**Список участников:**")
+            for data in sorted(participants.values(), key=lambda data: data['name'].lower()):
+                status = "🔔" if data['notified'] else "⏳"
+                status += "🎁" if data['is_giver'] else ""
+                username = f"(@{data['username']})" if data['username'] else ""
+                lines.append(f"{status} {data['name']} {username}")
+
+        # Информация о парах если распределение выполнено
+        if pairs:
+            lines.append("\n**Пары (кто → кому):**")
+            rows = []
+            for giver_id, receiver_id in pairs.items():
+                giver = participants.get(giver_id, {})
+                receiver = participants.get(receiver_id, {})
+                notified = "✅" if giver.get('notified') else "⏳"
+                rows.append((giver.get('name', '?'), f"{notified} {giver.get('name', '?')} → {receiver.get('name', '?')}"))
+            lines.extend(line for _, line in sorted(rows, key=lambda row: row[0].lower()))
+
+        # Раскладываем строки по страницам с учётом длины
+        self.pages = []
+        page, size = [], 0
+        for line in lines:
+            line = line[:PAGE_CHARS]
+            if page and (size + len(line) + 1 > PAGE_CHARS or len(page) >= PAGE_LINES):
+                self.pages.append(page)
+                page, size = [], 0
+            page.append(line)
+            size += len(line) + 1
+        if page or not self.pages:
+            self.pages.append(page)
+
+        self.rendered = {}
+        self.version = version
+
+    async def page(self, db, number):
+        """Текст и кнопки страницы number (с нуля)"""
+        if self.version != db.version:
+            await self.rebuild(db)
+
+        number = max(0, min(number, len(self.pages) - 1))
+        if number not in self.rendered:
+            text = self.header
+            if self.pages[number]:
+                text += "\n".join(self.pages[number]) + "\n"
+            if len(self.pages) > 1:
+                text += f"\n📄 Страница {number + 1} из {len(self.pages)}"
+            self.rendered[number] = text
+
+        return self.rendered[number], self.markup(number)
+
+    def markup(self, number):
+        if len(self.pages) < 2:
+            return None
+        buttons = []
+        if number > 0:
+            buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f'stats:{number - 1}'))
+        if number < len(self.pages) - 1:
+            buttons.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f'stats:{number + 1}'))
+        return InlineKeyboardMarkup([buttons])
@@ -0,0 +1,7 @@
+"""
+Замеры производительности. Запуск из корня репозитория:
+
+    python -m bench.matching 100000
+
+Первый аргумент — размер замера (у каждого скрипта свой по умолчанию).
+"""
@@ -0,0 +1,19 @@
+"""Замер: рассылка через BroadcastEngine и FakeBot против старого цикла с sleep(0.5)"""
+import asyncio
+import sys
+
+from broadcast import GLOBAL_RATE, BroadcastEngine, FakeBot
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+print(f"Benchmark: рассылка {count} сообщений через FakeBot (лимит 30/сек)")
+
+async def bench():
+    bot = FakeBot()
+    report = await BroadcastEngine(bot, rate=GLOBAL_RATE).run((chat_id, "🎅") for chat_id in range(count))
+    old = count * (bot.latency + 0.5)
+    print(f"Отправлено: {report['sent']}, ошибок: {report['failed']}, 429 от FakeBot: {bot.rejected}")
+    print(f"Время: {report['elapsed']:.1f} сек ({report['rate']:.1f} сообщ./сек), "
+          f"p50 {report['p50']:.0f} мс, p99 {report['p99']:.0f} мс")
+    print(f"Старый цикл с sleep(0.5): ~{old:.0f} сек")
+
+asyncio.run(bench())
@@ -0,0 +1,76 @@
+"""Замер: пропускная способность рабочих процессов над общей базой SQLite"""
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import database
+from cluster import shard_of
+
+
+def worker(path, source, done):
+    """Рабочий процесс бенчмарка: разбор обновления, чтение и запись в общую базу"""
+    from telegram import Update
+
+    logging.disable(logging.INFO)
+    db = database.SantaDatabase(path, shared=True)
+    done.put('ready')
+    handled = 0
+    while True:
+        data = source.get()
+        if data is None:
+            break
+        update = Update.de_json(data, None)
+        user_id = update.effective_user.id
+        if db.get_info(user_id) is None:
+            db.register(user_id, None, update.message.text)
+        handled += 1
+    db.close()
+    done.put(handled)
+
+
+def message(user_id, step):
+    return {
+        'update_id': user_id * 10 + step,
+        'message': {
+            'message_id': step, 'date': 0, 'text': f"Участник Номер {user_id}",
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'}
+        }
+    }
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    logging.disable(logging.INFO)
+    context = multiprocessing.get_context('spawn')
+    print(f"Benchmark: {count} обновлений, общая база SQLite, ядер: {os.cpu_count()}")
+    for workers in (1, 2, 4):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'santa.db')
+            database.SantaDatabase(path).close()
+
+            queues = [context.Queue() for _ in range(workers)]
+            done = context.Queue()
+            processes = [context.Process(target=worker, args=(path, queue, done)) for queue in queues]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                done.get()  # процессы подняты, импорт telegram не в замере
+
+            started = time.perf_counter()
+            for number in range(count):
+                user_id = 10**9 + number % (count // 5)
+                update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+                queues[shard_of(update, workers)].put(message(user_id, number // (count // 5)))
+            for queue in queues:
+                queue.put(None)
+            handled = sum(done.get() for _ in processes)
+            elapsed = time.perf_counter() - started
+            for process in processes:
+                process.join()
+            assert handled == count
+            print(f"{workers} процесс(а): {count / elapsed:7.0f} обновлений/с")
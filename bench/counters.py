@@ -0,0 +1,44 @@
+"""Замер: счётчики статистики против пересчёта по таблице"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import database
+
+logging.disable(logging.INFO)
+operations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+print(f"Проверка счётчиков: {operations} случайных операций с SQLite-хранилищем")
+
+db = database.SantaDatabase(os.path.join(tempfile.mkdtemp(), 'counters.db'))
+users = range(operations // 5)
+for step in range(operations):
+    action = random.random()
+    if action < 0.6:
+        user_id = random.choice(users)
+        db.register(user_id, f"user{user_id}", f"Участник {user_id}")
+    elif action < 0.9:
+        db.mark_as_notified(random.choice(users))
+    elif action < 0.995:
+        db.distribute_gifts()
+    else:
+        db.reset_all()
+
+    if step % 500 == 0:
+        mismatches = db.check_stats()
+        assert not mismatches, mismatches
+
+assert not db.check_stats()
+print("Счётчики совпадают с пересчётом:", db.get_stats())
+
+started = time.perf_counter()
+for _ in range(10_000):
+    db.get_stats()
+incremental = (time.perf_counter() - started) / 10_000
+started = time.perf_counter()
+for _ in range(100):
+    db.check_stats()
+recount = (time.perf_counter() - started) / 100
+print(f"get_stats: {incremental * 1e6:.1f} мкс, пересчёт с нуля: {recount * 1e6:.0f} мкс")
@@ -0,0 +1,47 @@
+"""Замер: соединение на каждый вызов, одно соединение и CachedDatabase"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from database import CachedDatabase, SantaDatabase, logger
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+logger.setLevel(logging.WARNING)
+print(f"Benchmark: соединение на каждый вызов, одно соединение и кэш ({count} операций)")
+
+for label in ("connect per call", "pooled", "cached"):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = SantaDatabase(path, pooled=label != "connect per call")
+    if label == "cached":
+        db = CachedDatabase(db)
+
+    started = time.perf_counter()
+    for user_id in range(count):
+        db.register(user_id, f"user{user_id}", f"Участник {user_id}", "книга", None)
+    register = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for user_id in range(count):
+        db.get_info(user_id)
+        db.get_receiver_for_giver(user_id)
+    lookup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(count):
+        db.get_stats()
+    stats = time.perf_counter() - started
+
+    # После жеребьёвки: «кому я дарю» и «кто дарит мне»
+    db.distribute_gifts()
+    started = time.perf_counter()
+    for user_id in range(count):
+        db.get_receiver_for_giver(user_id)
+        db.get_giver_for_receiver(user_id)
+    pairs = time.perf_counter() - started
+
+    print(f"{label:>17}: register {count / register:8.0f}/сек, "
+          f"lookup x2 {count / lookup:8.0f}/сек, stats {count / stats:8.0f}/сек, "
+          f"pairs x2 {count / pairs:8.0f}/сек")
+    db.close()
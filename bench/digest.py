@@ -0,0 +1,55 @@
+"""Замер: уведомления организатору по одному против сводок AdminDigest"""
+import asyncio
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+from telegram.error import TelegramError
+
+from broadcast import FakeBot
+from digest import AdminDigest
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+logging.disable(logging.WARNING)
+event = SimpleNamespace(id='bench', title="Тайный Санта", organizers={1, 2})
+
+async def rush(bot, notify, rate=500):
+    # Наплыв регистраций: rate событий в секунду
+    started = time.perf_counter()
+    for number in range(count):
+        await notify(bot, number)
+        await asyncio.sleep(1 / rate)
+    return time.perf_counter() - started
+
+async def bench():
+    print(f"Benchmark: {count} регистраций, 2 организатора, лимит 30 сообщений/с и 1/с на чат")
+
+    async def direct(bot, number):
+        # Прежний notify_organizers: сообщение на событие, ошибки проглатываются
+        for organizer_id in event.organizers:
+            try:
+                await bot.send_message(chat_id=organizer_id, text=f"📥 Новый участник: {number}")
+            except TelegramError:
+                pass
+
+    bot = FakeBot(latency=0.001, global_limit=30, chat_interval=1.0)
+    elapsed = await rush(bot, direct)
+    print(f"по одному: {elapsed:5.2f} с, доставлено {bot.delivered:5}, потеряно на 429: {bot.rejected:5}")
+
+    digest = AdminDigest(interval=1.0)
+    bot = FakeBot(latency=0.001, global_limit=30, chat_interval=1.0)
+    task = asyncio.create_task(digest.run(bot))
+
+    async def coalesced(bot, number):
+        digest.add(event, f"📥 Новый участник: {number}", footer=f"👥 Всего участников: {number + 1}")
+
+    elapsed = await rush(bot, coalesced)
+    task.cancel()
+    while digest.pending():
+        await asyncio.sleep(1.0)
+        await digest.flush(bot)
+    print(f"   сводки: {elapsed:5.2f} с, доставлено {bot.delivered:5}, 429: {bot.rejected:5}, "
+          f"событий в сводках: {digest.stats['events']}")
+
+asyncio.run(bench())
@@ -0,0 +1,61 @@
+"""Замер: реестр розыгрышей — загрузка, вытеснение и память"""
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import database
+from events import EventCatalog, EventRegistry
+
+events_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+per_event = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+logging.disable(logging.INFO)
+
+async def bench(max_loaded):
+    directory = tempfile.mkdtemp()
+    catalog = EventCatalog(os.path.join(directory, 'catalog.db'))
+    registry = EventRegistry(
+        catalog,
+        lambda event_id: database.CachedDatabase(database.SantaDatabase(os.path.join(directory, f'{event_id}.db'))),
+        max_loaded=max_loaded, min_idle=0
+    )
+    tracemalloc.start()
+
+    started = time.perf_counter()
+    for number in range(events_count):
+        event = await registry.create(f"Команда {number}", organizer=10**9 + number)
+        for user_id in range(number * per_event, (number + 1) * per_event):
+            await registry.join(user_id, event.id)
+            await event.db.register(user_id, f"user{user_id}", f"Участник {user_id}", "книга", None)
+        await event.db.distribute_gifts()
+    setup = time.perf_counter() - started
+
+    # Случайные обращения участников: событие пользователя + карточка получателя
+    latencies = []
+    users = events_count * per_event
+    for _ in range(10_000):
+        user_id = random.randrange(users)
+        started = time.perf_counter()
+        event = await registry.for_user(user_id)
+        assert await event.db.get_receiver_for_giver(user_id)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"max_loaded={max_loaded:>5}: заполнение {setup:5.1f} сек, "
+          f"в памяти {len(registry.loaded)} событий, загрузок {registry.loads}, выгрузок {registry.evictions}, "
+          f"p50 {latencies[len(latencies) // 2] * 1e3:.2f} мс, p99 {latencies[len(latencies) * 99 // 100] * 1e3:.2f} мс, "
+          f"память {current / 2**20:.1f} МБ (пик {peak / 2**20:.1f} МБ)")
+    registry.close()
+
+async def main():
+    print(f"Benchmark: {events_count} событий × {per_event} участников в одном процессе")
+    for max_loaded in (events_count, 100):
+        await bench(max_loaded)
+
+asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Замер: MemoryDatabase с журналом против SQLite"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from database import MemoryDatabase
+from journal import SYNC_INTERVAL, Journal
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+logging.disable(logging.INFO)
+
+with tempfile.TemporaryDirectory() as directory:
+    print(f"Benchmark: журнал MemoryDatabase, {count} участников")
+
+    for label, sync_interval in (("fsync на запись", 0), ("групповой fsync", SYNC_INTERVAL)):
+        base = os.path.join(directory, f'append{sync_interval}')
+        db = MemoryDatabase()
+        db.attach_journal(Journal(base, sync_interval=sync_interval, snapshot_every=10**9))
+        appends = 2000 if sync_interval == 0 else count
+        started = time.perf_counter()
+        for user_id in range(appends):
+            db.register(user_id, f"user{user_id}", f"Участник {user_id}", "книга", None)
+        db.flush()
+        elapsed = time.perf_counter() - started
+        print(f"{label:>16}: {appends / elapsed:8.0f} регистраций/с, fsync: {db.journal.syncs}")
+        db.close()
+
+    # Снимок после регистрации и распределения, затем хвост журнала
+    base = os.path.join(directory, 'event')
+    db = MemoryDatabase()
+    db.attach_journal(Journal(base, snapshot_every=count))
+    for user_id in range(count):
+        db.register(10**9 + user_id, f"user{user_id}", f"Участник {user_id}", random.choice(["книга", None]), None)
+    db.distribute_gifts()
+    started = time.perf_counter()
+    db.flush()
+    print(f"снимок: {time.perf_counter() - started:.3f} с, {os.path.getsize(base + '.snapshot') / 2**20:.1f} МБ")
+    tail = count // 10
+    for user_id in range(tail):
+        db.mark_as_notified(10**9 + user_id)
+    expected = (db.get_stats(), db.get_pairs())
+    # Как при падении: close записал бы снимок
+    db.journal.close()
+
+    started = time.perf_counter()
+    restored = MemoryDatabase()
+    restored.attach_journal(Journal(base))
+    elapsed = time.perf_counter() - started
+    assert (restored.get_stats(), restored.get_pairs()) == expected
+    assert restored.check_stats() == {}
+    print(f"восстановление: {elapsed:.3f} с (снимок {count} участников + {tail} записей журнала)")
+    restored.close()
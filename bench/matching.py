@@ -0,0 +1,74 @@
+"""Замер: движки распределения пар и распределение с ограничениями"""
+import random
+import sys
+import time
+
+from matching import Constraints, UnsatisfiableError, constrained_cycle, random_cycle, random_derangement
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+participants = range(10**9, 10**9 + count)
+
+for name, engine in (("random_cycle", random_cycle), ("random_derangement", random_derangement)):
+    started = time.perf_counter()
+    assignment = engine(participants)
+    elapsed = time.perf_counter() - started
+    assert len(assignment) == count
+    assert all(giver != receiver for giver, receiver in assignment.giver_to_receiver.items())
+    assert len(assignment.receiver_to_giver) == count
+    print(f"{name}: {count} участников за {elapsed * 1000:.0f} мс")
+
+# Распределение с ограничениями на 10k участников
+size = 10_000
+people = list(range(size))
+
+def sparse():
+    constraints = Constraints()
+    for user_id in people:
+        for other in random.sample(people, 5):
+            if other != user_id:
+                constraints.exclude(user_id, other)
+    return constraints
+
+def dense_teams():
+    # 4 команды по 2500 и ещё 200 личных исключений у каждого: запрещено ~27% пар
+    constraints = sparse()
+    for user_id in people:
+        constraints.set_group(user_id, user_id % 4)
+        for other in random.sample(people, 200):
+            if other != user_id:
+                constraints.exclude(user_id, other, mutual=False)
+    return constraints
+
+def two_halves():
+    # Две команды по половине: каждому запрещена половина участников
+    constraints = Constraints()
+    for user_id in people:
+        constraints.set_group(user_id, user_id % 2)
+    return constraints
+
+def oversized_team():
+    constraints = two_halves()
+    constraints.set_group(1, 0)
+    return constraints
+
+def isolated():
+    # Одному участнику запрещены все получатели
+    constraints = sparse()
+    for other in people:
+        constraints.exclude(0, other, mutual=False)
+    return constraints
+
+for name, build in (("sparse", sparse), ("dense_teams", dense_teams), ("two_halves", two_halves),
+                    ("oversized_team", oversized_team), ("isolated", isolated)):
+    constraints = build()
+    started = time.perf_counter()
+    try:
+        assignment = constrained_cycle(people, constraints)
+    except UnsatisfiableError as e:
+        result = f"невыполнимо ({e})"
+    else:
+        assert all(constraints.allows(g, r) for g, r in assignment.giver_to_receiver.items())
+        assert len(assignment.receiver_to_giver) == size
+        result = f"циклов: {len(assignment.cycles())}"
+    elapsed = time.perf_counter() - started
+    print(f"constrained_cycle/{name}: {size} участников за {elapsed * 1000:.0f} мс, {result}")
@@ -0,0 +1,19 @@
+"""Замер: стоимость Histogram.observe и точность квантилей по корзинам"""
+import random
+import time
+
+from metrics import Histogram
+
+count = 1_000_000
+histogram = Histogram('bench_seconds', 'benchmark', ('route',))
+values = [random.expovariate(100) for _ in range(1000)]
+
+started = time.perf_counter()
+for index in range(count):
+    histogram.observe(values[index % 1000], 'route')
+elapsed = time.perf_counter() - started
+print(f"Histogram.observe: {elapsed / count * 1e9:.0f} нс на наблюдение")
+
+values.sort()
+print(f"p50: точно {values[500] * 1000:.2f} мс, по корзинам {histogram.quantile(0.5, 'route') * 1000:.2f} мс")
+print(f"p99: точно {values[990] * 1000:.2f} мс, по корзинам {histogram.quantile(0.99, 'route') * 1000:.2f} мс")
@@ -0,0 +1,54 @@
+"""Замер: ответы пользователям во время рассылки с приоритетами OutboundQueue и без"""
+import asyncio
+import random
+import sys
+import time
+
+from broadcast import GLOBAL_RATE
+from metrics import percentile
+from outbound import BULK, INTERACTIVE, OutboundQueue
+
+bulk_count = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+replies = 100
+latency = 0.02  # заглушка Bot API: время ответа сервера
+
+async def scenario(prioritized):
+    queue = OutboundQueue(rate=GLOBAL_RATE)
+
+    async def call(priority, chat_id):
+        # Без приоритетов все запросы идут одним классом, по порядку прихода
+        async with queue.slot(priority if prioritized else BULK, chat_id):
+            await asyncio.sleep(latency)
+
+    async def broadcast():
+        # Восемь воркеров рассылки, как в BroadcastEngine
+        chats = iter(range(10**6, 10**6 + bulk_count))
+
+        async def worker():
+            for chat_id in chats:
+                await call(BULK, chat_id)
+
+        await asyncio.gather(*(worker() for _ in range(8)))
+
+    async def user(chat_id, delay):
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        await call(INTERACTIVE, chat_id)
+        return time.perf_counter() - started
+
+    sender = asyncio.create_task(broadcast())
+    # Ответы пользователям во время рассылки: около 5 в секунду
+    waits = sorted(await asyncio.gather(*(user(chat_id, random.uniform(1, 1 + replies / 5))
+                                          for chat_id in range(replies))))
+    await sender
+    return waits
+
+async def bench():
+    print(f"Benchmark: рассылка {bulk_count} сообщений и {replies} ответов пользователям, "
+          f"лимит {GLOBAL_RATE}/с, Bot API — заглушка {latency * 1000:.0f} мс")
+    for label, prioritized in (("одна очередь", False), ("приоритеты", True)):
+        waits = await scenario(prioritized)
+        print(f"{label:>13}: ответ пользователю p50 {percentile(waits, 50) * 1000:6.0f} мс, "
+              f"p99 {percentile(waits, 99) * 1000:6.0f} мс")
+
+asyncio.run(bench())
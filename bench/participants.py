@@ -0,0 +1,67 @@
+"""Замер: ParticipantStore — заполнение, поиск и память"""
+import random
+import sys
+import time
+import tracemalloc
+
+from participants import ParticipantStore
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+wishes = ["книга", "носки", "нет", "-", None]
+people = [
+    (10**9 + number, f"user{number}", f"Сотрудник Номер {number}",
+     random.choice(wishes), random.choice(wishes))
+    for number in range(count)
+]
+order = [user_id for user_id, *_ in people]
+random.shuffle(order)
+assignment = dict(zip(order, order[1:] + order[:1]))
+
+def dict_layout():
+    # Прежняя раскладка SantaDatabase: словарь словарей и две карты пар
+    participants = {}
+    for user_id, username, full_name, wish, not_wish in people:
+        participants[user_id] = {
+            'name': full_name, 'wish': wish, 'not_wish': not_wish, 'username': username,
+            'has_receiver': False, 'is_giver': False, 'notified': False
+        }
+    pairs = dict(assignment)
+    givers = {receiver: giver for giver, receiver in pairs.items()}
+    for user_id, data in participants.items():
+        data['has_receiver'] = user_id in givers
+        data['is_giver'] = user_id in pairs
+    return participants, pairs, givers
+
+def compact_layout():
+    store = ParticipantStore()
+    for user_id, username, full_name, wish, not_wish in people:
+        store.put(user_id, username, full_name, wish, not_wish)
+    store.assign(assignment)
+    return store
+
+print(f"Benchmark: {count} участников после распределения (строки анкет не считаются)")
+strings = sum(sys.getsizeof(value) for person in people for value in person[1:3])
+for label, build in (("словари", dict_layout), ("компактно", compact_layout)):
+    tracemalloc.start()
+    layout = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Строки уже созданы в people, tracemalloc их не видит, кроме копий
+    print(f"{label:>10}: {size / 2**20:6.1f} МБ, пик {peak / 2**20:6.1f} МБ, "
+          f"{size / count:5.0f} байт на участника")
+    del layout
+print(f"   строки ФИО и username: {strings / 2**20:.1f} МБ (общие для обеих раскладок)")
+
+store = compact_layout()
+participants, pairs, _ = dict_layout()
+lookups = order[:10_000]
+for label, lookup in (
+    ("словари", lambda giver_id: participants[pairs[giver_id]]['name']),
+    ("компактно", lambda giver_id: store.profile(store.receiver_of(giver_id))[0]),
+):
+    started = time.perf_counter()
+    for _ in range(10):
+        for giver_id in lookups:
+            lookup(giver_id)
+    elapsed = (time.perf_counter() - started) / (10 * len(lookups))
+    print(f"{label:>10}: получатель дарителя за {elapsed * 1e9:.0f} нс")
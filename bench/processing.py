@@ -0,0 +1,40 @@
+"""Замер: UserOrderedUpdateProcessor против SimpleUpdateProcessor"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.ext import SimpleUpdateProcessor
+
+from processing import UserOrderedUpdateProcessor
+
+per_user = 5
+latency = 0.02  # время «ответа Telegram» в обработчике
+
+async def bench(processor, users):
+    seen = {}
+
+    async def handler(user_id, step):
+        await asyncio.sleep(latency)
+        seen.setdefault(user_id, []).append(step)
+
+    started = time.perf_counter()
+    tasks = []
+    for step in range(per_user):
+        for user_id in range(users):
+            update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+            tasks.append(asyncio.create_task(processor.process_update(update, handler(user_id, step))))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    ordered = all(steps == list(range(per_user)) for steps in seen.values())
+    return users * per_user / elapsed, ordered
+
+async def main():
+    print(f"Benchmark: {per_user} обновлений на пользователя, обработчик {latency * 1000:.0f} мс")
+    for users in (1, 10, 100, 500):
+        sequential, _ = await bench(SimpleUpdateProcessor(1), users)
+        concurrent, ordered = await bench(UserOrderedUpdateProcessor(32), users)
+        print(f"{users:>5} пользователей: последовательно {sequential:7.0f}/сек, "
+              f"параллельно {concurrent:7.0f}/сек, порядок сохранён: {ordered}")
+
+asyncio.run(main())
@@ -0,0 +1,111 @@
+"""Замер: анонимная переписка напрямую и через AnonymousRelay"""
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from telegram.error import TelegramError
+
+from broadcast import FakeBot
+from metrics import percentile
+from outbound import OutboundQueue
+from participants import ParticipantStore
+from relay import AnonymousRelay, RelayOutbox
+
+conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+per_user = 3
+rate = 500  # лимит поднят, чтобы замер шёл секунды, а не минуты
+logging.disable(logging.WARNING)
+
+class QueuedBot:
+    """FakeBot за OutboundQueue — как запросы бота через OutboundRequest"""
+
+    def __init__(self, bot, queue):
+        self.bot = bot
+        self.queue = queue
+
+    async def send_message(self, chat_id, text, **kwargs):
+        async with self.queue.slot(chat_id=chat_id):
+            return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+
+# Участники розыгрыша и пары: кольцо из conversations человек
+store = ParticipantStore()
+users = list(range(10**9, 10**9 + conversations))
+for user_id in users:
+    store.put(user_id, None, f"Участник {user_id}", None, None)
+store.assign({giver: users[(number + 1) % len(users)] for number, giver in enumerate(users)})
+
+started = time.perf_counter()
+for user_id in users * 10:
+    store.receiver_of(user_id)
+    store.giver_of(user_id)
+lookup = (time.perf_counter() - started) / (len(users) * 20)
+
+async def chatter(send):
+    # Каждый участник за пару секунд пишет per_user сообщений получателю или Санте
+    async def user(user_id):
+        for _ in range(per_user):
+            await asyncio.sleep(random.uniform(0, 2))
+            target = store.receiver_of(user_id) if random.random() < 0.5 else store.giver_of(user_id)
+            await send(target, f"🎅 Анонимное сообщение от {user_id}")
+
+    await asyncio.gather(*(user(user_id) for user_id in users))
+
+async def bench():
+    total = conversations * per_user
+    print(f"Benchmark: {conversations} пар переписываются, {total} сообщений, "
+          f"лимит {rate}/с и 1/с на чат; поиск пары {lookup * 1e9:.0f} нс")
+
+    bot = FakeBot(latency=0.02, global_limit=rate, chat_interval=1.0)
+    queued = QueuedBot(bot, OutboundQueue(rate))
+
+    async def direct(chat_id, text):
+        # Без очереди: отправка из обработчика, 429 — сообщение потеряно
+        try:
+            await queued.send_message(chat_id=chat_id, text=text)
+        except TelegramError:
+            pass
+
+    started = time.perf_counter()
+    await chatter(direct)
+    elapsed = time.perf_counter() - started
+    print(f" напрямую: {elapsed:5.2f} с, доставлено {bot.delivered:5} из {total}, "
+          f"потеряно на 429: {bot.rejected:5}")
+
+    path = os.path.join(tempfile.mkdtemp(), 'relay.db')
+    relay = AnonymousRelay(RelayOutbox(path))
+    bot = FakeBot(latency=0.02, global_limit=rate, chat_interval=1.0)
+    task = asyncio.create_task(relay.run(QueuedBot(bot, OutboundQueue(rate))))
+    accepted = []
+
+    async def relayed(chat_id, text):
+        began = time.perf_counter()
+        await relay.add(chat_id, text)
+        accepted.append(time.perf_counter() - began)
+
+    started = time.perf_counter()
+    await chatter(relayed)
+    while relay.pending():
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    left = len(relay.outbox.pending())
+    relay.close()
+    accepted.sort()
+    print(f"  очередь: {elapsed:5.2f} с, доставлено {relay.stats['delivered']:5} из {total} "
+          f"в {relay.stats['sent']} сообщениях, 429: {bot.rejected}, в outbox осталось {left}; "
+          f"приём p50 {percentile(accepted, 50) * 1e6:.0f} мкс, p99 {percentile(accepted, 99) * 1e6:.0f} мкс")
+
+    # Перезапуск: принятое, но не доставленное поднимается из outbox
+    relay = AnonymousRelay(RelayOutbox(path))
+    for user_id in users[:100]:
+        await relay.add(user_id, "🎁 Сообщение до перезапуска")
+    relay.close()
+    relay = AnonymousRelay(RelayOutbox(path))
+    print(f"  после перезапуска в очереди: {relay.pending()} из 100")
+    relay.close()
+
+asyncio.run(bench())
@@ -0,0 +1,64 @@
+"""Замер: холодный старт — импорт bot и ответы на накопившиеся обновления"""
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from replay import replay_pending
+
+# Корень репозитория: bot импортируется оттуда
+directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+environment = dict(os.environ, STORAGE='memory')
+
+def run(code):
+    return subprocess.run([sys.executable, *code], cwd=directory, env=environment,
+                          capture_output=True, text=True, check=True)
+
+# 1. Импорт: самые тяжёлые модули первого уровня по -X importtime
+profile = run(['-X', 'importtime', '-c', 'import bot']).stderr
+modules = []
+for line in profile.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+        continue
+    _, cumulative, name = line.split('|')
+    # Отступ имени — глубина импорта: два пробела на уровень
+    if name.startswith('   ') and not name.startswith('    '):
+        modules.append((int(cumulative), name.strip()))
+print("Benchmark: холодный старт (STORAGE=memory)")
+print("  импорт bot, первый уровень, мс:")
+for cumulative, name in sorted(modules, reverse=True)[:8]:
+    print(f"    {name:>16}: {cumulative / 1000:7.1f}")
+timings = sorted(float(run(['-c', 'import time; t = time.perf_counter(); import bot; '
+                                  'print(time.perf_counter() - t)']).stdout) for _ in range(3))
+print(f"  import bot: медиана {timings[1] * 1000:.0f} мс (из трёх запусков)")
+
+# 2. Подъём приложения и ответы на обновления, накопившиеся за время простоя
+async def restart(pending):
+    from loadtest import TOKEN, FakeBotApi, synthetic_update
+    import bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    api = FakeBotApi()
+    await api.start()
+    for update_id in range(1, pending + 1):
+        # Каждый второй пользователь за время простоя дважды нажал /start
+        api.push_update(synthetic_update(update_id, 10_000 + update_id // 2, '/start'))
+    started = time.perf_counter()
+    application = bot.build_application(TOKEN, base_url=api.base_url)
+    await application.initialize()
+    await application.start()
+    ready = time.perf_counter() - started
+    report = await replay_pending(application)
+    await api.wait_for_replies(report['replayed'])
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+    await api.stop()
+    return ready, elapsed, report
+
+ready, elapsed, report = asyncio.run(restart(400))
+print(f"  приложение готово: {ready * 1000:.0f} мс; накопилось {report['received']} обновлений, "
+      f"обработано {report['replayed']} (повторов {report['duplicates']}), "
+      f"последний ответ через {elapsed * 1000:.0f} мс")
@@ -0,0 +1,50 @@
+"""Замер: импорт и выгрузка списка участников, SQLite"""
+import asyncio
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import database
+from database import AsyncStorage
+from roster import export_roster, import_roster
+
+total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+logging.disable(logging.INFO)
+
+async def bench(directory):
+    db = AsyncStorage(database.SantaDatabase(os.path.join(directory, 'bench.db')))
+    print("Benchmark: импорт и выгрузка, SQLite")
+    for count in (total // 10, total):
+        await db.reset_all()
+        source = os.path.join(directory, f'roster{count}.csv')
+        with open(source, 'w', encoding='utf-8', newline='') as stream:
+            writer = csv.writer(stream)
+            writer.writerow(('user_id', 'username', 'full_name', 'wish', 'not_wish'))
+            for number in range(count):
+                writer.writerow((10**9 + number, f"user{number}", f"Сотрудник Номер {number}", "книга", ""))
+            writer.writerow(("не число", "", "Ошибка В Строке", "", ""))
+
+        for label, work in (
+            ("импорт", lambda: import_roster(db, source)),
+            ("выгрузка", lambda: export_roster(db, os.path.join(directory, f'export{count}.jsonl'))),
+        ):
+            tracemalloc.start()
+            started = time.perf_counter()
+            result = await work()
+            elapsed = time.perf_counter() - started
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rows = result['imported'] if isinstance(result, dict) else result
+            # Пик сверх того, что осталось в хранилище (счётчики), — память самого конвейера
+            print(f"{count:>7} строк, {label:>8}: {elapsed:6.2f} с, {rows / elapsed:7.0f} строк/с, "
+                  f"пик конвейера {(peak - retained) / 2**20:5.2f} МБ")
+        if count == total:
+            assert rows == count
+    db.close()
+
+with tempfile.TemporaryDirectory() as directory:
+    asyncio.run(bench(directory))
@@ -0,0 +1,42 @@
+"""Замер: Router против цепочки if по тексту кнопки"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from router import Router
+
+buttons = [f"Кнопка {number}" for number in range(1000)]
+
+async def noop(update, context):
+    pass
+
+async def is_admin(update):
+    return True
+
+async def main():
+    router = Router(is_admin, fallback=noop)
+    for label in buttons:
+        router.add(label, noop)
+
+    # Та же таблица, но перебором, как в цепочке if/elif
+    async def chain(update, context):
+        for label in buttons:
+            if update.message.text == label:
+                await noop(update, context)
+                return
+        await noop(update, context)
+
+    context = SimpleNamespace(user_data={})
+    for count in (10, 100, 1000):
+        updates = [SimpleNamespace(message=SimpleNamespace(text=buttons[count - 1]))] * 20_000
+        for label, handler in (("if/elif", chain), ("таблица", router.dispatch)):
+            started = time.perf_counter()
+            for update in updates:
+                await handler(update, context)
+            elapsed = (time.perf_counter() - started) / len(updates)
+            print(f"{count:>5}-я кнопка, {label:>8}: {elapsed * 1e6:6.2f} мкс на сообщение")
+
+    for name, summary in router.report():
+        print(f"{name}: {summary['count']} вызовов, p50 {summary['p50'] * 1e6:.1f} мкс")
+
+asyncio.run(main())
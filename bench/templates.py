@@ -0,0 +1,38 @@
+"""Замер: CardCache против сборки карточки заново"""
+import time
+
+from templates import GIFT_CARD, CardCache
+
+count = 100_000
+receivers = [(user_id, f"Участник {user_id}", "книга" if user_id % 2 else None, "носки" if user_id % 3 else None)
+             for user_id in range(1000)]
+
+def concatenate(receiver_id, name, wish, not_wish):
+    # Прежняя сборка строки в send_gift_info
+    response = f"🎅 **Твой Тайный Санта назначен!** 🎅\n\n"
+    response += f"👤 **Ты даришь подарок:** {name}\n"
+    if wish:
+        response += f"\n✅ **Что хочет получить:**\n{wish}\n"
+    if not_wish:
+        response += f"\n❌ **Что НЕ хочет получать:**\n{not_wish}\n"
+    response += "\n⚠️ **Важно:**\n"
+    response += "• Этот выбор окончательный\n"
+    response += "• Изменить получателя нельзя\n"
+    response += "• Сохраните это сообщение\n\n"
+    response += "🎄 **Счастливого Нового года!** 🎄"
+    return response
+
+def compiled(receiver_id, name, wish, not_wish):
+    return GIFT_CARD.render(name, wish, not_wish)
+
+cache = CardCache()
+for receiver in receivers:
+    assert concatenate(*receiver) == compiled(*receiver) == cache.render(*receiver)
+
+print(f"Benchmark: {count} карточек для {len(receivers)} получателей")
+for label, render in (("конкатенация", concatenate), ("шаблон", compiled), ("кэш", cache.render)):
+    started = time.perf_counter()
+    for index in range(count):
+        render(*receivers[index % len(receivers)])
+    elapsed = time.perf_counter() - started
+    print(f"{label:>12}: {elapsed / count * 1e9:5.0f} нс на карточку")
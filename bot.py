@@ -1,15 +1,58 @@
+import functools
+import hashlib
 import logging
 import os
 import sys
-import random
+import tempfile
 import asyncio
 from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import Conflict
+from telegram.ext import (Application, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler,
+                          filters, ContextTypes)
+from telegram.error import BadRequest, Conflict, TelegramError
+
+import database
+from broadcast import GLOBAL_RATE, JOB_STATE_PATH, BroadcastJob
+from cluster import CATALOG_SCOPE, MemoryStore, SqliteStore, UpdateFanout, WorkerPool, hold_lease, receive
+from database import CachedDatabase, MemoryDatabase
+from digest import AdminDigest
+from events import DEFAULT_EVENT, EventCatalog, EventRegistry
+from journal import Journal
+import metrics
+from metrics import InstrumentedRequest
+from outbound import OutboundQueue, OutboundRequest
+from processing import UserOrderedUpdateProcessor
+from relay import RELAY_MAX_LENGTH, AnonymousRelay, RelayOutbox
+from replay import replay_pending
+from roster import export_roster, format_report, import_roster, roster_format
+from router import ANY_TEXT, Router, set_state
+from matching import UnsatisfiableError
 
 # Токен
 TOKEN = os.environ.get('BOT_TOKEN') or '7910806794:AAEJUGA9xhGuWnFUnGukfHSLP71JNSFfqX8'
 
+# Режим приёма обновлений: webhook (если задан публичный адрес WEBHOOK_URL) или polling
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+BOT_MODE = os.environ.get('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling')
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+PORT = int(os.environ.get('PORT', '8080'))
+# Если задан — /metrics отдаётся только с заголовком Authorization: Bearer <METRICS_TOKEN>,
+# иначе только запросам с localhost
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Сколько обновлений разных пользователей обрабатывать одновременно
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', '32'))
+
+# Сколько запросов к Bot API в секунду пропускает очередь исходящих (на весь бот)
+OUTBOUND_RATE = float(os.environ.get('OUTBOUND_RATE', GLOBAL_RATE))
+
+# Telegram отдаёт ботам файлы не больше 20 МБ (импорт участников)
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+
+# Параметры long polling
+POLL_TIMEOUT = 30
+POLL_INTERVAL = 1.0
+
 # ID администратора (ВАШ ID из Telegram)
 ADMIN_ID = 5763705344 # Замените на ваш настоящий ID
 
@@ -21,184 +64,157 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class SantaDatabase:
-    def __init__(self):
-        self.participants = {}  # user_id -> данные
-        self.pairs = {}  # giver_id -> receiver_id
-        self.distribution_done = False  # Распределение выполнено?
-    
-    def register(self, user_id, username, full_name, wish=None, not_wish=None):
-        self.participants[user_id] = {
-            'name': full_name,
-            'wish': wish,
-            'not_wish': not_wish,
-            'username': username,
-            'has_receiver': False,
-            'is_giver': False,
-            'notified': False  # Получил ли уведомление о получателе
-        }
-        logger.info(f"Registered: {full_name}")
-        return True
-    
-    def is_registered(self, user_id):
-        return user_id in self.participants
-    
-    def get_info(self, user_id):
-        if user_id in self.participants:
-            p = self.participants[user_id]
-            return (p['name'], p['wish'], p['not_wish'])
-        return None
+# Хранилище: у каждого розыгрыша свой SQLite-файл (переживает редеплой,
+# на Railway — пути на volume): розыгрыш по умолчанию — DATABASE_PATH,
+# остальные и каталог розыгрышей — в EVENTS_DIR.
+# STORAGE=memory — хранение только в памяти; STORAGE=journal — в памяти,
+# с журналом изменений и снимками в EVENTS_DIR (без запроса к базе на действие)
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'santa.db')
+EVENTS_DIR = os.environ.get('EVENTS_DIR', 'events')
+CACHE_FLUSH_INTERVAL = float(os.environ.get('CACHE_FLUSH_INTERVAL', '2'))
+
+# WORKERS=N — процесс приёма раздаёт обновления N рабочим процессам по
+# user_id; состояние общее — базы SQLite в EVENTS_DIR (только STORAGE=sqlite)
+WORKERS = int(os.environ.get('WORKERS', '0'))
+
+def open_event_storage(event_id):
+    """Хранилище розыгрыша (открывается при первом обращении к нему)"""
+    path = DATABASE_PATH if event_id == DEFAULT_EVENT else os.path.join(EVENTS_DIR, f'{event_id}.db')
+    if WORKERS:
+        # Кэш записи в памяти одного процесса не виден остальным
+        return database.SantaDatabase(path, shared=True)
+    return CachedDatabase(database.SantaDatabase(path), flush_interval=CACHE_FLUSH_INTERVAL)
+
+def open_journaled_storage(event_id):
+    """Розыгрыш в памяти, восстановленный из снимка и журнала в EVENTS_DIR"""
+    db = MemoryDatabase()
+    db.attach_journal(Journal(os.path.join(EVENTS_DIR, event_id)))
+    return db
+
+def broadcast_state_path(event_id):
+    """Файл состояния фоновой рассылки розыгрыша"""
+    if event_id == DEFAULT_EVENT:
+        return JOB_STATE_PATH
+    root, ext = os.path.splitext(JOB_STATE_PATH)
+    return f'{root}.{event_id}{ext}'
+
+def relay_outbox_path():
+    """Файл недоставленных анонимных сообщений: у каждого процесса свой"""
+    if os.environ.get('STORAGE') == 'memory':
+        return ':memory:'
+    # Перезапущенный рабочий процесс получает тот же WORKER_ID и дошлёт своё
+    worker = os.environ.get('WORKER_ID', '').rpartition(':')[2]
+    return os.path.join(EVENTS_DIR, f'relay.{worker}.db' if worker else 'relay.db')
+
+# Состояние процесса: розыгрыши (events), блокировки распределения и рассылки
+# (locks) и анонимная переписка Санты и получателя (relay). Открывается
+# в open_storage при сборке приложения, а не при импорте: import bot
+# (утилиты, бенчмарки) не создаёт файлов
+events = None
+locks = None
+relay = None
+
+def open_storage():
+    """Открыть розыгрыши, блокировки и outbox анонимных сообщений (один раз на процесс)"""
+    global events, locks, relay
+    if events is not None:
+        return
     
-    def can_distribute(self):
-        """Можно ли выполнить распределение?"""
-        return len(self.participants) >= 2 and not self.distribution_done
+    if os.environ.get('STORAGE') == 'memory':
+        events = EventRegistry(EventCatalog(':memory:'), lambda event_id: MemoryDatabase(), persistent=False)
+    else:
+        os.makedirs(EVENTS_DIR, exist_ok=True)
+        open_backend = open_journaled_storage if os.environ.get('STORAGE') == 'journal' else open_event_storage
+        cluster_store = SqliteStore(os.path.join(EVENTS_DIR, 'cluster.db')) if WORKERS else None
+        events = EventRegistry(EventCatalog(os.path.join(EVENTS_DIR, 'catalog.db')), open_backend, store=cluster_store)
     
-    def distribute_gifts(self):
-        """Распределить подарки между всеми участниками"""
-        if self.distribution_done:
-            return False
-        
-        participants_list = list(self.participants.keys())
-        
-        if len(participants_list) < 2:
-            return False
-        
-        # Создаём случайную циклическую цепочку
-        shuffled = participants_list.copy()
-        
-        # Пытаемся создать хорошую цепочку (избегаем коротких циклов)
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            random.shuffle(shuffled)
-            
-            # Проверяем что никто не дарит сам себе
-            valid = True
-            for i in range(len(shuffled)):
-                if shuffled[i] == participants_list[i]:
-                    valid = False
-                    break
-            
-            if valid:
-                break
-        
-        # Создаём пары: каждый дарит следующему в списке
-        self.pairs.clear()
-        for i in range(len(shuffled)):
-            giver = shuffled[i]
-            receiver = shuffled[(i + 1) % len(shuffled)]  # Замыкаем цикл
-            self.pairs[giver] = receiver
-        
-        # Обновляем статусы
-        for user_id in self.participants:
-            self.participants[user_id]['has_receiver'] = user_id in self.pairs.values()
-            self.participants[user_id]['is_giver'] = user_id in self.pairs
-            self.participants[user_id]['notified'] = False
-        
-        self.distribution_done = True
-        logger.info(f"Распределение выполнено для {len(participants_list)} участников")
-        return True
-    
-    def get_receiver_for_giver(self, giver_id):
-        """Получить получателя для дарителя"""
-        if giver_id not in self.pairs:
-            return None
-        
-        receiver_id = self.pairs[giver_id]
-        receiver = self.participants.get(receiver_id)
-        
-        if not receiver:
-            return None
-        
-        return (receiver_id, receiver['name'], receiver['wish'], receiver['not_wish'])
-    
-    def mark_as_notified(self, user_id):
-        """Пометить что пользователь получил уведомление"""
-        if user_id in self.participants:
-            self.participants[user_id]['notified'] = True
-    
-    def is_notified(self, user_id):
-        """Проверил ли пользователь своего получателя?"""
-        return self.participants.get(user_id, {}).get('notified', False)
-    
-    def reset_all(self):
-        """Полный сброс"""
-        self.participants.clear()
-        self.pairs.clear()
-        self.distribution_done = False
-        logger.info("Все данные сброшены")
-        return True
-    
-    def get_all(self):
-        return self.participants
-    
-    def get_stats(self):
-        total = len(self.participants)
-        notified = sum(1 for p in self.participants.values() if p['notified'])
-        
-        return {
-            'total': total,
-            'distributed': self.distribution_done,
-            'notified': notified,
-            'remaining': total - notified
-        }
-    
-    def get_pair_info(self, giver_id):
-        """Полная информация о паре (для администратора)"""
-        if giver_id not in self.pairs:
-            return None
-        
-        receiver_id = self.pairs[giver_id]
-        giver = self.participants.get(giver_id)
-        receiver = self.participants.get(receiver_id)
-        
-        if not giver or not receiver:
-            return None
-        
-        return {
-            'giver_name': giver['name'],
-            'giver_username': giver['username'],
-            'receiver_name': receiver['name'],
-            'receiver_wish': receiver['wish'],
-            'receiver_not_wish': receiver['not_wish'],
-            'notified': giver['notified']
-        }
+    # Блокировки общие для рабочих процессов или в памяти
+    locks = events.store or MemoryStore()
+    
+    # Розыгрыш по умолчанию — для тех, кто пришёл без приглашения; его организатор — ADMIN_ID
+    events.catalog.add(DEFAULT_EVENT, "Тайный Санта", organizer=ADMIN_ID)
+    
+    # Анонимные сообщения пишутся в outbox и уходят пачками
+    relay = AnonymousRelay(RelayOutbox(relay_outbox_path()))
 
-# Создаём базу данных
-db = SantaDatabase()
+def close_storage():
+    """Записать накопленное и закрыть всё, что открыл open_storage"""
+    global events, locks, relay
+    if events is None:
+        return
+    relay.close()
+    events.close()
+    locks.close()
+    events = locks = relay = None
 
-# Состояния для регистрации
-(WAITING_FOR_NAME, WAITING_FOR_WISH, WAITING_FOR_NOT_WISH) = range(3)
+# Все исходящие запросы: ответы пользователям, сводки, рассылка — по приоритетам.
+# Рабочие процессы делят лимит поровну
+send_queue = OutboundQueue(OUTBOUND_RATE / max(WORKERS, 1))
+
+# Состояния диалога: шаги регистрации, подтверждения админа и анонимное сообщение
+(WAITING_FOR_NAME, WAITING_FOR_WISH, WAITING_FOR_NOT_WISH,
+ CONFIRM_DISTRIBUTION, CONFIRM_RESET, WAITING_FOR_RELAY) = range(6)
 
 # ========== ОСНОВНЫЕ ФУНКЦИИ ==========
 
-def is_admin(user_id):
-    """Проверка, является ли пользователь администратором"""
-    return user_id == ADMIN_ID
+async def current_event(update: Update):
+    """Розыгрыш, в котором сейчас участвует пользователь"""
+    return await events.for_user(update.effective_user.id)
+
+def invite_link(bot, event):
+    """Ссылка-приглашение в розыгрыш"""
+    return f"https://t.me/{bot.username}?start={event.id}"
+
+async def is_organizer(update: Update):
+    """Организатор ли отправитель в своём текущем розыгрыше?"""
+    event = await current_event(update)
+    return event.is_organizer(update.effective_user.id)
+
+# Текстовые сообщения: таблица кнопок и шагов диалога (маршруты — в конце файла)
+router = Router(is_admin=is_organizer, scope=lambda: events.pinning())
+
+# События для организаторов (регистрации, просмотры получателей) уходят сводками,
+# чтобы в наплыв регистраций не отнимать лимит Bot API у ответов участникам
+digest = AdminDigest()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начало работы с ботом"""
+    """Начало работы с ботом (/start <ID розыгрыша> — по приглашению)"""
     user = update.effective_user
     
-    if db.is_registered(user.id):
+    if context.args:
+        event = await events.get(context.args[0])
+        if event is None:
+            await update.message.reply_text("❌ Розыгрыш не найден. Проверьте ссылку-приглашение.")
+            return
+        await events.join(user.id, event.id)
+        # Незаконченная регистрация относилась к прежнему розыгрышу
+        context.user_data.clear()
+    else:
+        event = await current_event(update)
+    
+    if await event.db.is_registered(user.id):
         await show_user_menu(update, user.id)
     else:
         await update.message.reply_text(
             f"Привет, {user.first_name}! 🎅\n\n"
-            "Я бот для Новогоднего Тайного Санты.\n\n"
+            "Я бот для Новогоднего Тайного Санты.\n"
+            f"🎄 Розыгрыш: {event.title}\n\n"
             "📝 **Для регистрации напиши свое ФИО:**\n"
             "Пример: Иванов Иван Иванович"
         )
-        context.user_data['reg_step'] = WAITING_FOR_NAME
+        set_state(context, WAITING_FOR_NAME)
 
 async def show_user_menu(update: Update, user_id):
     """Показать меню для обычного пользователя"""
     keyboard = [
         ['📝 Моя анкета'],
-        ['🎁 Кому я дарю подарок?']
+        ['🎁 Кому я дарю подарок?'],
+        ['✉️ Написать получателю', '✉️ Написать Санте']
     ]
     
-    # Добавляем админские кнопки если пользователь - админ
-    if is_admin(user_id):
+    # Добавляем админские кнопки если пользователь - организатор
+    event = await current_event(update)
+    if event.is_organizer(user_id):
         keyboard.append(['👑 Админ панель'])
     
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -210,7 +226,9 @@ async def show_user_menu(update: Update, user_id):
 
 async def show_admin_menu(update: Update):
     """Показать админскую панель"""
-    stats = db.get_stats()
+    event = await current_event(update)
+    db = event.db
+    stats = await db.get_stats()
     
     keyboard = [
         ['📊 Статистика'],
@@ -224,248 +242,310 @@ async def show_admin_menu(update: Update):
     status_text = "⏳ Ожидание" if not db.distribution_done else "✅ Выполнено"
     
     await update.message.reply_text(
-        f"👑 **Админ панель** 👑\n\n"
+        f"👑 **Админ панель** 👑\n"
+        f"🎄 {event.title}\n\n"
         f"📈 Статистика:\n"
         f"• Участников: {stats['total']}\n"
         f"• Распределение: {status_text}\n"
-        f"• Получили уведомления: {stats['notified']}/{stats['total']}\n\n"
+        f"• Получили уведомления: {stats['notified']}/{stats['total']}\n"
+        f"• Регистраций за час: {stats['registrations_last_hour']}\n\n"
         f"Выберите действие:",
         reply_markup=reply_markup
     )
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка всех сообщений"""
+# ========== МАРШРУТЫ СООБЩЕНИЙ ==========
+
+async def registration_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Регистрация, шаг 1: ФИО"""
+    text = update.message.text
+    if len(text) < 5:
+        await update.message.reply_text("❌ Слишком короткое ФИО. Напишите полностью.")
+        return
+    
+    context.user_data['full_name'] = text
+    await update.message.reply_text(
+        "✨ Отлично! Теперь напиши, что бы ты хотел(а) получить в подарок:\n\n"
+        "(Можно написать 'нет' если не хочешь указывать)"
+    )
+    set_state(context, WAITING_FOR_WISH)
+
+async def registration_wish(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Регистрация, шаг 2: пожелания"""
+    text = update.message.text
+    context.user_data['wish'] = None if text.lower() == 'нет' else text
+    
+    await update.message.reply_text(
+        "📝 Теперь напиши, что точно НЕ хочешь получать:\n\n"
+        "(Можно написать 'нет' если не хочешь указывать)"
+    )
+    set_state(context, WAITING_FOR_NOT_WISH)
+
+async def registration_not_wish(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Регистрация, шаг 3: чего не дарить — и сохранение анкеты"""
     user = update.effective_user
     text = update.message.text
-    user_id = user.id
+    event = await current_event(update)
+    db = event.db
     
-    # Если пользователь в процессе регистрации
-    if 'reg_step' in context.user_data:
-        step = context.user_data['reg_step']
-        
-        if step == WAITING_FOR_NAME:
-            if len(text) < 5:
-                await update.message.reply_text("❌ Слишком короткое ФИО. Напишите полностью.")
-                return
-            
-            context.user_data['full_name'] = text
-            await update.message.reply_text(
-                "✨ Отлично! Теперь напиши, что бы ты хотел(а) получить в подарок:\n\n"
-                "(Можно написать 'нет' если не хочешь указывать)"
-            )
-            context.user_data['reg_step'] = WAITING_FOR_WISH
-            
-        elif step == WAITING_FOR_WISH:
-            wish = None if text.lower() == 'нет' else text
-            context.user_data['wish'] = wish
-            
-            await update.message.reply_text(
-                "📝 Теперь напиши, что точно НЕ хочешь получать:\n\n"
-                "(Можно написать 'нет' если не хочешь указывать)"
-            )
-            context.user_data['reg_step'] = WAITING_FOR_NOT_WISH
-            
-        elif step == WAITING_FOR_NOT_WISH:
-            not_wish = None if text.lower() == 'нет' else text
-            full_name = context.user_data['full_name']
-            wish = context.user_data.get('wish')
-            
-            # Сохраняем в базу
-            success = db.register(
-                user_id=user_id,
-                username=user.username,
-                full_name=full_name,
-                wish=wish,
-                not_wish=not_wish
-            )
-            
-            if success:
-                await update.message.reply_text(
-                    f"✅ **Регистрация завершена!** 🎉\n\n"
-                    f"Добро пожаловать, {full_name}!\n\n"
-                    "Теперь жди, когда организатор распределит подарки.\n"
-                    "Ты получишь сообщение, кому дарить подарок."
-                )
-                await show_user_menu(update, user_id)
-                context.user_data.clear()
-                
-                # Уведомляем администратора о новом участнике
-                if is_admin(ADMIN_ID):
-                    try:
-                        await context.bot.send_message(
-                            chat_id=ADMIN_ID,
-                            text=f"📥 Новый участник: {full_name}\n"
-                                 f"Всего участников: {len(db.get_all())}"
-                        )
-                    except:
-                        pass
-            else:
-                await update.message.reply_text("❌ Ошибка при регистрации")
-        return
-    
-    # Обработка кнопок пользователя
-    if text == '📝 Моя анкета':
-        info = db.get_info(user_id)
-        if info:
-            full_name, wish, not_wish = info
-            response = f"👤 **Ваша анкета:**\n\n📝 ФИО: {full_name}\n"
-            if wish:
-                response += f"✅ Хочет: {wish}\n"
-            if not_wish:
-                response += f"❌ Не хочет: {not_wish}\n"
-            
-            # Показываем статус распределения
-            if db.distribution_done:
-                if db.is_notified(user_id):
-                    response += "\n📬 Вы уже получили информацию о получателе!"
-                else:
-                    response += "\n⏳ Распределение выполнено, ждите уведомление!"
-            else:
-                response += "\n⏳ Распределение ещё не выполнено"
-            
-            await update.message.reply_text(response)
-        else:
-            await update.message.reply_text("❌ Вы не зарегистрированы. Напишите /start")
+    not_wish = None if text.lower() == 'нет' else text
+    full_name = context.user_data['full_name']
+    wish = context.user_data.get('wish')
     
-    elif text == '🎁 Кому я дарю подарок?':
-        if not db.is_registered(user_id):
-            await update.message.reply_text("❌ Сначала зарегистрируйтесь через /start")
-            return
+    # Сохраняем в базу
+    success = await db.register(
+        user_id=user.id,
+        username=user.username,
+        full_name=full_name,
+        wish=wish,
+        not_wish=not_wish
+    )
+    event.cards.invalidate(user.id)
+    
+    if success:
+        await update.message.reply_text(
+            f"✅ **Регистрация завершена!** 🎉\n\n"
+            f"Добро пожаловать, {full_name}!\n\n"
+            "Теперь жди, когда организатор распределит подарки.\n"
+            "Ты получишь сообщение, кому дарить подарок."
+        )
+        await show_user_menu(update, user.id)
+        context.user_data.clear()
         
-        if not db.distribution_done:
-            await update.message.reply_text(
-                "🎄 **Распределение ещё не выполнено.**\n\n"
-                "Организатор ещё не распределил подарки.\n"
-                "Пожалуйста, подождите."
-            )
-            return
+        # Уведомляем организаторов о новом участнике
+        stats = await db.get_stats()
+        digest.add(event, f"📥 Новый участник: {full_name}", footer=f"👥 Всего участников: {stats['total']}")
+    else:
+        await update.message.reply_text("❌ Ошибка при регистрации")
+
+async def my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '📝 Моя анкета'"""
+    user_id = update.effective_user.id
+    db = (await current_event(update)).db
+    
+    info = await db.get_info(user_id)
+    if info:
+        full_name, wish, not_wish = info
+        response = f"👤 **Ваша анкета:**\n\n📝 ФИО: {full_name}\n"
+        if wish:
+            response += f"✅ Хочет: {wish}\n"
+        if not_wish:
+            response += f"❌ Не хочет: {not_wish}\n"
         
-        # Проверяем, получал ли уже пользователь уведомление
-        if db.is_notified(user_id):
-            # Показываем информацию ещё раз
-            receiver_info = db.get_receiver_for_giver(user_id)
-            if receiver_info:
-                receiver_id, full_name, wish, not_wish = receiver_info
-                await send_gift_info(update, user_id, full_name, wish, not_wish)
+        # Показываем статус распределения
+        if db.distribution_done:
+            if await db.is_notified(user_id):
+                response += "\n📬 Вы уже получили информацию о получателе!"
             else:
-                await update.message.reply_text("❌ Информация о получателе не найдена")
-            return
-        
-        # Получаем информацию о получателе
-        receiver_info = db.get_receiver_for_giver(user_id)
-        
-        if not receiver_info:
-            await update.message.reply_text(
-                "❌ Вам ещё не назначен получатель.\n"
-                "Обратитесь к организатору."
-            )
-            return
-        
-        receiver_id, full_name, wish, not_wish = receiver_info
-        
-        # Отправляем информацию
-        await send_gift_info(update, user_id, full_name, wish, not_wish)
-        
-        # Помечаем как уведомлённого
-        db.mark_as_notified(user_id)
+                response += "\n⏳ Распределение выполнено, ждите уведомление!"
+            giver_id = await db.get_giver_for_receiver(user_id)
+            if giver_id is not None:
+                if await db.is_notified(giver_id):
+                    response += "\n🎅 Ваш Санта уже знает, кому дарит подарок"
+                else:
+                    response += "\n🎅 Ваш Санта ещё не открыл карточку получателя"
+        else:
+            response += "\n⏳ Распределение ещё не выполнено"
         
-        # Уведомляем администратора
-        if is_admin(ADMIN_ID):
-            try:
-                user_data = db.get_all().get(user_id, {})
-                user_name = user_data.get('name', 'Неизвестно')
-                await context.bot.send_message(
-                    chat_id=ADMIN_ID,
-                    text=f"✅ {user_name} получил информацию о получателе\n"
-                         f"Получатель: {full_name}"
-                )
-            except:
-                pass
-    
-    # Админские кнопки
-    elif text == '👑 Админ панель':
-        if not is_admin(user_id):
-            await update.message.reply_text("❌ У вас нет доступа к админ панели")
-            return
-        await show_admin_menu(update)
+        await update.message.reply_text(response)
+    else:
+        await update.message.reply_text("❌ Вы не зарегистрированы. Напишите /start")
+
+async def my_receiver(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '🎁 Кому я дарю подарок?'"""
+    user_id = update.effective_user.id
+    event = await current_event(update)
+    db = event.db
     
-    elif text == '👤 Вернуться в меню':
-        await show_user_menu(update, user_id)
+    if not await db.is_registered(user_id):
+        await update.message.reply_text("❌ Сначала зарегистрируйтесь через /start")
+        return
     
-    # Админские функции
-    elif is_admin(user_id):
-        if text == '📊 Статистика':
-            await show_admin_statistics(update, context)
-        
-        elif text == '🎁 Распределить подарки':
-            await distribute_gifts(update, context)
-        
-        elif text == '🔔 Отправить уведомления':
-            await send_notifications_to_all(update, context)
-        
-        elif text == '🔄 Сбросить всё':
-            await reset_all_data(update, context)
+    if not db.distribution_done:
+        await update.message.reply_text(
+            "🎄 **Распределение ещё не выполнено.**\n\n"
+            "Организатор ещё не распределил подарки.\n"
+            "Пожалуйста, подождите."
+        )
+        return
     
-    else:
+    # Проверяем, получал ли уже пользователь уведомление
+    if await db.is_notified(user_id):
+        # Показываем информацию ещё раз
+        receiver_info = await db.get_receiver_for_giver(user_id)
+        if receiver_info:
+            await send_gift_info(update, event, receiver_info)
+        else:
+            await update.message.reply_text("❌ Информация о получателе не найдена")
+        return
+    
+    # Получаем информацию о получателе
+    receiver_info = await db.get_receiver_for_giver(user_id)
+    
+    if not receiver_info:
         await update.message.reply_text(
-            "🤔 Используйте кнопки меню или напишите /start"
+            "❌ Вам ещё не назначен получатель.\n"
+            "Обратитесь к организатору."
         )
+        return
+    
+    receiver_id, full_name, wish, not_wish = receiver_info
+    
+    # Отправляем информацию
+    await send_gift_info(update, event, receiver_info)
+    
+    # Помечаем как уведомлённого
+    await db.mark_as_notified(user_id)
+    
+    # Уведомляем организаторов
+    info = await db.get_info(user_id)
+    user_name = info[0] if info else 'Неизвестно'
+    digest.add(event, f"✅ {user_name} узнал получателя: {full_name}")
 
-async def send_gift_info(update: Update, user_id: int, receiver_name: str, wish: str, not_wish: str):
-    """Отправить информацию о получателе подарка"""
-    response = f"🎅 **Твой Тайный Санта назначен!** 🎅\n\n"
-    response += f"👤 **Ты даришь подарок:** {receiver_name}\n"
+async def relay_target(db, user_id, direction):
+    """Кому уйдёт анонимное сообщение: получателю или Санте пользователя"""
+    if direction == 'receiver':
+        receiver_info = await db.get_receiver_for_giver(user_id)
+        return receiver_info[0] if receiver_info else None
+    return await db.get_giver_for_receiver(user_id)
+
+async def start_relay(update: Update, context: ContextTypes.DEFAULT_TYPE, direction):
+    """Начать анонимное сообщение: direction — 'receiver' или 'santa'"""
+    user_id = update.effective_user.id
+    db = (await current_event(update)).db
+    
+    if not await db.is_registered(user_id):
+        await update.message.reply_text("❌ Сначала зарегистрируйтесь через /start")
+        return
     
-    if wish:
-        response += f"\n✅ **Что хочет получить:**\n{wish}\n"
+    if not db.distribution_done:
+        await update.message.reply_text("🎄 Переписка откроется после распределения подарков.")
+        return
     
-    if not_wish:
-        response += f"\n❌ **Что НЕ хочет получать:**\n{not_wish}\n"
+    if await relay_target(db, user_id, direction) is None:
+        await update.message.reply_text("❌ Вам ещё не назначена пара.\nОбратитесь к организатору.")
+        return
     
-    response += "\n⚠️ **Важно:**\n"
-    response += "• Этот выбор окончательный\n"
-    response += "• Изменить получателя нельзя\n"
-    response += "• Сохраните это сообщение\n\n"
-    response += "🎄 **Счастливого Нового года!** 🎄"
+    if direction == 'receiver':
+        prompt = "✍️ Напишите сообщение своему получателю.\nОн не узнает, от кого оно."
+    else:
+        prompt = "✍️ Напишите сообщение своему Тайному Санте.\nБот передаст его, не раскрывая Санту."
+    reply_markup = ReplyKeyboardMarkup([['❌ Отменить сообщение']], resize_keyboard=True, one_time_keyboard=True)
+    await update.message.reply_text(prompt, reply_markup=reply_markup)
     
-    await update.message.reply_text(response)
+    context.user_data['relay'] = direction
+    set_state(context, WAITING_FOR_RELAY)
+
+async def write_to_receiver(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '✉️ Написать получателю'"""
+    await start_relay(update, context, 'receiver')
+
+async def write_to_santa(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '✉️ Написать Санте'"""
+    await start_relay(update, context, 'santa')
+
+async def relay_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Текст анонимного сообщения: уходит через очередь relay"""
+    user_id = update.effective_user.id
+    event = await current_event(update)
+    text = update.message.text.strip()
+    
+    if len(text) > RELAY_MAX_LENGTH:
+        await update.message.reply_text(f"❌ Слишком длинное сообщение: не больше {RELAY_MAX_LENGTH} символов")
+        return
+    
+    set_state(context, None)
+    direction = context.user_data.pop('relay', None)
+    # Пару проверяем заново: организатор мог сбросить распределение
+    target = await relay_target(event.db, user_id, direction)
+    if target is None:
+        await update.message.reply_text("❌ Пара не найдена: распределение могли сбросить")
+    else:
+        if direction == 'receiver':
+            header = f"🎅 Сообщение от вашего Тайного Санты («{event.title}»):"
+        else:
+            header = f"🎁 Сообщение от вашего получателя («{event.title}»):"
+        if await relay.add(target, f"{header}\n{text}", sender_id=user_id):
+            await update.message.reply_text("✅ Сообщение отправлено анонимно")
+        elif relay.sender_wait(user_id):
+            await update.message.reply_text("⏳ Слишком часто: подождите пару секунд и отправьте ещё раз")
+        else:
+            await update.message.reply_text("❌ Не удалось отправить сообщение, попробуйте позже")
+    await show_user_menu(update, user_id)
+
+async def cancel_relay(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '❌ Отменить сообщение'"""
+    set_state(context, None)
+    context.user_data.pop('relay', None)
+    await update.message.reply_text("❌ Сообщение отменено")
+    await show_user_menu(update, update.effective_user.id)
+
+async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '👑 Админ панель'"""
+    if not await is_organizer(update):
+        await update.message.reply_text("❌ У вас нет доступа к админ панели")
+        return
+    await show_admin_menu(update)
+
+async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '👤 Вернуться в меню'"""
+    await show_user_menu(update, update.effective_user.id)
+
+async def unknown_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сообщение, для которого нет маршрута"""
+    await update.message.reply_text(
+        "🤔 Используйте кнопки меню или напишите /start"
+    )
+
+async def send_gift_info(update: Update, event, receiver_info):
+    """Отправить информацию о получателе подарка"""
+    await update.message.reply_text(event.cards.render(*receiver_info))
 
 async def show_admin_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать детальную статистику для админа"""
-    stats = db.get_stats()
-    participants = db.get_all()
-    
-    response = f"📊 **Детальная статистика:**\n\n"
-    response += f"👥 Всего участников: {stats['total']}\n"
-    response += f"🎁 Распределение: {'✅ Выполнено' if db.distribution_done else '❌ Не выполнено'}\n"
-    response += f"🔔 Получили уведомления: {stats['notified']}/{stats['total']}\n\n"
-    
-    if participants:
-        response += "**Список участников:**\n"
-        for user_id, data in participants.items():
-            status = "🔔" if data['notified'] else "⏳"
-            status += "🎁" if data['is_giver'] else ""
-            username = f"(@{data['username']})" if data['username'] else ""
-            response += f"{status} {data['name']} {username}\n"
-    
-    # Информация о парах если распределение выполнено
-    if db.distribution_done:
-        response += "\n**Пары (кто → кому):**\n"
-        for giver_id, receiver_id in db.pairs.items():
-            giver = participants.get(giver_id, {})
-            receiver = participants.get(receiver_id, {})
-            notified = "✅" if giver.get('notified') else "⏳"
-            response += f"{notified} {giver.get('name', '?')} → {receiver.get('name', '?')}\n"
+    """Показать детальную статистику для админа (первая страница)"""
+    event = await current_event(update)
+    text, reply_markup = await event.stats_pages.page(event.db, 0)
+    text += await cache_footer(event.db)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def stats_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание страниц статистики"""
+    query = update.callback_query
+    event = await current_event(update)
+    
+    if not event.is_organizer(query.from_user.id):
+        await query.answer("❌ Только для администратора!")
+        return
     
-    await update.message.reply_text(response)
+    number = int(query.data.split(':', 1)[1])
+    text, reply_markup = await event.stats_pages.page(event.db, number)
+    text += await cache_footer(event.db)
+    await query.answer()
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Текст не изменился — не ошибка
+        if 'not modified' not in str(e):
+            raise
+
+async def cache_footer(db):
+    """Счётчики кэша хранилища для админа"""
+    cache = await db.cache_stats()
+    if not cache:
+        return ""
+    return (
+        f"\n💾 Кэш: попаданий {cache['hits']}, промахов {cache['misses']} "
+        f"({cache['hit_rate']:.0%}), ждут записи: {cache['pending']}"
+    )
 
 async def distribute_gifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Распределить подарки между всеми участниками"""
-    if not is_admin(update.effective_user.id):
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
         await update.message.reply_text("❌ Только для администратора!")
         return
     
-    stats = db.get_stats()
+    stats = await db.get_stats()
     
     if stats['total'] < 2:
         await update.message.reply_text("❌ Нужно минимум 2 участника для распределения")
@@ -490,11 +570,26 @@ async def distribute_gifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
     
-    context.user_data['awaiting_distribution_confirmation'] = True
+    # Ключ жеребьёвки — этот запрос подтверждения: повторное «Да» не проведёт вторую
+    context.user_data['draw_key'] = f"{event.id}:{update.effective_user.id}:{update.message.message_id}"
+    set_state(context, CONFIRM_DISTRIBUTION)
+
+async def build_notification(event, user_id):
+    """Текст уведомления для дарителя (None, если получатель не назначен)"""
+    receiver_info = await event.db.get_receiver_for_giver(user_id)
+    if not receiver_info:
+        return None
+    return event.cards.render(*receiver_info)
+
+async def is_pending_notification(db, user_id):
+    """Нужно ли ещё отправить уведомление этому дарителю?"""
+    return await db.is_registered(user_id) and not await db.is_notified(user_id)
 
 async def send_notifications_to_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправить уведомления всем участникам"""
-    if not is_admin(update.effective_user.id):
+    """Запустить фоновую рассылку уведомлений всем участникам"""
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
         await update.message.reply_text("❌ Только для администратора!")
         return
     
@@ -502,55 +597,69 @@ async def send_notifications_to_all(update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text("❌ Сначала выполните распределение подарков!")
         return
     
-    participants = db.get_all()
-    total = len(participants)
-    sent = 0
-    failed = 0
-    
-    await update.message.reply_text(f"⏳ Отправляю уведомления {total} участникам...")
-    
-    for user_id, data in participants.items():
-        if not data['notified']:
-            receiver_info = db.get_receiver_for_giver(user_id)
-            if receiver_info:
-                receiver_id, full_name, wish, not_wish = receiver_info
-                
-                try:
-                    # Отправляем сообщение участнику
-                    message = f"🎅 **Твой Тайный Санта назначен!** 🎅\n\n"
-                    message += f"👤 **Ты даришь подарок:** {full_name}\n"
-                    
-                    if wish:
-                        message += f"\n✅ **Что хочет получить:**\n{wish}\n"
-                    
-                    if not_wish:
-                        message += f"\n❌ **Что НЕ хочет получать:**\n{not_wish}\n"
-                    
-                    message += "\n🎄 **Счастливого Нового года!** 🎄"
-                    
-                    await context.bot.send_message(chat_id=user_id, text=message)
-                    
-                    # Помечаем как уведомлённого
-                    db.mark_as_notified(user_id)
-                    sent += 1
-                    
-                    # Небольшая задержка чтобы не спамить
-                    await asyncio.sleep(0.5)
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка отправки {user_id}: {e}")
-                    failed += 1
+    if event.busy:
+        await update.message.reply_text("⚠️ Рассылка уже идёт, прогресс — в сообщении выше")
+        return
     
-    await update.message.reply_text(
-        f"✅ Уведомления отправлены!\n\n"
-        f"• Успешно: {sent}\n"
-        f"• Ошибок: {failed}\n"
-        f"• Всего участников: {total}"
-    )
+    lock = f'broadcast:{event.id}'
+    if not locks.try_lock(lock):
+        await update.message.reply_text("⚠️ Рассылка уже идёт в другом процессе")
+        return
+    
+    # До первого await: второе нажатие увидит, что рассылка уже запускается
+    event.starting.add('broadcast')
+    try:
+        # Курсор рассылки — все, кто ещё не получил уведомление
+        participants = await db.get_all()
+        pending = [user_id for user_id, data in participants.items() if not data['notified']]
+        
+        event.broadcast_job = BroadcastJob(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            pending=pending,
+            render=functools.partial(build_notification, event),
+            on_sent=db.mark_as_notified,
+            state_path=broadcast_state_path(event.id)
+        )
+        event.broadcast_job.start()
+    except Exception:
+        locks.unlock(lock)
+        raise
+    finally:
+        event.starting.discard('broadcast')
+    asyncio.create_task(hold_lease(locks, lock, event.broadcast_job.task))
+
+async def broadcast_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки управления рассылкой: пауза, продолжение, отмена"""
+    query = update.callback_query
+    event = await current_event(update)
+    broadcast_job = event.broadcast_job
+    
+    if not event.is_organizer(query.from_user.id):
+        await query.answer("❌ Только для администратора!")
+        return
+    
+    if not event.busy:
+        await query.answer("Рассылка уже завершена")
+        return
+    
+    action = query.data.split(':', 1)[1]
+    if action == 'pause':
+        broadcast_job.pause()
+        await query.answer("⏸ Рассылка на паузе")
+    elif action == 'resume':
+        broadcast_job.resume()
+        await query.answer("▶️ Рассылка продолжается")
+    elif action == 'cancel':
+        broadcast_job.cancel()
+        await query.answer("⏹ Рассылка отменена")
+    
+    await broadcast_job.show_progress()
 
 async def reset_all_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сбросить все данные"""
-    if not is_admin(update.effective_user.id):
+    event = await current_event(update)
+    if not event.is_organizer(update.effective_user.id):
         await update.message.reply_text("❌ Только для администратора!")
         return
     
@@ -569,64 +678,84 @@ async def reset_all_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
     
-    context.user_data['awaiting_reset_confirmation'] = True
+    set_state(context, CONFIRM_RESET)
 
 # ========== КОМАНДЫ ==========
 
-async def handle_admin_confirmations(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка подтверждений для администратора"""
-    user = update.effective_user
-    text = update.message.text
+async def confirm_distribution(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подтверждение распределения"""
+    event = await current_event(update)
+    db = event.db
+    set_state(context, None)
     
-    if not is_admin(user.id):
+    # Два организатора (в одном процессе или в разных) не должны распределять одновременно.
+    # Проверка и отметка — до первого await
+    lock = f'distribute:{event.id}'
+    if 'distribute' in event.starting or not locks.try_lock(lock):
+        await update.message.reply_text("⏳ Распределение уже выполняет другой организатор")
+        return
+    event.starting.add('distribute')
+    try:
+        await db.refresh()
+        success = await db.distribute_gifts(context.user_data.get('draw_key'))
+    except UnsatisfiableError as e:
+        await update.message.reply_text(
+            f"❌ **Распределение невозможно:** {e}\n\n"
+            f"Ослабьте ограничения через /exclude и /team"
+        )
+        await show_admin_menu(update)
         return
+    finally:
+        event.starting.discard('distribute')
+        locks.unlock(lock)
     
-    # Подтверждение распределения
-    if context.user_data.get('awaiting_distribution_confirmation'):
-        if text == '✅ Да, распределить':
-            success = db.distribute_gifts()
-            
-            if success:
-                stats = db.get_stats()
-                await update.message.reply_text(
-                    f"✅ **Распределение выполнено успешно!**\n\n"
-                    f"🎁 Распределено между {stats['total']} участниками\n\n"
-                    f"Теперь участники могут:\n"
-                    f"1. Нажать 'Кому я дарю подарок?' чтобы узнать\n"
-                    f"2. Или вы можете отправить уведомления всем"
-                )
-                await show_admin_menu(update)
-            else:
-                await update.message.reply_text("❌ Ошибка при распределении")
-        
-        elif text == '❌ Нет, отмена':
-            await update.message.reply_text("❌ Распределение отменено")
-            await show_admin_menu(update)
-        
-        context.user_data.pop('awaiting_distribution_confirmation', None)
-    
-    # Подтверждение сброса
-    elif context.user_data.get('awaiting_reset_confirmation'):
-        if text == '✅ Да, сбросить всё':
-            db.reset_all()
-            await update.message.reply_text(
-                "✅ **Все данные успешно сброшены!**\n\n"
-                "База данных очищена.\n"
-                "Теперь можно начинать новый розыгрыш с чистого листа."
-            )
-            await show_admin_menu(update)
-        
-        elif text == '❌ Нет, отмена':
-            await update.message.reply_text("❌ Сброс отменён")
-            await show_admin_menu(update)
-        
-        context.user_data.pop('awaiting_reset_confirmation', None)
+    if success:
+        events.changed(event.id)
+        stats = await db.get_stats()
+        await update.message.reply_text(
+            f"✅ **Распределение выполнено успешно!**\n\n"
+            f"🎁 Распределено между {stats['total']} участниками\n\n"
+            f"Теперь участники могут:\n"
+            f"1. Нажать 'Кому я дарю подарок?' чтобы узнать\n"
+            f"2. Или вы можете отправить уведомления всем"
+        )
+        await show_admin_menu(update)
+    else:
+        await update.message.reply_text("❌ Ошибка при распределении")
+
+async def cancel_distribution(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '❌ Нет, отмена' при подтверждении распределения"""
+    set_state(context, None)
+    await update.message.reply_text("❌ Распределение отменено")
+    await show_admin_menu(update)
+
+async def confirm_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подтверждение сброса"""
+    event = await current_event(update)
+    set_state(context, None)
+    
+    await event.db.reset_all()
+    event.cards.clear()
+    events.changed(event.id)
+    await update.message.reply_text(
+        "✅ **Все данные успешно сброшены!**\n\n"
+        "База данных очищена.\n"
+        "Теперь можно начинать новый розыгрыш с чистого листа."
+    )
+    await show_admin_menu(update)
+
+async def cancel_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '❌ Нет, отмена' при подтверждении сброса"""
+    set_state(context, None)
+    await update.message.reply_text("❌ Сброс отменён")
+    await show_admin_menu(update)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда помощи"""
     user = update.effective_user
+    event = await current_event(update)
     
-    if is_admin(user.id):
+    if event.is_organizer(user.id):
         help_text = (
             "👑 **Админ команды:**\n\n"
             "/start - регистрация/меню\n"
@@ -634,6 +763,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "/distribute - распределить подарки\n"
             "/notify_all - уведомить всех\n"
             "/reset - сбросить всё\n"
+            "/exclude @a @b - запретить паре дарить друг другу\n"
+            "/team @a отдел - внутри команды не дарят\n"
+            "/organizer @a - добавить организатора\n"
+            "/event - розыгрыш и ссылка-приглашение\n"
+            "/newevent Название - создать новый розыгрыш\n"
+            "/routes - время обработки запросов\n"
+            "/metrics - метрики бота\n"
+            "/export - выгрузить участников и пары (CSV)\n"
+            "📄 Пришлите .csv/.jsonl — импорт участников\n"
             "/help - эта справка"
         )
     else:
@@ -645,8 +783,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "3. Ждёте когда организатор распределит подарки\n"
             "4. Получаете уведомление кому дарить\n"
             "5. Дарите подарок!\n\n"
+            "✉️ Кнопками «Написать получателю» и «Написать Санте» можно анонимно "
+            "уточнить размер или пожелания.\n\n"
             "**Команды:**\n"
             "/start - регистрация\n"
+            "/event - текущий розыгрыш\n"
+            "/newevent Название - создать свой розыгрыш\n"
             "/help - эта справка"
         )
     
@@ -654,14 +796,377 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда статистики"""
-    if not is_admin(update.effective_user.id):
+    event = await current_event(update)
+    if not event.is_organizer(update.effective_user.id):
         await update.message.reply_text("❌ Только для администратора!")
         return
     
     await show_admin_statistics(update, context)
 
+async def exclude_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запретить двум участникам дарить друг другу: /exclude @a @b"""
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    if len(context.args) != 2:
+        await update.message.reply_text("Использование: /exclude <ID или @username> <ID или @username>")
+        return
+    
+    first = await db.find_participant(context.args[0])
+    second = await db.find_participant(context.args[1])
+    if first is None or second is None or first == second:
+        await update.message.reply_text("❌ Участники не найдены")
+        return
+    
+    await db.add_exclusion(first, second)
+    events.changed(event.id)
+    first_name, *_ = await db.get_info(first)
+    second_name, *_ = await db.get_info(second)
+    await update.message.reply_text(
+        f"🚫 {first_name} и {second_name} "
+        f"не будут дарить друг другу"
+    )
+
+async def team_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Указать команду участника: /team @a отдел (без названия — убрать)"""
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Использование: /team <ID или @username> [команда]")
+        return
+    
+    user_id = await db.find_participant(context.args[0])
+    if user_id is None:
+        await update.message.reply_text("❌ Участник не найден")
+        return
+    
+    tag = ' '.join(context.args[1:]) or None
+    await db.set_team(user_id, tag)
+    events.changed(event.id)
+    name, *_ = await db.get_info(user_id)
+    if tag:
+        await update.message.reply_text(f"👥 {name} в команде «{tag}»: внутри команды не дарят")
+    else:
+        await update.message.reply_text(f"👥 {name} больше не состоит в команде")
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт участников: организатор присылает файл .csv или .jsonl"""
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    document = update.message.document
+    if roster_format(document.file_name or '') is None:
+        await update.message.reply_text(
+            "📄 Для импорта пришлите .csv или .jsonl с колонками "
+            "user_id, username, full_name, wish, not_wish"
+        )
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await update.message.reply_text("❌ Файл больше 20 МБ — Telegram не отдаст его боту")
+        return
+    if db.distribution_done:
+        await update.message.reply_text("❌ Распределение уже выполнено: новые участники не получат пары")
+        return
+    
+    await update.message.reply_text("⏳ Импортирую участников...")
+    # Файл читается с диска построчно, а не целиком в память
+    handle, path = tempfile.mkstemp(suffix=os.path.splitext(document.file_name)[1])
+    os.close(handle)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        report = await import_roster(
+            db, path, on_batch=lambda user_ids: events.join_many(user_ids, event.id)
+        )
+    finally:
+        os.remove(path)
+    # Карточки получателей перестроятся по новым анкетам
+    event.cards.clear()
+    events.changed(event.id)
+    events.changed(CATALOG_SCOPE)
+    
+    stats = await db.get_stats()
+    await update.message.reply_text(format_report(report) + f"👥 Всего участников: {stats['total']}")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка участников, пар и статуса уведомлений: /export [csv|jsonl]"""
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    kind = context.args[0].lower() if context.args else 'csv'
+    if kind not in ('csv', 'jsonl'):
+        await update.message.reply_text("Использование: /export [csv|jsonl]")
+        return
+    
+    handle, path = tempfile.mkstemp(suffix=f'.{kind}')
+    os.close(handle)
+    try:
+        count = await export_roster(db, path)
+        with open(path, 'rb') as stream:
+            await update.message.reply_document(
+                stream, filename=f'santa_{event.id}.{kind}', caption=f"📤 Участников: {count}"
+            )
+    finally:
+        os.remove(path)
+
+async def organizer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавить организатора розыгрыша: /organizer @a"""
+    event = await current_event(update)
+    db = event.db
+    if not event.is_organizer(update.effective_user.id):
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    if len(context.args) != 1:
+        await update.message.reply_text("Использование: /organizer <ID или @username участника>")
+        return
+    
+    user_id = await db.find_participant(context.args[0])
+    if user_id is None:
+        await update.message.reply_text("❌ Участник не найден")
+        return
+    
+    await events.add_organizer(event.id, user_id)
+    events.changed(CATALOG_SCOPE)
+    name, *_ = await db.get_info(user_id)
+    await update.message.reply_text(f"👑 {name} теперь организатор розыгрыша «{event.title}»")
+
+async def event_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Текущий розыгрыш (организатору — со ссылкой-приглашением)"""
+    event = await current_event(update)
+    text = f"🎄 Розыгрыш: {event.title}\n"
+    if event.is_organizer(update.effective_user.id):
+        text += f"\n🔗 Приглашение для участников:\n{invite_link(context.bot, event)}"
+    await update.message.reply_text(text)
+
+async def new_event_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Создать свой розыгрыш: /newevent Название"""
+    title = ' '.join(context.args)
+    if not title:
+        await update.message.reply_text("Использование: /newevent <название розыгрыша>")
+        return
+    
+    event = await events.create(title, update.effective_user.id)
+    context.user_data.clear()
+    await update.message.reply_text(
+        f"✅ Розыгрыш «{event.title}» создан, вы — организатор.\n\n"
+        f"🔗 Отправьте участникам приглашение:\n{invite_link(context.bot, event)}\n\n"
+        f"Чтобы участвовать самому, напишите /start"
+    )
+
+async def routes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Время обработки по маршрутам: /routes (только оператор бота)"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    lines = ["⏱ **Время обработки (мс):**\n"]
+    for name, stats in router.report():
+        lines.append(
+            f"• {name}: {stats['count']} шт., p50 {stats['p50'] * 1000:.1f}, "
+            f"p99 {stats['p99'] * 1000:.1f}, макс {stats['max'] * 1000:.1f}"
+            + (f", ошибок {stats['errors']}" if stats['errors'] else "")
+        )
+    await update.message.reply_text("\n".join(lines))
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка метрик: /metrics (только оператор бота; полные данные — GET /metrics)"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Только для администратора!")
+        return
+    
+    in_flight = metrics.UPDATES_IN_FLIGHT.values
+    lines = [
+        "📈 **Метрики** (p50 / p99, мс):\n",
+        f"🔄 Обновлений в обработке: {in_flight.get(('total',), 0)}, "
+        f"выполняются: {in_flight.get(('running',), 0)}\n"
+    ]
+    for name, count, p50, p99 in metrics.summary():
+        lines.append(f"• {name}: {count} шт., {p50 * 1000:.1f} / {p99 * 1000:.1f}")
+    
+    if metrics.ERRORS.values:
+        lines.append("\n⚠️ **Ошибки:**")
+        for (source, kind), count in sorted(metrics.ERRORS.values.items()):
+            lines.append(f"• {source} {kind}: {count}")
+    
+    # Сообщение Telegram ограничено 4096 символами
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+# ========== ТАБЛИЦА МАРШРУТОВ ==========
+
+# Шаги регистрации...
+router.add(ANY_TEXT, registration_name, state=WAITING_FOR_NAME)
+router.add(ANY_TEXT, registration_wish, state=WAITING_FOR_WISH)
+router.add(ANY_TEXT, registration_not_wish, state=WAITING_FOR_NOT_WISH)
+# ...кнопки участника...
+router.add('📝 Моя анкета', my_profile)
+router.add('🎁 Кому я дарю подарок?', my_receiver)
+router.add('👑 Админ панель', admin_panel)
+router.add('👤 Вернуться в меню', back_to_menu)
+router.add('✉️ Написать получателю', write_to_receiver)
+router.add('✉️ Написать Санте', write_to_santa)
+router.add('❌ Отменить сообщение', cancel_relay, state=WAITING_FOR_RELAY)
+# Кнопка меню во время ввода сообщения — не текст для пары, а выход из переписки
+router.add(ANY_TEXT, relay_message, state=WAITING_FOR_RELAY, menu_first=True)
+# ...кнопки и подтверждения организатора
+router.add('📊 Статистика', show_admin_statistics, admin=True)
+router.add('🎁 Распределить подарки', distribute_gifts, admin=True)
+router.add('🔔 Отправить уведомления', send_notifications_to_all, admin=True)
+router.add('🔄 Сбросить всё', reset_all_data, admin=True)
+router.add('✅ Да, распределить', confirm_distribution, state=CONFIRM_DISTRIBUTION, admin=True)
+router.add('❌ Нет, отмена', cancel_distribution, state=CONFIRM_DISTRIBUTION, admin=True)
+router.add('✅ Да, сбросить всё', confirm_reset, state=CONFIRM_RESET, admin=True)
+router.add('❌ Нет, отмена', cancel_reset, state=CONFIRM_RESET, admin=True)
+router.fallback = unknown_message
+
 # ========== ЗАПУСК БОТА ==========
 
+def application_builder(token, base_url=None):
+    # Запросы к Bot API замеряются (metrics.API_SECONDS) и идут через общую очередь
+    request = OutboundRequest(
+        send_queue,
+        connection_pool_size=MAX_CONCURRENT_UPDATES + 8,
+        read_timeout=30,
+        write_timeout=30,
+        connect_timeout=30,
+        pool_timeout=30
+    )
+    builder = Application.builder() \
+        .token(token) \
+        .request(request) \
+        .get_updates_request(InstrumentedRequest()) \
+        .concurrent_updates(UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    if base_url:
+        # Локальный сервер Bot API (нагрузочные тесты)
+        builder = builder.base_url(base_url)
+    return builder
+
+def build_application(token, base_url=None, updater=True):
+    """Создать приложение и зарегистрировать обработчики"""
+    builder = application_builder(token, base_url)
+    if not updater:
+        # Рабочий процесс: обновления приходят из очереди процесса приёма
+        builder = builder.updater(None)
+    application = builder.build()
+    open_storage()
+    
+    # Регистрируем обработчики команд
+    application.add_handler(CommandHandler("start", router.timed(start)))
+    application.add_handler(CommandHandler("help", router.timed(help_command)))
+    application.add_handler(CommandHandler("stats", router.timed(stats_command)))
+    application.add_handler(CommandHandler("exclude", router.timed(exclude_command)))
+    application.add_handler(CommandHandler("team", router.timed(team_command)))
+    application.add_handler(CommandHandler("organizer", router.timed(organizer_command)))
+    application.add_handler(CommandHandler("event", router.timed(event_command)))
+    application.add_handler(CommandHandler("newevent", router.timed(new_event_command)))
+    application.add_handler(CommandHandler("routes", router.timed(routes_command)))
+    application.add_handler(CommandHandler("metrics", router.timed(metrics_command)))
+    application.add_handler(CommandHandler("export", router.timed(export_command)))
+    
+    # Импорт участников из присланного файла
+    application.add_handler(MessageHandler(filters.Document.ALL, router.timed(import_document)))
+    
+    # Главный обработчик сообщений
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, router.dispatch))
+    
+    # Управление фоновой рассылкой
+    application.add_handler(CallbackQueryHandler(router.timed(broadcast_control), pattern=r'^broadcast:'))
+    
+    # Листание статистики
+    application.add_handler(CallbackQueryHandler(router.timed(stats_page_callback), pattern=r'^stats:\d+$'))
+    
+    return application
+
+def build_ingestion_application(token, fanout):
+    """Процесс приёма: каждое обновление уходит рабочему процессу, сам он не отвечает"""
+    application = application_builder(token).build()
+    application.add_handler(TypeHandler(Update, fanout.forward))
+    return application
+
+async def restore_broadcasts(bot, shard=None):
+    """
+    Продолжить рассылки, прерванные перезапуском. Рабочий процесс shard
+    берёт только рассылки из чатов своего шарда, чтобы каждую продолжал один.
+    """
+    for event_id in list(events.catalog.titles):
+        state_path = broadcast_state_path(event_id)
+        if not os.path.exists(state_path):
+            continue
+        # Чужой шард отсеиваем по файлу состояния, не проверяя участников
+        state = BroadcastJob.read_state(state_path)
+        if not state or (shard is not None and state['chat_id'] % WORKERS != shard):
+            continue
+        event = await events.get(event_id)
+        job = await BroadcastJob.restore(
+            bot,
+            render=functools.partial(build_notification, event),
+            on_sent=event.db.mark_as_notified,
+            is_pending=functools.partial(is_pending_notification, event.db),
+            state_path=state_path,
+            state=state
+        )
+        if not job:
+            continue
+        lock = f'broadcast:{event_id}'
+        if not locks.try_lock(lock):
+            continue
+        event.broadcast_job = job
+        job.start()
+        asyncio.create_task(hold_lease(locks, lock, job.task))
+
+async def worker_main(index, queue):
+    """Рабочий процесс: обрабатывает обновления своего шарда из очереди"""
+    application = build_application(TOKEN, updater=False)
+    flusher = None
+    digest_task = None
+    relay_task = None
+    try:
+        # Блокировки с нашим WORKER_ID остались от упавшего предшественника
+        locks.release_all()
+        await application.initialize()
+        await application.start()
+        await restore_broadcasts(application.bot, shard=index)
+        flusher = asyncio.create_task(events.flush_periodically(CACHE_FLUSH_INTERVAL))
+        digest_task = asyncio.create_task(digest.run(application.bot))
+        relay_task = asyncio.create_task(relay.run(application.bot))
+        
+        def handle(data):
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+        
+        await receive(queue, handle)
+    finally:
+        if digest_task:
+            digest_task.cancel()
+            await digest.flush(application.bot)
+        if relay_task:
+            # Недоставленное остаётся в outbox до следующего запуска
+            relay_task.cancel()
+        if application.running:
+            await application.stop()
+        if application.initialized:
+            await application.shutdown()
+        if flusher:
+            flusher.cancel()
+        close_storage()
+
+def run_worker(index, queue):
+    """Точка входа рабочего процесса (WorkerPool)"""
+    logging.getLogger().setLevel(logging.INFO)
+    asyncio.run(worker_main(index, queue))
+
 async def main():
     """Асинхронная главная функция"""
     print("🤖 Запускаю бота...")
@@ -672,27 +1177,29 @@ async def main():
         print("❌ Токен не найден!")
         return
     
-    # Создаём приложение
-    application = Application.builder() \
-        .token(TOKEN) \
-        .read_timeout(30) \
-        .write_timeout(30) \
-        .connect_timeout(30) \
-        .build()
+    if WORKERS and os.environ.get('STORAGE') in ('memory', 'journal'):
+        print("❌ WORKERS работает только с хранилищем SQLite (STORAGE не задан)")
+        return
     
-    # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("stats", stats_command))
+    flusher = None
+    digest_task = None
+    relay_task = None
+    pool = None
+    supervisor = None
     
-    # Обработчик для админских подтверждений
-    application.add_handler(MessageHandler(
-        filters.Regex(r'^(✅ Да, распределить|❌ Нет, отмена|✅ Да, сбросить всё)$'),
-        handle_admin_confirmations
-    ))
+    # Создаём приложение
+    if WORKERS:
+        pool = WorkerPool(run_worker, WORKERS)
+        pool.start()
+        application = build_ingestion_application(TOKEN, UpdateFanout(pool.queues))
+        print(f"🧵 Рабочих процессов: {WORKERS}")
+    else:
+        application = build_application(TOKEN)
     
-    # Главный обработчик сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # HTTP-сервер: webhook и проверки здоровья для Railway. aiohttp импортируется
+    # только здесь: рабочим процессам и утилитам он не нужен, а импорт заметно удлиняет старт
+    from webhook import WebhookServer
+    server = WebhookServer(application, port=PORT, secret_token=WEBHOOK_SECRET, metrics_token=METRICS_TOKEN)
     
     print("✅ Бот запущен и готов к работе!")
     print("🔗 Бот будет работать 24/7 на Railway")
@@ -701,11 +1208,48 @@ async def main():
         # Запускаем бота
         await application.initialize()
         await application.start()
-        await application.updater.start_polling(
-            drop_pending_updates=True,
-            timeout=30,
-            poll_interval=1.0
-        )
+        await server.start()
+        
+        if not pool:
+            # Розыгрыш по умолчанию поднимаем сразу (снимок и журнал, счётчики),
+            # а не на первом запросе после перезапуска
+            await events.get(DEFAULT_EVENT)
+        
+        # То, что пользователи прислали за время перезапуска: последние REPLAY_LIMIT
+        # обновлений без устаревших и повторов; остальное Telegram забывает
+        try:
+            await replay_pending(application)
+        except TelegramError as e:
+            print(f"⚠️ Не удалось забрать накопившиеся обновления: {e}")
+        
+        if BOT_MODE == 'webhook' and WEBHOOK_URL:
+            try:
+                await server.set_webhook(WEBHOOK_URL)
+                print(f"🌐 Режим webhook: {WEBHOOK_URL}")
+            except TelegramError as e:
+                print(f"⚠️ Не удалось установить webhook ({e}), переключаюсь на polling")
+        
+        if not server.webhook_enabled:
+            await application.updater.start_polling(
+                timeout=POLL_TIMEOUT,
+                poll_interval=POLL_INTERVAL
+            )
+        
+        if pool:
+            # Рассылки продолжают рабочие процессы; упавшие перезапускаются
+            supervisor = asyncio.create_task(pool.supervise())
+        else:
+            # Продолжаем рассылки, прерванные перезапуском
+            await restore_broadcasts(application.bot)
+            
+            # Периодическая запись накопленных изменений в базу и выгрузка простаивающих розыгрышей
+            flusher = asyncio.create_task(events.flush_periodically(CACHE_FLUSH_INTERVAL))
+            
+            # Сводки организаторам
+            digest_task = asyncio.create_task(digest.run(application.bot))
+            
+            # Анонимные сообщения, в том числе не доставленные до перезапуска
+            relay_task = asyncio.create_task(relay.run(application.bot))
         
         # Бесконечный цикл
         await asyncio.Event().wait()
@@ -717,12 +1261,28 @@ async def main():
         print(f"❌ Ошибка: {type(e).__name__}: {e}")
         
     finally:
-        if application.updater:
+        await server.stop()
+        if application.updater and application.updater.running:
             await application.updater.stop()
+        if digest_task:
+            digest_task.cancel()
+            # Последняя сводка перед выходом
+            await digest.flush(application.bot)
+        if relay_task:
+            # Недоставленное остаётся в outbox до следующего запуска
+            relay_task.cancel()
         if application.running:
             await application.stop()
         if application.initialized:
             await application.shutdown()
+        if flusher:
+            flusher.cancel()
+        if supervisor:
+            supervisor.cancel()
+        if pool:
+            pool.stop()
+        # Сбрасываем накопленные записи перед выходом
+        close_storage()
         print("🛑 Бот остановлен")
 
 if __name__ == '__main__':
@@ -0,0 +1,458 @@
+"""Массовая рассылка сообщений с учётом лимитов Telegram Bot API"""
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from metrics import percentile
+from outbound import BULK, current_priority
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: около 30 сообщений в секунду всего и 1 сообщение
+# в секунду в один чат. Держимся чуть ниже, чтобы не ловить 429.
+GLOBAL_RATE = 28
+PER_CHAT_INTERVAL = 1.05
+
+# Файл с курсором фоновой рассылки и частота обновления прогресса
+JOB_STATE_PATH = os.environ.get('BROADCAST_STATE_PATH', 'broadcast_job.json')
+PROGRESS_INTERVAL = 3.0
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем не больше rate операций в секунду"""
+
+    def __init__(self, rate, capacity=5):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retryable(error):
+    """Временная ошибка (429, сеть): отправку стоит повторить позже"""
+    return isinstance(error, (RetryAfter, NetworkError)) and not isinstance(error, BadRequest)
+
+
+async def resolve(result):
+    """Обработчики могут быть как обычными функциями, так и корутинами"""
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class BroadcastEngine:
+    """
+    Рассылка через пул воркеров. Общий лимит запросов в боте держит
+    OutboundQueue, через которую идут все запросы бота; собственное ведро
+    токенов (rate) — только для бота без очереди (бенчмарк).
+    RetryAfter откладывает только тот чат, который его получил (не больше
+    max_throttled раз), временные сетевые ошибки повторяются с экспоненциальной
+    задержкой и джиттером (не больше max_retries раз); дальше — on_failed.
+    """
+
+    def __init__(self, bot, rate=None, workers=8, per_chat_interval=PER_CHAT_INTERVAL,
+                 max_retries=3, base_delay=0.5, max_throttled=5):
+        self.bot = bot
+        self.bucket = TokenBucket(rate) if rate else None
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_throttled = max_throttled
+        self.lanes = {}  # chat_id -> время, раньше которого в чат писать нельзя
+        self.resumed = asyncio.Event()  # сброшено, пока рассылка на паузе
+        self.resumed.set()
+        self.cancelled = False
+        self.queue = asyncio.Queue()
+        self.timers = set()
+        self.pending = 0
+        self.done = asyncio.Event()
+
+    async def run(self, messages, on_sent=None, on_failed=None):
+        """
+        Отправить сообщения (chat_id, text).
+        on_sent(chat_id) и on_failed(chat_id, error) вызываются по мере отправки.
+        Возвращает словарь со статистикой рассылки.
+        """
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        for chat_id, text in messages:
+            # (чат, текст, сетевых повторов, ответов 429)
+            self.queue.put_nowait((chat_id, text, 0, 0))
+
+        self.pending = self.queue.qsize()
+        self.latencies = []
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'throttled': 0}
+
+        started = time.monotonic()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            if self.pending:
+                await self.done.wait()
+        finally:
+            for timer in self.timers:
+                timer.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return self._report(time.monotonic() - started)
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def cancel(self):
+        """Отменить рассылку: уже начатые отправки доработают, остальные выбрасываются"""
+        self.cancelled = True
+        for timer in self.timers:
+            timer.cancel()
+        self.pending -= len(self.timers)
+        self.timers.clear()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.pending -= 1
+        self.resumed.set()
+        if self.pending == 0:
+            self.done.set()
+
+    def _drop(self):
+        """Выбросить сообщение отменённой рассылки"""
+        self.pending -= 1
+        if self.pending == 0:
+            self.done.set()
+
+    def _later(self, delay, item):
+        """Вернуть сообщение в очередь через delay секунд"""
+        if self.cancelled:
+            self._drop()
+            return
+
+        loop = asyncio.get_running_loop()
+
+        def put():
+            self.timers.discard(timer)
+            self.queue.put_nowait(item)
+
+        timer = loop.call_later(delay, put)
+        self.timers.add(timer)
+
+    async def _complete(self, callback, *args):
+        self.pending -= 1
+        try:
+            if callback:
+                await resolve(callback(*args))
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике рассылки для {args[0]}: {e}")
+        finally:
+            if self.pending == 0:
+                self.done.set()
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            chat_id, text, attempt, throttled = item
+            await self.resumed.wait()
+            if self.cancelled:
+                self._drop()
+                continue
+
+            wait = self.lanes.get(chat_id, 0) - time.monotonic()
+            if wait > 0:
+                self._later(wait, item)
+                continue
+
+            if self.bucket:
+                await self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+
+            except RetryAfter as e:
+                # Ждём только в этом чате, остальные воркеры продолжают работу
+                self.stats['throttled'] += 1
+                self.lanes[chat_id] = time.monotonic() + e.retry_after
+                if throttled < self.max_throttled:
+                    self._later(e.retry_after, (chat_id, text, attempt, throttled + 1))
+                else:
+                    logger.error(f"Ошибка отправки {chat_id}: 429 {throttled + 1} раз подряд")
+                    self.stats['failed'] += 1
+                    await self._complete(self.on_failed, chat_id, e)
+
+            except NetworkError as e:
+                # TimedOut тоже NetworkError: повторяем с джиттером
+                if attempt < self.max_retries:
+                    self.stats['retried'] += 1
+                    delay = self.base_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+                    self._later(delay, (chat_id, text, attempt + 1, throttled))
+                else:
+                    logger.error(f"Ошибка отправки {chat_id}: {e}")
+                    self.stats['failed'] += 1
+                    await self._complete(self.on_failed, chat_id, e)
+
+            except Exception as e:
+                logger.error(f"Ошибка отправки {chat_id}: {e}")
+                self.stats['failed'] += 1
+                await self._complete(self.on_failed, chat_id, e)
+
+            else:
+                now = time.monotonic()
+                self.latencies.append(now - started)
+                self.lanes[chat_id] = now + self.per_chat_interval
+                self.stats['sent'] += 1
+                await self._complete(self.on_sent, chat_id)
+
+    def _report(self, elapsed):
+        latencies = sorted(self.latencies)
+        report = dict(self.stats)
+        report['elapsed'] = elapsed
+        report['rate'] = report['sent'] / elapsed if elapsed > 0 else 0.0
+        report['p50'] = percentile(latencies, 50) * 1000
+        report['p99'] = percentile(latencies, 99) * 1000
+        logger.info(
+            f"Рассылка: {report['sent']} отправлено, {report['failed']} ошибок, "
+            f"{report['rate']:.1f} сообщ./сек, p50 {report['p50']:.0f} мс, p99 {report['p99']:.0f} мс"
+        )
+        return report
+
+class BroadcastJob:
+    """
+    Рассылка в фоне. Список ещё не уведомлённых дарителей сохраняется в файл,
+    чтобы после перезапуска продолжить с того же места. Прогресс показывается
+    одним сообщением, которое периодически редактируется. Не доставленные
+    из-за 429 и сети (retry) тоже сохраняются: файл состояния остаётся и после
+    завершения, и после перезапуска рассылка повторит их.
+    """
+
+    def __init__(self, bot, chat_id, pending, render, on_sent,
+                 state_path=JOB_STATE_PATH, message_id=None, sent=0, failed=0, paused=False):
+        self.bot = bot
+        self.chat_id = chat_id  # куда показывать прогресс
+        self.pending = set(pending)
+        self.retry = set()  # временные ошибки: повторить при следующем запуске
+        self.total = len(self.pending) + sent + failed
+        self.render = render  # user_id -> текст уведомления или None (можно корутину)
+        self.on_sent = on_sent
+        self.state_path = state_path
+        self.message_id = message_id
+        self.sent = sent
+        self.failed = failed
+        self.paused = paused
+        self.cancelled = False
+        self.finished = False
+        self.engine = BroadcastEngine(bot)
+        if paused:
+            self.engine.pause()
+        self.task = None
+
+    @staticmethod
+    def read_state(state_path=JOB_STATE_PATH):
+        """Сохранённое состояние рассылки (или None) — без проверки участников"""
+        if not os.path.exists(state_path):
+            return None
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать состояние рассылки: {e}")
+            return None
+
+    @classmethod
+    async def restore(cls, bot, render, on_sent, is_pending, state_path=JOB_STATE_PATH, state=None):
+        """Восстановить незавершённую рассылку после перезапуска (или None)"""
+        if state is None:
+            state = cls.read_state(state_path)
+        if state is None:
+            return None
+
+        # Берём только тех, кто так и не получил уведомление, и повторяем недоставленных
+        pending = [user_id for user_id in state['pending'] + state.get('retry', [])
+                   if await resolve(is_pending(user_id))]
+        logger.info(f"Продолжаю рассылку: осталось {len(pending)} участников")
+        return cls(bot, state['chat_id'], pending, render, on_sent, state_path=state_path,
+                   message_id=state.get('message_id'), sent=state.get('sent', 0),
+                   failed=state.get('failed', 0), paused=state.get('paused', False))
+
+    def save(self):
+        state = {
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'pending': sorted(self.pending),
+            'retry': sorted(self.retry),
+            'sent': self.sent,
+            'failed': self.failed,
+            'paused': self.paused,
+        }
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self.task
+
+    def pause(self):
+        self.paused = True
+        self.engine.pause()
+        self.save()
+
+    def resume(self):
+        self.paused = False
+        self.engine.resume()
+        self.save()
+
+    def cancel(self):
+        self.cancelled = True
+        self.engine.cancel()
+
+    async def _sent(self, chat_id):
+        self.pending.discard(chat_id)
+        self.sent += 1
+        await resolve(self.on_sent(chat_id))
+
+    def _failed(self, chat_id, error):
+        self.pending.discard(chat_id)
+        if retryable(error):
+            self.retry.add(chat_id)
+        else:
+            # Бот заблокирован, чат удалён: повтор не поможет
+            self.failed += 1
+
+    def progress_text(self):
+        if self.finished:
+            status = "⏹ Отменена" if self.cancelled else "✅ Завершена"
+        elif self.paused:
+            status = "⏸ На паузе"
+        else:
+            status = "⏳ Идёт"
+        return (
+            f"🔔 **Рассылка уведомлений**\n\n"
+            f"Статус: {status}\n"
+            f"• Отправлено: {self.sent}/{self.total}\n"
+            f"• Ошибок: {self.failed}\n"
+            f"• Осталось: {len(self.pending)}"
+            + (f"\n• Повторю после перезапуска: {len(self.retry)}" if self.retry else "")
+        )
+
+    def progress_markup(self):
+        if self.finished:
+            return None
+        if self.paused:
+            toggle = InlineKeyboardButton("▶️ Продолжить", callback_data='broadcast:resume')
+        else:
+            toggle = InlineKeyboardButton("⏸ Пауза", callback_data='broadcast:pause')
+        cancel = InlineKeyboardButton("⏹ Отменить", callback_data='broadcast:cancel')
+        return InlineKeyboardMarkup([[toggle, cancel]])
+
+    async def show_progress(self):
+        """Отредактировать сообщение с прогрессом, если оно изменилось"""
+        text = self.progress_text()
+        if text == self._shown:
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id, message_id=self.message_id,
+                text=text, reply_markup=self.progress_markup()
+            )
+            self._shown = text
+        except Exception as e:
+            logger.error(f"Ошибка обновления прогресса рассылки: {e}")
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            self.save()
+            await self.show_progress()
+
+    async def _run(self):
+        # Запросы рассылки (и её прогресса) пропускают вперёд ответы пользователям
+        current_priority.set(BULK)
+        self._shown = None
+        if self.message_id is None:
+            message = await self.bot.send_message(
+                chat_id=self.chat_id, text=self.progress_text(), reply_markup=self.progress_markup()
+            )
+            self.message_id = message.message_id
+            self._shown = message.text
+        self.save()
+
+        messages = []
+        for user_id in sorted(self.pending):
+            text = await resolve(self.render(user_id))
+            if text:
+                messages.append((user_id, text))
+            else:
+                self.pending.discard(user_id)
+        self.total = len(messages) + self.sent + self.failed + len(self.retry)
+
+        reporter = asyncio.create_task(self._report_progress())
+        try:
+            await self.engine.run(messages, on_sent=self._sent, on_failed=self._failed)
+        finally:
+            reporter.cancel()
+
+        self.finished = True
+        if self.retry and not self.cancelled:
+            # Недоставленные остаются в файле: restore повторит их
+            self.save()
+        elif os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        await self.show_progress()
+
+
+class FakeBot:
+    """
+    Локальная замена Bot для замеров: задержка сети и 429,
+    если превышен глобальный лимит или лимит на один чат.
+    """
+
+    def __init__(self, latency=0.05, global_limit=30, chat_interval=1.0, retry_after=1):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.chat_interval = chat_interval
+        self.retry_after = retry_after
+        self.window = []
+        self.last_in_chat = {}
+        self.delivered = 0
+        self.rejected = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        now = time.monotonic()
+        self.window = [t for t in self.window if now - t < 1.0]
+        if len(self.window) >= self.global_limit or \
+                now - self.last_in_chat.get(chat_id, -self.chat_interval) < self.chat_interval:
+            self.rejected += 1
+            raise RetryAfter(self.retry_after)
+        self.window.append(now)
+        self.last_in_chat[chat_id] = now
+        self.delivered += 1
+        return SimpleNamespace(chat_id=chat_id, message_id=self.delivered, text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.edits += 1
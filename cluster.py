@@ -0,0 +1,281 @@
+"""Несколько рабочих процессов: раздача обновлений по user_id и общее состояние"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from processing import update_key
+
+logger = logging.getLogger(__name__)
+
+# Сколько живёт рекомендательная блокировка без продления, секунды
+LEASE_TTL = 30.0
+# Область версий для каталога событий (ID событий — hex, не пересекаются)
+CATALOG_SCOPE = '#catalog'
+# Как часто перечитывать версии из общей базы, секунды: изменения других
+# процессов видны с такой задержкой, зато обращение к событию не ждёт SQLite
+VERSION_POLL_INTERVAL = 0.5
+
+# Владелец блокировок этого процесса. У рабочего процесса имя постоянное
+# (WORKER_ID): перезапущенный процесс снимает блокировки прежнего (release_all)
+OWNER = os.environ.get('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+SQL_CLUSTER = '''
+    CREATE TABLE IF NOT EXISTS versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+'''
+SQL_VERSIONS = "SELECT scope, version FROM versions"
+SQL_BUMP = '''
+    INSERT INTO versions (scope, version) VALUES (?, 1)
+    ON CONFLICT(scope) DO UPDATE SET version = version + 1
+'''
+# Занять свободную или просроченную блокировку — одним выражением.
+# Занятую не получает и сам владелец: два обработчика одного процесса
+# не должны пройти одну блокировку вместе
+SQL_LOCK = '''
+    INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+    WHERE leases.expires < ?
+'''
+SQL_RENEW = "UPDATE leases SET expires = ? WHERE name = ? AND owner = ?"
+SQL_UNLOCK = "DELETE FROM leases WHERE name = ? AND owner = ?"
+SQL_RELEASE_ALL = "DELETE FROM leases WHERE owner = ?"
+
+
+def shard_of(update, workers):
+    """Номер рабочего процесса для обновления: все обновления пользователя — одному"""
+    key = update_key(update)
+    return key % workers if key is not None else 0
+
+
+class MemoryStore:
+    """
+    Общее состояние в памяти процесса: версии данных и блокировки.
+    Для одного процесса (WORKERS=0) и тестов.
+    """
+
+    def __init__(self):
+        self.scopes = {}  # область -> номер версии
+        self.leases = {}  # имя -> (владелец, истекает)
+
+    def version(self, scope):
+        return self.scopes.get(scope, 0)
+
+    def versions(self, *scopes):
+        return tuple(self.version(scope) for scope in scopes)
+
+    def bump(self, scope):
+        self.scopes[scope] = self.version(scope) + 1
+
+    def try_lock(self, name, owner=OWNER, ttl=LEASE_TTL):
+        """Занять блокировку, если она свободна или просрочена"""
+        now = time.time()
+        holder = self.leases.get(name)
+        if holder and holder[1] >= now:
+            return False
+        self.leases[name] = (owner, now + ttl)
+        return True
+
+    def renew(self, name, owner=OWNER, ttl=LEASE_TTL):
+        """Продлить свою блокировку; False — её уже занял другой"""
+        if self.leases.get(name, (None,))[0] != owner:
+            return False
+        self.leases[name] = (owner, time.time() + ttl)
+        return True
+
+    def unlock(self, name, owner=OWNER):
+        if self.leases.get(name, (None,))[0] == owner:
+            del self.leases[name]
+
+    def release_all(self, owner=OWNER):
+        """Снять все блокировки владельца (оставшиеся от упавшего процесса)"""
+        for name, holder in list(self.leases.items()):
+            if holder[0] == owner:
+                del self.leases[name]
+
+    def close(self):
+        pass
+
+
+class SqliteStore(MemoryStore):
+    """
+    Общее состояние рабочих процессов в файле SQLite рядом с базами событий.
+    Версия области растёт при изменениях, после которых другим процессам
+    нужно перечитать данные (распределение, сброс, каталог); версии всех
+    областей читаются одним запросом не чаще раза в poll_interval секунд.
+    Блокировка — аренда на ttl секунд: упавший процесс не держит её вечно.
+    """
+
+    def __init__(self, path, poll_interval=VERSION_POLL_INTERVAL):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQL_CLUSTER)
+        self.lock = threading.Lock()
+        self.poll_interval = poll_interval
+        self.polled = None  # monotonic-время последнего чтения версий
+        self.scopes = {}
+
+    def _poll(self):
+        now = time.monotonic()
+        if self.polled is not None and now - self.polled < self.poll_interval:
+            return
+        try:
+            with self.lock:
+                self.scopes = dict(self.conn.execute(SQL_VERSIONS))
+        except sqlite3.Error as e:
+            # Останутся прежние версии: перечитаем при следующем опросе
+            logger.error(f"Версии: {e}")
+        self.polled = now
+
+    def version(self, scope):
+        self._poll()
+        return super().version(scope)
+
+    def bump(self, scope):
+        with self.lock, self.conn:
+            self.conn.execute(SQL_BUMP, (scope,))
+        # Своё изменение видно сразу
+        self.polled = None
+
+    def try_lock(self, name, owner=OWNER, ttl=LEASE_TTL):
+        now = time.time()
+        try:
+            with self.lock, self.conn:
+                return self.conn.execute(SQL_LOCK, (name, owner, now + ttl, now)).rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Блокировка {name}: {e}")
+            return False
+
+    def renew(self, name, owner=OWNER, ttl=LEASE_TTL):
+        try:
+            with self.lock, self.conn:
+                return self.conn.execute(SQL_RENEW, (time.time() + ttl, name, owner)).rowcount == 1
+        except sqlite3.Error as e:
+            # Не смогли продлить — не значит, что блокировку перехватили: попробуем в следующий раз
+            logger.error(f"Блокировка {name}: {e}")
+            return True
+
+    def unlock(self, name, owner=OWNER):
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(SQL_UNLOCK, (name, owner))
+        except sqlite3.Error as e:
+            logger.error(f"Блокировка {name}: {e}")
+
+    def release_all(self, owner=OWNER):
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(SQL_RELEASE_ALL, (owner,))
+        except sqlite3.Error as e:
+            logger.error(f"Блокировки {owner}: {e}")
+
+    def close(self):
+        self.conn.close()
+
+
+async def hold_lease(store, name, task, ttl=LEASE_TTL):
+    """Продлевать блокировку, пока идёт task, затем снять её"""
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=ttl / 3)
+            if not task.done() and not store.renew(name, ttl=ttl):
+                logger.error(f"Блокировка {name} перехвачена другим процессом")
+                return
+    finally:
+        store.unlock(name)
+
+
+class UpdateFanout:
+    """Процесс приёма: обновление уходит в очередь рабочего процесса его пользователя"""
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.forwarded = [0] * len(queues)
+
+    async def forward(self, update, context):
+        worker = shard_of(update, len(self.queues))
+        self.queues[worker].put(update.to_dict())
+        self.forwarded[worker] += 1
+
+
+class WorkerPool:
+    """
+    Рабочие процессы, у каждого своя очередь обновлений. Процессы
+    запускаются через spawn: открытые базы родителя им не достаются.
+    Упавший процесс перезапускается с той же очередью и тем же WORKER_ID.
+    """
+
+    def __init__(self, target, count):
+        self.context = multiprocessing.get_context('spawn')
+        self.target = target  # target(index, queue), функция уровня модуля
+        self.queues = [self.context.Queue() for _ in range(count)]
+        self.processes = [None] * count
+        self.restarts = 0
+
+    def _spawn(self, index):
+        # spawn передаёт дочернему процессу текущее окружение
+        os.environ['WORKER_ID'] = f"{socket.gethostname()}:worker-{index}"
+        try:
+            process = self.context.Process(
+                target=self.target, args=(index, self.queues[index]), name=f'worker-{index}', daemon=True
+            )
+            process.start()
+        finally:
+            del os.environ['WORKER_ID']
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+        logger.info(f"Запущено рабочих процессов: {len(self.queues)}")
+
+    async def supervise(self, interval=5.0):
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error(f"Рабочий процесс {index} завершился (код {process.exitcode}), перезапускаю")
+                    self.restarts += 1
+                    self._spawn(index)
+
+    def stop(self, timeout=10.0):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+async def receive(source, handle):
+    """
+    Рабочий процесс: передавать обновления из очереди процессов source
+    в handle(data) в цикле событий (отдельный поток ждёт на source.get).
+    None в source — сигнал остановки.
+    """
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+
+    def pump():
+        while True:
+            data = source.get()
+            if data is None:
+                loop.call_soon_threadsafe(stopped.set_result, None)
+                return
+            loop.call_soon_threadsafe(handle, data)
+
+    threading.Thread(target=pump, name='updates', daemon=True).start()
+    await stopped
@@ -0,0 +1,71 @@
+"""Счётчики статистики, которые обновляются при каждом изменении данных"""
+import time
+from collections import deque
+
+HOUR = 3600
+
+
+class StatsCounters:
+    """
+    Счётчики для get_stats: всего участников, получили уведомление, дарители
+    и регистрации за последний час. Хранилище обновляет их в register,
+    mark_as_notified, distribute_gifts и reset_all, поэтому чтение — O(1)
+    (окно регистраций чистится по мере устаревания записей).
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.notified = 0
+        self.givers = 0
+        self.recent = deque()  # время новых регистраций за последний час
+
+    def registered(self, previous=None, at=None):
+        """
+        Регистрация. previous — (notified, is_giver) для повторной регистрации,
+        которая сбрасывает флаги участника, или None для нового участника.
+        """
+        if previous is None:
+            self.total += 1
+            self.recent.append(time.time() if at is None else at)
+        else:
+            was_notified, was_giver = previous
+            self.notified -= bool(was_notified)
+            self.givers -= bool(was_giver)
+
+    def marked_notified(self, count=1):
+        self.notified += count
+
+    def distributed(self, givers):
+        self.givers = givers
+        self.notified = 0
+
+    def reset(self):
+        self.total = 0
+        self.notified = 0
+        self.givers = 0
+        self.recent.clear()
+
+    def registrations_last_hour(self):
+        border = time.time() - HOUR
+        while self.recent and self.recent[0] < border:
+            self.recent.popleft()
+        return len(self.recent)
+
+    def snapshot(self, distributed):
+        return {
+            'total': self.total,
+            'distributed': distributed,
+            'notified': self.notified,
+            'remaining': self.total - self.notified,
+            'givers': self.givers,
+            'registrations_last_hour': self.registrations_last_hour()
+        }
+
+    def compare(self, expected):
+        """Сверить счётчики с пересчитанными с нуля значениями; вернуть расхождения"""
+        actual = self.snapshot(expected.get('distributed'))
+        return {
+            key: (actual[key], value)
+            for key, value in expected.items()
+            if key in actual and actual[key] != value
+        }
@@ -1,217 +1,1168 @@
+import asyncio
+import functools
 import sqlite3
 import logging
-import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from counters import StatsCounters
+from matching import Constraints, constrained_cycle, random_cycle
+from metrics import ERRORS, STORAGE_QUEUE_SECONDS, STORAGE_SECONDS
+from participants import ParticipantStore, ParticipantsView
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Как часто в общем режиме (shared) перечитывать PRAGMA data_version, секунды
+DATA_VERSION_POLL = 0.5
+
+# Запросы — константы: sqlite3 кэширует скомпилированные выражения
+# на соединении, поэтому на долгоживущем соединении они не парсятся повторно
+SQL_REGISTER = '''
+    INSERT INTO participants
+    (user_id, username, full_name, wish_text, not_wish_text, has_receiver, is_giver, notified)
+    VALUES (?, ?, ?, ?, ?, 0, 0, 0)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username, full_name = excluded.full_name,
+        wish_text = excluded.wish_text, not_wish_text = excluded.not_wish_text,
+        has_receiver = 0, is_giver = 0, notified = 0
+'''
+SQL_IS_REGISTERED = "SELECT 1 FROM participants WHERE user_id = ?"
+SQL_GET_INFO = "SELECT full_name, wish_text, not_wish_text FROM participants WHERE user_id = ?"
+SQL_GET_RECEIVER = '''
+    SELECT p.user_id, p.full_name, p.wish_text, p.not_wish_text
+    FROM santa_pairs sp
+    JOIN participants p ON p.user_id = sp.receiver_id
+    WHERE sp.giver_id = ?
+'''
+SQL_GET_GIVER = "SELECT giver_id FROM santa_pairs WHERE receiver_id = ?"
+SQL_MARK_NOTIFIED = "UPDATE participants SET notified = 1 WHERE user_id = ? AND notified = 0"
+SQL_IS_NOTIFIED = "SELECT notified FROM participants WHERE user_id = ?"
+SQL_GET_ALL = '''
+    SELECT user_id, full_name, wish_text, not_wish_text, username, has_receiver, is_giver, notified
+    FROM participants ORDER BY rowid
+'''
+SQL_PREVIOUS = "SELECT notified, is_giver FROM participants WHERE user_id = ?"
+SQL_RECOUNT = '''
+    SELECT COUNT(*), COALESCE(SUM(notified), 0), COALESCE(SUM(is_giver), 0),
+           COALESCE(SUM(created_at >= datetime('now', '-1 hour')), 0)
+    FROM participants
+'''
+SQL_PAIRS = "SELECT giver_id, receiver_id FROM santa_pairs"
+SQL_DRAW = '''
+    SELECT sp.giver_id, sp.receiver_id, r.full_name, r.wish_text, r.not_wish_text
+    FROM santa_pairs sp
+    JOIN participants r ON r.user_id = sp.receiver_id
+'''
+SQL_PAIR_INFO = '''
+    SELECT g.full_name, g.username, r.full_name, r.wish_text, r.not_wish_text, g.notified
+    FROM santa_pairs sp
+    JOIN participants g ON g.user_id = sp.giver_id
+    JOIN participants r ON r.user_id = sp.receiver_id
+    WHERE sp.giver_id = ?
+'''
+# Выгрузка участников с получателями, страницами по user_id
+SQL_EXPORT_PAGE = '''
+    SELECT p.user_id, p.username, p.full_name, p.wish_text, p.not_wish_text, p.notified,
+           r.user_id, r.full_name
+    FROM participants p
+    LEFT JOIN santa_pairs sp ON sp.giver_id = p.user_id
+    LEFT JOIN participants r ON r.user_id = sp.receiver_id
+    WHERE p.user_id > ? ORDER BY p.user_id LIMIT ?
+'''
+SQL_FIND_BY_USERNAME = "SELECT user_id FROM participants WHERE username = ?"
+SQL_SET_SETTING = "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)"
+SQL_GET_SETTING = "SELECT value FROM settings WHERE key = ?"
+SQL_DRAW_BY_KEY = "SELECT draw_id FROM draws WHERE request_key = ?"
+SQL_ADD_DRAW = "INSERT INTO draws (request_key, pairs) VALUES (?, ?)"
+
+
 class SantaDatabase:
-    def __init__(self, db_name='santa.db'):
+    """
+    Хранилище в SQLite с тем же API, что и MemoryDatabase.
+    Одно долгоживущее соединение в режиме WAL; pooled=False открывает
+    соединение на каждый вызов (только для сравнения в бенчмарке).
+    shared=True — базу одновременно меняют другие процессы (WORKERS):
+    статистика считается по базе, а флаг распределения и ограничения
+    перечитываются через refresh.
+    """
+
+    def __init__(self, db_name='santa.db', pooled=True, shared=False):
         self.db_name = db_name
+        self.pooled = pooled
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.conn = self._connect() if pooled else None
+        self.distribution_done = False
+        self.draw = 0  # номер текущей жеребьёвки (0 — не проводилась)
+        self.constraints = Constraints()
+        self.changes = 0  # Растёт при каждом изменении данных (для кэшей)
+        self.data_version = 0  # PRAGMA data_version при последнем опросе (общий режим)
+        self.data_version_read = 0.0
+        self.counters = StatsCounters()
         self.init_database()
-    
+
+    @property
+    def version(self):
+        """Версия данных для кэшей; в общем режиме учитывает и записи других процессов"""
+        if not self.shared:
+            return self.changes
+        # Читается из цикла событий: базу спрашиваем не чаще раза в DATA_VERSION_POLL
+        # секунд и не ждём поток хранилища, если он сейчас держит соединение
+        now = time.monotonic()
+        if now - self.data_version_read >= DATA_VERSION_POLL and self.lock.acquire(blocking=False):
+            try:
+                # data_version меняется, когда базу изменило другое соединение
+                self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+                self.data_version_read = now
+            except sqlite3.Error as e:
+                logger.error(f"Error: {e}")
+            finally:
+                self.lock.release()
+        return self.changes, self.data_version
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=128)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
-    
+        return self.conn if self.pooled else self._connect()
+
+    def _execute(self, sql, params=(), fetch=None, many=False):
+        """Выполнить запрос в транзакции; fetch: None, 'one' или 'all'"""
+        with self.lock:
+            conn = self.get_connection()
+            try:
+                with conn:
+                    cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+                    if fetch == 'one':
+                        return cursor.fetchone()
+                    if fetch == 'all':
+                        return cursor.fetchall()
+                    return cursor.rowcount
+            finally:
+                if not self.pooled:
+                    conn.close()
+
     def init_database(self):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Таблица участников
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS participants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    full_name TEXT NOT NULL,
-                    wish_text TEXT,
-                    not_wish_text TEXT,
-                    is_available BOOLEAN DEFAULT TRUE,  # Можно ли выбирать этого человека
-                    has_receiver BOOLEAN DEFAULT FALSE, # Есть ли у этого человека получатель
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица пар (кто кому дарит)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS santa_pairs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    giver_id INTEGER UNIQUE NOT NULL,   # Кто дарит (уникальный!)
-                    receiver_id INTEGER UNIQUE NOT NULL, # Кому дарит (уникальный!)
-                    paired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (giver_id) REFERENCES participants(user_id),
-                    FOREIGN KEY (receiver_id) REFERENCES participants(user_id)
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info("Database created")
-            
-        except sqlite3.Error as e:
-            logger.error(f"Error: {e}")
-    
-    def register_participant(self, user_id, username, full_name, wish_text=None, not_wish_text=None):
-        """Регистрация участника"""
+            with self.lock:
+                conn = self.get_connection()
+                conn.executescript('''
+                    -- Участники
+                    CREATE TABLE IF NOT EXISTS participants (
+                        user_id INTEGER PRIMARY KEY,
+                        username TEXT COLLATE NOCASE,
+                        full_name TEXT NOT NULL,
+                        wish_text TEXT,
+                        not_wish_text TEXT,
+                        has_receiver INTEGER NOT NULL DEFAULT 0,  -- есть ли у человека даритель
+                        is_giver INTEGER NOT NULL DEFAULT 0,      -- назначен ли ему получатель
+                        notified INTEGER NOT NULL DEFAULT 0,      -- получил ли уведомление
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_participants_username ON participants(username);
+
+                    -- Пары (кто кому дарит)
+                    CREATE TABLE IF NOT EXISTS santa_pairs (
+                        giver_id INTEGER PRIMARY KEY REFERENCES participants(user_id) ON DELETE CASCADE,
+                        receiver_id INTEGER UNIQUE NOT NULL REFERENCES participants(user_id) ON DELETE CASCADE,
+                        paired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+
+                    -- Ограничения распределения
+                    CREATE TABLE IF NOT EXISTS exclusions (
+                        giver_id INTEGER NOT NULL,
+                        receiver_id INTEGER NOT NULL,
+                        PRIMARY KEY (giver_id, receiver_id)
+                    ) WITHOUT ROWID;
+                    CREATE TABLE IF NOT EXISTS teams (
+                        user_id INTEGER PRIMARY KEY,
+                        tag TEXT NOT NULL
+                    );
+
+                    -- Жеребьёвки: пары текущей лежат в santa_pairs, номер — в settings.draw.
+                    -- request_key защищает от повторного запуска той же жеребьёвки
+                    CREATE TABLE IF NOT EXISTS draws (
+                        draw_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        request_key TEXT UNIQUE,
+                        pairs INTEGER NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+
+                    -- Флаги (распределение выполнено и т.п.)
+                    CREATE TABLE IF NOT EXISTS settings (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                    );
+                ''')
+                self._load_state(conn)
+
+                if not self.pooled:
+                    conn.close()
+            logger.info("Database ready")
+
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+
+    def _load_state(self, conn):
+        """Флаг распределения, счётчики и ограничения из базы"""
+        row = conn.execute(SQL_GET_SETTING, ('distribution_done',)).fetchone()
+        self.distribution_done = row is not None and row[0] == '1'
+        row = conn.execute(SQL_GET_SETTING, ('draw',)).fetchone()
+        self.draw = int(row[0]) if row else 0
+
+        # Счётчики статистики поднимаем при старте (и в refresh)
+        total, notified, givers, _ = conn.execute(SQL_RECOUNT).fetchone()
+        self.counters.reset()
+        self.counters.total = total
+        self.counters.notified = notified
+        self.counters.givers = givers
+        for (registered_at,) in conn.execute('''
+            SELECT CAST(strftime('%s', created_at) AS INTEGER) FROM participants
+            WHERE created_at >= datetime('now', '-1 hour') ORDER BY created_at
+        '''):
+            self.counters.recent.append(registered_at)
+
+        self.constraints.clear()
+        for giver_id, receiver_id in conn.execute("SELECT giver_id, receiver_id FROM exclusions"):
+            self.constraints.exclude(giver_id, receiver_id, mutual=False)
+        for user_id, tag in conn.execute("SELECT user_id, tag FROM teams"):
+            self.constraints.set_group(user_id, tag)
+
+    def refresh(self):
+        """Перечитать состояние, которое могли изменить другие процессы"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                '''INSERT OR REPLACE INTO participants 
-                   (user_id, username, full_name, wish_text, not_wish_text, is_available, has_receiver) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                (user_id, username, full_name, wish_text, not_wish_text, True, False)
-            )
-            
-            conn.commit()
-            conn.close()
+            with self.lock:
+                conn = self.get_connection()
+                try:
+                    self._load_state(conn)
+                finally:
+                    if not self.pooled:
+                        conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+
+    def register(self, user_id, username, full_name, wish=None, not_wish=None):
+        if self.register_many([(user_id, username, full_name, wish, not_wish)]):
             logger.info(f"Registered: {full_name}")
             return True
-            
+        return False
+
+    def register_many(self, rows):
+        """Пакетная регистрация одной транзакцией: rows — кортежи (user_id, username, full_name, wish, not_wish)"""
+        try:
+            with self.lock:
+                conn = self.get_connection()
+                try:
+                    with conn:
+                        # Прежние флаги нужны счётчикам: повторная регистрация их сбрасывает
+                        previous = []
+                        for row in rows:
+                            previous.append(conn.execute(SQL_PREVIOUS, (row[0],)).fetchone())
+                            conn.execute(SQL_REGISTER, row)
+                finally:
+                    if not self.pooled:
+                        conn.close()
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return False
-    
+
+        for state in previous:
+            self.counters.registered(state)
+        self.changes += 1
+        return True
+
     def is_registered(self, user_id):
-        """Проверка регистрации"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM participants WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result is not None
+            return self._execute(SQL_IS_REGISTERED, (user_id,), fetch='one') is not None
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return False
-    
-    def get_participant_info(self, user_id):
-        """Информация об участнике"""
+
+    def get_info(self, user_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT full_name, wish_text, not_wish_text FROM participants WHERE user_id = ?",
-                (user_id,)
-            )
-            result = cursor.fetchone()
-            conn.close()
-            return result
+            return self._execute(SQL_GET_INFO, (user_id,), fetch='one')
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return None
-    
-    def assign_receiver(self, giver_id):
+
+    def can_distribute(self):
+        """Можно ли выполнить распределение?"""
+        return self.get_stats()['total'] >= 2 and not self.distribution_done
+
+    def distribute_gifts(self, key=None):
         """
-        Назначить уникального получателя для дарителя
-        Возвращает (receiver_id, full_name, wish_text, not_wish_text) или None
+        Провести жеребьёвку: пары считаются в памяти и вместе с записью
+        в draws фиксируются одной транзакцией — после сбоя в базе либо
+        вся жеребьёвка, либо ничего. key — ключ запроса: повтор с ключом
+        уже проведённой жеребьёвки возвращает True и ничего не меняет.
+        UnsatisfiableError пробрасывается наружу.
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Проверяем, не назначен ли уже получатель
-            cursor.execute(
-                "SELECT receiver_id FROM santa_pairs WHERE giver_id = ?",
-                (giver_id,)
-            )
-            existing = cursor.fetchone()
-            if existing:
-                conn.close()
-                return None  # Уже есть получатель
-            
-            # Ищем доступного получателя, у которого ЕЩЁ НЕТ дарителя
-            cursor.execute('''
-                SELECT p.user_id, p.full_name, p.wish_text, p.not_wish_text 
-                FROM participants p
-                LEFT JOIN santa_pairs sp ON sp.receiver_id = p.user_id
-                WHERE p.user_id != ? 
-                AND p.is_available = TRUE
-                AND sp.receiver_id IS NULL  # У этого человека ещё нет дарителя
-                AND p.has_receiver = FALSE  # Ещё не назначен как получатель
-            ''', (giver_id,))
-            
-            available_receivers = cursor.fetchall()
-            
-            if not available_receivers:
-                conn.close()
-                return None
-            
-            # Выбираем случайного получателя
-            receiver = random.choice(available_receivers)
-            receiver_id, full_name, wish_text, not_wish_text = receiver
-            
-            # Создаём пару
-            cursor.execute(
-                "INSERT INTO santa_pairs (giver_id, receiver_id) VALUES (?, ?)",
-                (giver_id, receiver_id)
-            )
-            
-            # Помечаем получателя как "имеющего дарителя"
-            cursor.execute(
-                "UPDATE participants SET has_receiver = TRUE WHERE user_id = ?",
-                (receiver_id,)
-            )
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"Assigned receiver {receiver_id} to giver {giver_id}")
-            
-            return (receiver_id, full_name, wish_text, not_wish_text)
-            
+            with self.lock:
+                conn = self.get_connection()
+                try:
+                    with conn:
+                        # Блокировка записи до чтения: другой процесс не проведёт жеребьёвку параллельно
+                        conn.execute("BEGIN IMMEDIATE")
+                        row = conn.execute(SQL_GET_SETTING, ('draw',)).fetchone()
+                        current = int(row[0]) if row else 0
+                        row = conn.execute(SQL_DRAW_BY_KEY, (key,)).fetchone() if key else None
+                        if row is not None:
+                            return row[0] == current
+                        row = conn.execute(SQL_GET_SETTING, ('distribution_done',)).fetchone()
+                        if row is not None and row[0] == '1':
+                            return False
+
+                        participants = [row[0] for row in conn.execute("SELECT user_id FROM participants")]
+                        if len(participants) < 2:
+                            return False
+                        if self.constraints:
+                            assignment = constrained_cycle(participants, self.constraints)
+                        else:
+                            assignment = random_cycle(participants)
+
+                        conn.execute("DELETE FROM santa_pairs")
+                        conn.executemany(
+                            "INSERT INTO santa_pairs (giver_id, receiver_id) VALUES (?, ?)",
+                            assignment.giver_to_receiver.items()
+                        )
+                        conn.execute('''
+                            UPDATE participants SET
+                                is_giver = user_id IN (SELECT giver_id FROM santa_pairs),
+                                has_receiver = user_id IN (SELECT receiver_id FROM santa_pairs),
+                                notified = 0
+                        ''')
+                        draw = conn.execute(SQL_ADD_DRAW, (key, len(assignment))).lastrowid
+                        conn.execute(SQL_SET_SETTING, ('draw', str(draw)))
+                        conn.execute(SQL_SET_SETTING, ('distribution_done', '1'))
+                finally:
+                    if not self.pooled:
+                        conn.close()
+
+            self.distribution_done = True
+            self.draw = draw
+            self.counters.distributed(len(assignment))
+            self.changes += 1
+            logger.info(f"Жеребьёвка {draw}: распределение выполнено для {len(assignment)} участников")
+            return True
+
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return False
+
+    def get_receiver_for_giver(self, giver_id):
+        """Получить получателя для дарителя: (receiver_id, full_name, wish, not_wish)"""
+        try:
+            return self._execute(SQL_GET_RECEIVER, (giver_id,), fetch='one')
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return None
-    
-    def get_assigned_receiver(self, giver_id):
-        """Получить назначенного получателя"""
+
+    def get_giver_for_receiver(self, receiver_id):
+        """Кто дарит подарок этому участнику"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT p.full_name, p.wish_text, p.not_wish_text
-                FROM santa_pairs sp
-                JOIN participants p ON p.user_id = sp.receiver_id
-                WHERE sp.giver_id = ?
-            ''', (giver_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result  # (full_name, wish_text, not_wish_text)
+            row = self._execute(SQL_GET_GIVER, (receiver_id,), fetch='one')
+            return row[0] if row else None
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return None
-    
-    def reset_all_assignments(self):
-        """Сбросить все назначения"""
+
+    def mark_as_notified(self, user_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM santa_pairs")
-            cursor.execute("UPDATE participants SET has_receiver = FALSE")
-            conn.commit()
-            conn.close()
-            logger.info("All assignments reset")
+            self.counters.marked_notified(self._execute(SQL_MARK_NOTIFIED, (user_id,)))
+            self.changes += 1
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+
+    def mark_many_as_notified(self, user_ids):
+        try:
+            updated = self._execute(SQL_MARK_NOTIFIED, [(user_id,) for user_id in user_ids], many=True)
+            self.counters.marked_notified(updated)
+            self.changes += 1
             return True
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return False
-    
-    def get_all_participants(self):
-        """Все участники для статистики"""
+
+    def is_notified(self, user_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM participants ORDER BY full_name")
-            participants = cursor.fetchall()
-            conn.close()
-            return participants
+            row = self._execute(SQL_IS_NOTIFIED, (user_id,), fetch='one')
+            return bool(row and row[0])
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return False
+
+    def reset_all(self):
+        """Полный сброс"""
+        try:
+            with self.lock:
+                conn = self.get_connection()
+                try:
+                    with conn:
+                        conn.execute("DELETE FROM santa_pairs")
+                        conn.execute("DELETE FROM participants")
+                        conn.execute("DELETE FROM exclusions")
+                        conn.execute("DELETE FROM teams")
+                        conn.execute(SQL_SET_SETTING, ('distribution_done', '0'))
+                        # История жеребьёвок остаётся: старый ключ не запустит новую
+                        conn.execute(SQL_SET_SETTING, ('draw', '0'))
+                finally:
+                    if not self.pooled:
+                        conn.close()
+            self.distribution_done = False
+            self.draw = 0
+            self.constraints.clear()
+            self.counters.reset()
+            self.changes += 1
+            logger.info("Все данные сброшены")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return False
+
+    def get_all(self):
+        """Все участники в том же виде, что и в памяти: user_id -> данные"""
+        try:
+            rows = self._execute(SQL_GET_ALL, fetch='all')
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return {}
+
+        return {
+            user_id: {
+                'name': full_name,
+                'wish': wish,
+                'not_wish': not_wish,
+                'username': username,
+                'has_receiver': bool(has_receiver),
+                'is_giver': bool(is_giver),
+                'notified': bool(notified)
+            }
+            for user_id, full_name, wish, not_wish, username, has_receiver, is_giver, notified in rows
+        }
+
+    def get_pairs(self):
+        """Все пары текущей жеребьёвки одним запросом: giver_id -> receiver_id"""
+        try:
+            return dict(self._execute(SQL_PAIRS, fetch='all'))
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return {}
+
+    def get_draw(self):
+        """Пары с анкетами получателей одним запросом: [(giver_id, receiver_id, full_name, wish, not_wish)]"""
+        try:
+            return self._execute(SQL_DRAW, fetch='all')
         except sqlite3.Error as e:
             logger.error(f"Error: {e}")
             return []
 
-if __name__ == "__main__":
-    print("Testing database...")
-    db = SantaDatabase()
-    print("Database ready")
+    def export_page(self, cursor, limit):
+        """
+        Страница выгрузки: (строки, курсор следующей страницы или None).
+        Строка — (user_id, username, full_name, wish, not_wish, notified,
+        receiver_id, receiver_name); курсор — последний выданный user_id.
+        """
+        try:
+            rows = self._execute(SQL_EXPORT_PAGE, (-2**63 if cursor is None else cursor, limit), fetch='all')
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return [], None
+        return rows, (rows[-1][0] if len(rows) == limit else None)
+
+    def get_stats(self):
+        """Статистика из счётчиков, без запросов к базе (в общем режиме — по базе)"""
+        if not self.shared:
+            return self.counters.snapshot(self.distribution_done)
+        try:
+            total, notified, givers, last_hour = self._execute(SQL_RECOUNT, fetch='one')
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return self.counters.snapshot(self.distribution_done)
+        return {
+            'total': total,
+            'distributed': self.distribution_done,
+            'notified': notified,
+            'remaining': total - notified,
+            'givers': givers,
+            'registrations_last_hour': last_hour
+        }
+
+    def check_stats(self):
+        """Пересчитать статистику с нуля и вернуть расхождения со счётчиками"""
+        total, notified, givers, last_hour = self._execute(SQL_RECOUNT, fetch='one')
+        return self.counters.compare({
+            'total': total,
+            'notified': notified,
+            'remaining': total - notified,
+            'givers': givers,
+            'registrations_last_hour': last_hour
+        })
+
+    def get_pair_info(self, giver_id):
+        """Полная информация о паре (для администратора)"""
+        try:
+            row = self._execute(SQL_PAIR_INFO, (giver_id,), fetch='one')
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return None
+
+        if not row:
+            return None
+
+        giver_name, giver_username, receiver_name, receiver_wish, receiver_not_wish, notified = row
+        return {
+            'giver_name': giver_name,
+            'giver_username': giver_username,
+            'receiver_name': receiver_name,
+            'receiver_wish': receiver_wish,
+            'receiver_not_wish': receiver_not_wish,
+            'notified': bool(notified)
+        }
+
+    def find_participant(self, ref):
+        """Найти участника по ID или @username"""
+        ref = ref.strip()
+        if ref.lstrip('-').isdigit():
+            user_id = int(ref)
+            return user_id if self.is_registered(user_id) else None
+
+        try:
+            row = self._execute(SQL_FIND_BY_USERNAME, (ref.lstrip('@'),), fetch='one')
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return None
+
+    def add_exclusion(self, giver_id, receiver_id, mutual=True):
+        """Запретить giver_id дарить receiver_id (и наоборот, если mutual)"""
+        rows = [(giver_id, receiver_id)]
+        if mutual:
+            rows.append((receiver_id, giver_id))
+        try:
+            self._execute("INSERT OR IGNORE INTO exclusions (giver_id, receiver_id) VALUES (?, ?)", rows, many=True)
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return False
+        self.constraints.exclude(giver_id, receiver_id, mutual)
+        return True
+
+    def set_team(self, user_id, tag):
+        """Указать команду участника (None — убрать из команды)"""
+        try:
+            if tag is None:
+                self._execute("DELETE FROM teams WHERE user_id = ?", (user_id,))
+            else:
+                self._execute("INSERT OR REPLACE INTO teams (user_id, tag) VALUES (?, ?)", (user_id, tag))
+        except sqlite3.Error as e:
+            logger.error(f"Error: {e}")
+            return False
+        self.constraints.set_group(user_id, tag)
+        return True
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+class CachedDatabase:
+    """
+    Кэш перед SQLite для горячих путей ('📝 Моя анкета', '🎁 Кому я дарю подарок?').
+    Анкеты и карточки получателей читаются через кэш; регистрации и отметки
+    об уведомлении копятся в памяти и записываются пачкой раз в
+    flush_interval секунд, при переполнении буфера и при остановке.
+    Операции над всеми участниками сначала сбрасывают буфер.
+    """
+
+    def __init__(self, backend, flush_interval=2.0, max_pending=500):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.profiles = {}  # user_id -> (full_name, wish, not_wish) или None, если не зарегистрирован
+        self.pairs = None  # giver_id -> receiver_id текущей жеребьёвки (читается одним запросом)
+        self.givers = None  # receiver_id -> giver_id той же жеребьёвки
+        self.notified = {}  # user_id -> bool
+        self.pending_registrations = {}  # user_id -> строка для register_many
+        self.pending_notified = set()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.changes = 0  # Все изменения идут через кэш, поэтому версию считаем здесь
+
+    @property
+    def distribution_done(self):
+        return self.backend.distribution_done
+
+    @property
+    def constraints(self):
+        return self.backend.constraints
+
+    @property
+    def version(self):
+        return self.changes
+
+    def flush(self):
+        """Записать накопленные изменения одной пачкой"""
+        if self.pending_registrations:
+            rows = list(self.pending_registrations.values())
+            if self.backend.register_many(rows):
+                self.pending_registrations.clear()
+        if self.pending_notified:
+            if self.backend.mark_many_as_notified(self.pending_notified):
+                self.pending_notified.clear()
+        self.flushes += 1
+
+    def _maybe_flush(self):
+        if len(self.pending_registrations) + len(self.pending_notified) >= self.max_pending:
+            self.flush()
+
+    def _invalidate(self):
+        self.profiles.clear()
+        self.pairs = self.givers = None
+        self.notified.clear()
+
+    def _draw(self):
+        """
+        Пары текущей жеребьёвки в обе стороны: (giver -> receiver, receiver -> giver).
+        Загружаются целиком при первом обращении вместе с анкетами получателей,
+        так что карточка получателя и «кто дарит мне» — поиск в словаре.
+        """
+        if self.pairs is not None:
+            return self.pairs, self.givers
+        pairs, givers = {}, {}
+        for giver_id, receiver_id, *profile in self.backend.get_draw():
+            pairs[giver_id] = receiver_id
+            givers[receiver_id] = giver_id
+            # Незаписанные регистрации уже лежат в profiles и новее базы
+            self.profiles.setdefault(receiver_id, tuple(profile))
+        # Пустой ответ после распределения — ошибка чтения: не кэшируем
+        if pairs or not self.distribution_done:
+            self.pairs, self.givers = pairs, givers
+        return pairs, givers
+
+    def cache_stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'pending': len(self.pending_registrations) + len(self.pending_notified),
+            'flushes': self.flushes
+        }
+
+    def register_many(self, rows):
+        """Пакетная регистрация мимо буфера: сначала пишем накопленное"""
+        self.flush()
+        self._invalidate()
+        self.changes += 1
+        return self.backend.register_many(rows)
+
+    def register(self, user_id, username, full_name, wish=None, not_wish=None):
+        self.pending_registrations[user_id] = (user_id, username, full_name, wish, not_wish)
+        self.pending_notified.discard(user_id)
+        self.profiles[user_id] = (full_name, wish, not_wish)
+        self.notified[user_id] = False
+        self.changes += 1
+        logger.info(f"Registered: {full_name}")
+        self._maybe_flush()
+        return True
+
+    def get_info(self, user_id):
+        if user_id in self.profiles:
+            self.hits += 1
+            return self.profiles[user_id]
+        self.misses += 1
+        info = self.backend.get_info(user_id)
+        self.profiles[user_id] = tuple(info) if info else None
+        return self.profiles[user_id]
+
+    def is_registered(self, user_id):
+        return self.get_info(user_id) is not None
+
+    def get_receiver_for_giver(self, giver_id):
+        # Получатель — из пар жеребьёвки, анкета — из кэша анкет (с учётом ещё не записанных)
+        receiver_id = self._draw()[0].get(giver_id)
+        if receiver_id is None:
+            return None
+        info = self.get_info(receiver_id)
+        return (receiver_id, *info) if info else None
+
+    def mark_as_notified(self, user_id):
+        self.notified[user_id] = True
+        self.pending_notified.add(user_id)
+        self.changes += 1
+        self._maybe_flush()
+
+    def is_notified(self, user_id):
+        if user_id in self.notified:
+            self.hits += 1
+            return self.notified[user_id]
+        self.misses += 1
+        self.notified[user_id] = self.backend.is_notified(user_id)
+        return self.notified[user_id]
+
+    def can_distribute(self):
+        self.flush()
+        return self.backend.can_distribute()
+
+    def distribute_gifts(self, key=None):
+        self.flush()
+        try:
+            return self.backend.distribute_gifts(key)
+        finally:
+            self.pairs = self.givers = None
+            self.notified.clear()
+            self.changes += 1
+
+    def reset_all(self):
+        self.pending_registrations.clear()
+        self.pending_notified.clear()
+        self._invalidate()
+        self.changes += 1
+        return self.backend.reset_all()
+
+    def get_giver_for_receiver(self, receiver_id):
+        return self._draw()[1].get(receiver_id)
+
+    def get_all(self):
+        self.flush()
+        return self.backend.get_all()
+
+    def get_pairs(self):
+        return dict(self._draw()[0])
+
+    def export_page(self, cursor, limit):
+        self.flush()
+        return self.backend.export_page(cursor, limit)
+
+    def get_stats(self):
+        self.flush()
+        return self.backend.get_stats()
+
+    def check_stats(self):
+        self.flush()
+        return self.backend.check_stats()
+
+    def get_pair_info(self, giver_id):
+        self.flush()
+        return self.backend.get_pair_info(giver_id)
+
+    def find_participant(self, ref):
+        self.flush()
+        return self.backend.find_participant(ref)
+
+    def add_exclusion(self, giver_id, receiver_id, mutual=True):
+        return self.backend.add_exclusion(giver_id, receiver_id, mutual)
+
+    def set_team(self, user_id, tag):
+        return self.backend.set_team(user_id, tag)
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+
+class MemoryDatabase:
+    """
+    Хранилище участников в памяти (STORAGE=memory и STORAGE=journal).
+    Участники — в ParticipantStore; с журналом (attach_journal) каждое
+    изменение пишется в него и переживает перезапуск.
+    """
+
+    def __init__(self):
+        self.participants = ParticipantStore()  # user_id -> слот; анкеты, флаги и пары по слотам
+        self.distribution_done = False  # Распределение выполнено?
+        self.draw = 0  # Номер последней жеребьёвки
+        self.draw_keys = {}  # Ключ запроса -> номер жеребьёвки (повтор запроса не перераспределяет)
+        self.constraints = Constraints()  # Кому кого нельзя назначать
+        self.version = 0  # Растёт при каждом изменении данных (для кэшей)
+        self.counters = StatsCounters()  # Статистика без обхода всех участников
+        self.journal = None  # Журнал изменений (None — только память)
+
+    def attach_journal(self, journal):
+        """Восстановить данные из снимка и журнала и дальше записывать в него изменения"""
+        state, records = journal.recover()
+        if state is not None:
+            self.restore(state)
+        for record in records:
+            self.apply(record)
+        self.journal = journal
+        logger.info(f"Восстановлено участников: {len(self.participants)}, записей журнала: {len(records)}")
+
+    def _log(self, *record):
+        if self.journal is not None:
+            self.journal.append(record)
+
+    def apply(self, record):
+        """Повторить операцию из журнала"""
+        operation, *args = record
+        if operation == 'register':
+            self._register(*args)
+        elif operation == 'distribute':
+            # Записи до появления ключа жеребьёвки — без него
+            self._assign(dict(zip(args[0], args[1])), *args[2:])
+        elif operation == 'notified':
+            self.mark_as_notified(*args)
+        elif operation == 'reset':
+            self.reset_all()
+        elif operation == 'exclude':
+            self.add_exclusion(*args)
+        elif operation == 'team':
+            self.set_team(*args)
+        else:
+            logger.error(f"Неизвестная операция в журнале: {operation}")
+
+    def dump(self):
+        """Полное состояние для снимка"""
+        return {
+            'participants': self.participants.dump(),
+            'distribution_done': self.distribution_done,
+            'draw': self.draw,
+            'draw_keys': self.draw_keys,
+            'version': self.version,
+            'exclusions': self.constraints.exclusions,
+            'groups': self.constraints.groups,
+            'recent': list(self.counters.recent)
+        }
+
+    def restore(self, state):
+        self.participants.load(state['participants'])
+        self.distribution_done = state['distribution_done']
+        self.draw = state.get('draw', int(self.distribution_done))
+        self.draw_keys = state.get('draw_keys', {})
+        self.version = state['version']
+        self.constraints.exclusions = state['exclusions']
+        self.constraints.groups = state['groups']
+        self.counters.total = len(self.participants)
+        self.counters.notified = self.participants.notified.count()
+        self.counters.givers = self.participants.is_giver.count()
+        self.counters.recent.extend(state['recent'])
+
+    def flush(self):
+        """fsync журнала; при длинном журнале — новый снимок"""
+        if self.journal is None:
+            return
+        if self.journal.needs_snapshot():
+            self.journal.write_snapshot(self.dump())
+        self.journal.sync()
+
+    def close(self):
+        if self.journal is not None:
+            # При штатной остановке — снимок: следующий старт не переигрывает журнал
+            if self.journal.since_snapshot:
+                self.journal.write_snapshot(self.dump())
+            self.journal.close()
+
+    def register(self, user_id, username, full_name, wish=None, not_wish=None):
+        at = time.time()
+        self._log('register', user_id, username, full_name, wish, not_wish, at)
+        self._register(user_id, username, full_name, wish, not_wish, at)
+        logger.info(f"Registered: {full_name}")
+        return True
+
+    def register_many(self, rows):
+        """Пакетная регистрация: rows — кортежи (user_id, username, full_name, wish, not_wish)"""
+        at = time.time()
+        for row in rows:
+            self._log('register', *row, at)
+            self._register(*row, at)
+        logger.info(f"Зарегистрировано пакетом: {len(rows)}")
+        return True
+
+    def _register(self, user_id, username, full_name, wish, not_wish, at):
+        previous = self.participants.put(user_id, username, full_name, wish, not_wish)
+        self.counters.registered(previous, at)
+        self.version += 1
+
+    def is_registered(self, user_id):
+        return user_id in self.participants
+
+    def get_info(self, user_id):
+        return self.participants.profile(user_id)
+
+    def can_distribute(self):
+        """Можно ли выполнить распределение?"""
+        return len(self.participants) >= 2 and not self.distribution_done
+
+    def distribute_gifts(self, key=None):
+        """
+        Распределить подарки между всеми участниками. Жеребьёвка пишется
+        в журнал одной записью. key — ключ запроса: повтор с ключом
+        текущей жеребьёвки возвращает True и ничего не меняет.
+        """
+        if key in self.draw_keys:
+            return self.distribution_done and self.draw_keys[key] == self.draw
+        if self.distribution_done:
+            return False
+
+        if len(self.participants) < 2:
+            return False
+
+        # Один случайный цикл: каждый дарит следующему, никто не дарит сам себе.
+        # При невыполнимых ограничениях constrained_cycle бросает UnsatisfiableError
+        if self.constraints:
+            assignment = constrained_cycle(self.participants, self.constraints)
+        else:
+            assignment = random_cycle(self.participants)
+
+        pairs = assignment.giver_to_receiver
+        self._log('distribute', list(pairs), list(pairs.values()), key)
+        self._assign(pairs, key)
+        logger.info(f"Распределение выполнено для {len(pairs)} участников")
+        return True
+
+    def _assign(self, pairs, key=None):
+        # Пары и статусы всех участников
+        self.participants.assign(pairs)
+        self.distribution_done = True
+        self.draw += 1
+        if key is not None:
+            self.draw_keys[key] = self.draw
+        self.counters.distributed(len(pairs))
+        self.version += 1
+
+    def get_receiver_for_giver(self, giver_id):
+        """Получить получателя для дарителя"""
+        receiver_id = self.participants.receiver_of(giver_id)
+        if receiver_id is None:
+            return None
+
+        return (receiver_id, *self.participants.profile(receiver_id))
+
+    def get_giver_for_receiver(self, receiver_id):
+        """Кто дарит подарок этому участнику"""
+        return self.participants.giver_of(receiver_id)
+
+    def mark_as_notified(self, user_id):
+        """Пометить что пользователь получил уведомление"""
+        if self.participants.mark_notified(user_id):
+            self._log('notified', user_id)
+            self.counters.marked_notified()
+            self.version += 1
+
+    def is_notified(self, user_id):
+        """Проверил ли пользователь своего получателя?"""
+        return self.participants.is_notified(user_id)
+
+    def reset_all(self):
+        """Полный сброс"""
+        self._log('reset')
+        self.participants.clear()
+        self.constraints.clear()
+        self.distribution_done = False
+        self.counters.reset()
+        self.version += 1
+        logger.info("Все данные сброшены")
+        return True
+
+    def get_all(self):
+        """Все участники: user_id -> данные (только чтение)"""
+        return ParticipantsView(self.participants)
+
+    def get_pairs(self):
+        """Все пары: giver_id -> receiver_id"""
+        return self.participants.pairs()
+
+    def find_participant(self, ref):
+        """Найти участника по ID или @username"""
+        ref = ref.strip()
+        if ref.lstrip('-').isdigit():
+            user_id = int(ref)
+            return user_id if user_id in self.participants else None
+
+        return self.participants.find_username(ref.lstrip('@').lower())
+
+    def add_exclusion(self, giver_id, receiver_id, mutual=True):
+        """Запретить giver_id дарить receiver_id (и наоборот, если mutual)"""
+        self._log('exclude', giver_id, receiver_id, mutual)
+        self.constraints.exclude(giver_id, receiver_id, mutual)
+        return True
+
+    def set_team(self, user_id, tag):
+        """Указать команду участника (None — убрать из команды)"""
+        self._log('team', user_id, tag)
+        self.constraints.set_group(user_id, tag)
+        return True
+
+    def export_page(self, cursor, limit):
+        """Страница выгрузки: (строки, курсор следующей страницы или None); курсор — номер слота"""
+        start = cursor or 0
+        stop = min(start + limit, len(self.participants))
+        rows = list(self.participants.export_rows(start, stop))
+        return rows, (stop if stop < len(self.participants) else None)
+
+    def get_stats(self):
+        return self.counters.snapshot(self.distribution_done)
+
+    def check_stats(self):
+        """Пересчитать статистику с нуля и вернуть расхождения со счётчиками"""
+        total = len(self.participants)
+        notified = self.participants.notified.count()
+        givers = self.participants.is_giver.count()
+
+        return self.counters.compare({
+            'total': total,
+            'notified': notified,
+            'remaining': total - notified,
+            'givers': givers
+        })
+
+    def get_pair_info(self, giver_id):
+        """Полная информация о паре (для администратора)"""
+        receiver_id = self.participants.receiver_of(giver_id)
+        if receiver_id is None:
+            return None
+
+        giver = self.participants.get(giver_id)
+        receiver = self.participants.get(receiver_id)
+
+        return {
+            'giver_name': giver['name'],
+            'giver_username': giver['username'],
+            'receiver_name': receiver['name'],
+            'receiver_wish': receiver['wish'],
+            'receiver_not_wish': receiver['not_wish'],
+            'notified': giver['notified']
+        }
+
+
+def _timed(func, *args, **kwargs):
+    """Вызов в потоке хранилища: возвращает и момент начала (для времени ожидания)"""
+    return time.perf_counter(), func(*args, **kwargs)
+
+
+class AsyncStorage:
+    """
+    Асинхронный фасад над хранилищем для обработчиков бота.
+    Блокирующие вызовы SQLite уходят в отдельный поток, чтобы не
+    останавливать цикл событий; хранилище в памяти вызывается напрямую.
+    Обновления обрабатываются параллельно, но каждый вызов атомарен: все
+    обращения к SQLite и кэшу идут через один поток, а методы хранилища
+    в памяти не уступают управление циклу событий.
+    """
+
+    def __init__(self, backend, blocking=True, executor=None):
+        self.backend = backend
+        # Один поток: все обращения к соединению идут последовательно.
+        # executor — общий поток для нескольких хранилищ (events.py)
+        self.own_executor = blocking and executor is None
+        if blocking:
+            self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+        else:
+            self.executor = None
+
+    async def _call(self, func, *args, **kwargs):
+        queued = time.perf_counter()
+        try:
+            if self.executor is None:
+                return func(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            started, result = await loop.run_in_executor(self.executor, functools.partial(_timed, func, *args, **kwargs))
+            STORAGE_QUEUE_SECONDS.observe(started - queued)
+            return result
+        except Exception as e:
+            ERRORS.inc('storage', type(e).__name__)
+            raise
+        finally:
+            STORAGE_SECONDS.observe(time.perf_counter() - queued, func.__name__)
+
+    @property
+    def distribution_done(self):
+        return self.backend.distribution_done
+
+    @property
+    def version(self):
+        return self.backend.version
+
+    async def register(self, user_id, username, full_name, wish=None, not_wish=None):
+        return await self._call(self.backend.register, user_id, username, full_name, wish, not_wish)
+
+    async def register_many(self, rows):
+        return await self._call(self.backend.register_many, rows)
+
+    async def is_registered(self, user_id):
+        return await self._call(self.backend.is_registered, user_id)
+
+    async def get_info(self, user_id):
+        return await self._call(self.backend.get_info, user_id)
+
+    async def can_distribute(self):
+        return await self._call(self.backend.can_distribute)
+
+    async def distribute_gifts(self, key=None):
+        return await self._call(self.backend.distribute_gifts, key)
+
+    async def get_receiver_for_giver(self, giver_id):
+        return await self._call(self.backend.get_receiver_for_giver, giver_id)
+
+    async def get_giver_for_receiver(self, receiver_id):
+        return await self._call(self.backend.get_giver_for_receiver, receiver_id)
+
+    async def mark_as_notified(self, user_id):
+        return await self._call(self.backend.mark_as_notified, user_id)
+
+    async def is_notified(self, user_id):
+        return await self._call(self.backend.is_notified, user_id)
+
+    async def reset_all(self):
+        return await self._call(self.backend.reset_all)
+
+    async def get_all(self):
+        return await self._call(self.backend.get_all)
+
+    async def get_pairs(self):
+        return await self._call(self.backend.get_pairs)
+
+    async def export_page(self, cursor, limit):
+        return await self._call(self.backend.export_page, cursor, limit)
+
+    async def get_stats(self):
+        return await self._call(self.backend.get_stats)
+
+    async def check_stats(self):
+        return await self._call(self.backend.check_stats)
+
+    async def get_pair_info(self, giver_id):
+        return await self._call(self.backend.get_pair_info, giver_id)
+
+    async def find_participant(self, ref):
+        return await self._call(self.backend.find_participant, ref)
+
+    async def add_exclusion(self, giver_id, receiver_id, mutual=True):
+        return await self._call(self.backend.add_exclusion, giver_id, receiver_id, mutual)
+
+    async def set_team(self, user_id, tag):
+        return await self._call(self.backend.set_team, user_id, tag)
+
+    async def refresh(self):
+        """Перечитать данные, изменённые другими процессами (для SQLite в режиме WORKERS)"""
+        if hasattr(self.backend, 'refresh'):
+            await self._call(self.backend.refresh)
+
+    async def flush(self):
+        if hasattr(self.backend, 'flush'):
+            await self._call(self.backend.flush)
+
+    async def cache_stats(self):
+        """Счётчики кэша или None, если кэша нет"""
+        if not hasattr(self.backend, 'cache_stats'):
+            return None
+        return await self._call(self.backend.cache_stats)
+
+    async def release(self):
+        """Записать изменения и закрыть хранилище, не останавливая общий поток"""
+        if hasattr(self.backend, 'close'):
+            await self._call(self.backend.close)
+
+    def close(self):
+        if self.executor and self.own_executor:
+            self.executor.shutdown(wait=True)
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
@@ -0,0 +1,162 @@
+"""Сводки для организаторов: события копятся и уходят одним сообщением"""
+import asyncio
+import logging
+import os
+import time
+
+from telegram.error import NetworkError, RetryAfter, TelegramError
+
+from broadcast import PER_CHAT_INTERVAL
+from metrics import DIGEST_EVENTS, ERRORS
+from outbound import ADMIN, current_priority
+
+logger = logging.getLogger(__name__)
+
+# Сводка уходит раз в DIGEST_INTERVAL секунд или сразу после DIGEST_MAX_EVENTS событий
+DIGEST_INTERVAL = float(os.environ.get('ADMIN_DIGEST_INTERVAL', '30'))
+DIGEST_MAX_EVENTS = int(os.environ.get('ADMIN_DIGEST_MAX_EVENTS', '50'))
+# Сколько строк держать на чат, пока он недоступен (остальные только считаются)
+MAX_BUFFERED = 500
+# Сообщение Telegram ограничено 4096 символами
+MAX_MESSAGE_LENGTH = 4000
+
+
+class DigestBuffer:
+    """События одного розыгрыша для одного чата организатора"""
+    __slots__ = ('title', 'lines', 'skipped', 'footer')
+
+    def __init__(self, title):
+        self.title = title
+        self.lines = []
+        self.skipped = 0  # событий сверх MAX_BUFFERED
+        self.footer = None  # последнее значение итоговой строки («Всего участников: …»)
+
+    def __len__(self):
+        return len(self.lines) + self.skipped
+
+    def render(self):
+        """Текст сводки; строки, не влезшие в сообщение, остаются в буфере"""
+        header = f"🗞 «{self.title}»: событий {len(self)}\n\n"
+        tail = f"\n{self.footer}" if self.footer else ""
+        size = len(header) + len(tail) + 40
+        taken = 0
+        for line in self.lines:
+            if size + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                break
+            size += len(line) + 1
+            taken += 1
+        text = header + "\n".join(self.lines[:taken])
+        rest = len(self.lines) - taken + self.skipped
+        if rest:
+            text += f"\n… и ещё {rest}"
+        return text + tail, taken
+
+
+class AdminDigest:
+    """
+    Канал уведомлений организаторам. add кладёт событие в буфер чата
+    и сразу возвращается, поэтому обработчик пользователя не ждёт
+    отправки. run раз в interval секунд (или когда в каком-то буфере
+    набралось max_events событий) отправляет по одной сводке на чат.
+    Между сводками в один чат не меньше PER_CHAT_INTERVAL, а RetryAfter
+    откладывает чат на указанное время: события копятся до MAX_BUFFERED
+    строк, дальше только считаются. Сетевые ошибки
+    повторяются на следующем цикле, остальные пишутся в лог, и сводка
+    отбрасывается.
+    """
+
+    def __init__(self, interval=DIGEST_INTERVAL, max_events=DIGEST_MAX_EVENTS):
+        self.interval = interval
+        self.max_events = max_events
+        self.buffers = {}  # (chat_id, event_id) -> DigestBuffer
+        self.blocked = {}  # chat_id -> monotonic-время, до которого в чат не пишем
+        self.wakeup = asyncio.Event()
+        self.stats = {'events': 0, 'sent': 0, 'throttled': 0, 'failed': 0}
+
+    def add(self, event, text, footer=None):
+        """Событие розыгрыша для всех его организаторов"""
+        self.stats['events'] += 1
+        DIGEST_EVENTS.inc('event')
+        for chat_id in event.organizers:
+            buffer = self.buffers.get((chat_id, event.id))
+            if buffer is None:
+                buffer = self.buffers[chat_id, event.id] = DigestBuffer(event.title)
+            if len(buffer.lines) < MAX_BUFFERED:
+                buffer.lines.append(text)
+            else:
+                buffer.skipped += 1
+            if footer is not None:
+                buffer.footer = footer
+            if len(buffer) >= self.max_events and chat_id not in self.blocked:
+                self.wakeup.set()
+
+    async def run(self, bot):
+        """Цикл отправки сводок (до отмены задачи)"""
+        current_priority.set(ADMIN)
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self._timeout())
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush(bot)
+
+    def _timeout(self):
+        # Полный буфер отложенного чата ждёт только конца паузы, а не весь интервал
+        timeout = self.interval
+        now = time.monotonic()
+        for (chat_id, _), buffer in self.buffers.items():
+            if chat_id in self.blocked and len(buffer) >= self.max_events:
+                timeout = min(timeout, max(self.blocked[chat_id] - now, 0))
+        return timeout
+
+    async def flush(self, bot):
+        """Отправить накопленные сводки всем доступным чатам"""
+        now = time.monotonic()
+        for chat_id, until in list(self.blocked.items()):
+            if until <= now:
+                del self.blocked[chat_id]
+        for key in list(self.buffers):
+            chat_id, _ = key
+            if chat_id not in self.blocked:
+                await self._send(bot, key)
+
+    async def _send(self, bot, key):
+        chat_id, event_id = key
+        buffer = self.buffers[key]
+        text, taken = buffer.render()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+
+        except RetryAfter as e:
+            # Сводка остаётся в буфере до конца ожидания
+            self.blocked[chat_id] = time.monotonic() + e.retry_after
+            self.stats['throttled'] += 1
+            DIGEST_EVENTS.inc('throttled')
+            logger.warning(f"Сводка для {chat_id} отложена на {e.retry_after} с")
+            return
+
+        except NetworkError as e:
+            # Повторим на следующем цикле
+            ERRORS.inc('digest', type(e).__name__)
+            logger.warning(f"Сводка для {chat_id} не отправлена ({e}), повторю позже")
+            return
+
+        except TelegramError as e:
+            # Организатор заблокировал бота и т. п.: повтор не поможет
+            ERRORS.inc('digest', type(e).__name__)
+            self.stats['failed'] += 1
+            logger.error(f"Сводка для {chat_id} ({event_id}) потеряна: {e}")
+            del self.buffers[key]
+            return
+
+        self.stats['sent'] += 1
+        DIGEST_EVENTS.inc('sent')
+        self.blocked[chat_id] = time.monotonic() + PER_CHAT_INTERVAL
+        del buffer.lines[:taken]
+        buffer.skipped = 0
+        if not buffer.lines:
+            del self.buffers[key]
+
+    def pending(self):
+        return sum(len(buffer) for buffer in self.buffers.values())
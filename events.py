@@ -0,0 +1,375 @@
+"""Несколько розыгрышей в одном процессе: каталог событий и состояние по событиям"""
+import asyncio
+import functools
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from admin_stats import StatsPages
+from cluster import CATALOG_SCOPE
+from database import AsyncStorage
+from templates import CardCache
+
+logger = logging.getLogger(__name__)
+
+# Событие, в котором оказываются пользователи без приглашения (прежний единственный розыгрыш)
+DEFAULT_EVENT = 'default'
+
+# Сколько событий держать в памяти и через сколько секунд простоя выгружать
+MAX_LOADED_EVENTS = int(os.environ.get('MAX_LOADED_EVENTS', '200'))
+EVENT_IDLE_TIMEOUT = float(os.environ.get('EVENT_IDLE_TIMEOUT', '900'))
+# Событие, к которому обращались недавно, не выгружается даже сверх лимита
+# (фоновые задачи получают события без закрепления)
+EVENT_MIN_IDLE = 30
+
+# Сколько пользователей сверять с каталогом одним запросом при reload
+RELOAD_BATCH = 500
+
+# События, полученные текущим обработчиком (EventRegistry.pinning); None — вне обработчика
+pinned_events = ContextVar('pinned_events', default=None)
+
+SQL_CATALOG = '''
+    CREATE TABLE IF NOT EXISTS events (
+        event_id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        created_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS organizers (
+        event_id TEXT NOT NULL REFERENCES events (event_id),
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (event_id, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS members (
+        user_id INTEGER PRIMARY KEY,
+        event_id TEXT NOT NULL REFERENCES events (event_id)
+    );
+'''
+SQL_ADD_EVENT = "INSERT OR IGNORE INTO events (event_id, title, created_by) VALUES (?, ?, ?)"
+SQL_ADD_ORGANIZER = "INSERT OR IGNORE INTO organizers (event_id, user_id) VALUES (?, ?)"
+SQL_EVENT_OF = "SELECT event_id FROM members WHERE user_id = ?"
+SQL_JOIN = "INSERT OR REPLACE INTO members (user_id, event_id) VALUES (?, ?)"
+SQL_MEMBERS = "SELECT user_id, event_id FROM members WHERE user_id IN ({})"
+
+
+class EventCatalog:
+    """
+    Каталог событий в SQLite: названия, организаторы и текущее событие
+    каждого пользователя. События и организаторы загружаются целиком
+    (их немного), событие пользователя читается при первом обращении и
+    дальше берётся из памяти. Методы, которые обращаются к базе, реестр
+    вызывает в потоке хранилищ; цикл событий только читает словари.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQL_CATALOG)
+        self.titles = dict(self.conn.execute("SELECT event_id, title FROM events"))
+        self.organizers = {}  # event_id -> множество user_id
+        for event_id, user_id in self.conn.execute("SELECT event_id, user_id FROM organizers"):
+            self.organizers.setdefault(event_id, set()).add(user_id)
+        self.members = {}  # user_id -> event_id (кэш таблицы members)
+
+    def exists(self, event_id):
+        return event_id in self.titles
+
+    def add(self, event_id, title, organizer=None):
+        with self.conn:
+            self.conn.execute(SQL_ADD_EVENT, (event_id, title, organizer))
+        self.titles.setdefault(event_id, title)
+        if organizer is not None:
+            self.add_organizer(event_id, organizer)
+
+    def create(self, title, organizer):
+        """Новое событие со случайным ID; создатель становится организатором"""
+        event_id = secrets.token_hex(4)
+        while event_id in self.titles:
+            event_id = secrets.token_hex(4)
+        self.add(event_id, title, organizer)
+        logger.info(f"Создано событие {event_id} «{title}», организатор {organizer}")
+        return event_id
+
+    def add_organizer(self, event_id, user_id):
+        with self.conn:
+            self.conn.execute(SQL_ADD_ORGANIZER, (event_id, user_id))
+        self.organizers.setdefault(event_id, set()).add(user_id)
+
+    def event_of(self, user_id):
+        """Текущее событие пользователя или None"""
+        if user_id not in self.members:
+            row = self.conn.execute(SQL_EVENT_OF, (user_id,)).fetchone()
+            self.members[user_id] = row[0] if row else None
+        return self.members[user_id]
+
+    def join(self, user_id, event_id):
+        with self.conn:
+            self.conn.execute(SQL_JOIN, (user_id, event_id))
+        self.members[user_id] = event_id
+
+    def join_many(self, user_ids, event_id):
+        """Перевести многих пользователей в событие одной транзакцией"""
+        with self.conn:
+            self.conn.executemany(SQL_JOIN, ((user_id, event_id) for user_id in user_ids))
+        for user_id in user_ids:
+            # Кэш обновляем только для уже прочитанных: остальные прочитаются из базы
+            if user_id in self.members:
+                self.members[user_id] = event_id
+
+    def reload(self):
+        """
+        Перечитать каталог: события, организаторов и участников могли изменить
+        другие процессы. В кэше событий пользователей меняются только записи,
+        которые разошлись с базой, остальной кэш остаётся.
+        """
+        self.titles.update(self.conn.execute("SELECT event_id, title FROM events").fetchall())
+        organizers = {}
+        for event_id, user_id in self.conn.execute("SELECT event_id, user_id FROM organizers"):
+            organizers.setdefault(event_id, set()).add(user_id)
+        # Множества общие с загруженными событиями: обновляем их на месте и без
+        # промежуточного пустого множества — цикл событий читает их в это время
+        for event_id, users in organizers.items():
+            current = self.organizers.setdefault(event_id, set())
+            current.intersection_update(users)
+            current.update(users)
+        cached = list(self.members)
+        for start in range(0, len(cached), RELOAD_BATCH):
+            user_ids = cached[start:start + RELOAD_BATCH]
+            found = dict(self.conn.execute(SQL_MEMBERS.format(",".join("?" * len(user_ids))), user_ids))
+            for user_id in user_ids:
+                event_id = found.get(user_id)
+                if self.members.get(user_id) != event_id:
+                    self.members[user_id] = event_id
+
+    def close(self):
+        self.conn.close()
+
+
+class Event:
+    """Загруженное событие: хранилище участников и всё, что с ним связано в памяти"""
+
+    def __init__(self, event_id, title, db, organizers):
+        self.id = event_id
+        self.title = title
+        self.db = db
+        self.organizers = organizers  # множество из каталога, общее с ним
+        self.stats_pages = StatsPages()
+        self.cards = CardCache()  # Карточки получателей для ответов и рассылки
+        self.broadcast_job = None
+        self.starting = set()  # операции, которые обработчики начали, но ещё не запустили: 'broadcast', 'distribute'
+        self.last_used = time.monotonic()
+        self.pins = 0  # сколько обработчиков сейчас работают с событием
+        self.synced = 0  # версия события в общем хранилище, с которой совпадают данные в памяти
+
+    def is_organizer(self, user_id):
+        return user_id in self.organizers
+
+    @property
+    def busy(self):
+        """Идёт рассылка или распределение"""
+        return bool(self.starting) or (self.broadcast_job is not None and not self.broadcast_job.finished)
+
+    @property
+    def in_use(self):
+        """Событие нельзя выгружать: оно занято или с ним работает обработчик"""
+        return self.pins > 0 or self.busy
+
+
+class EventRegistry:
+    """
+    Состояние всех событий, ключ — ID события: поиск события и всё
+    остальное внутри него не зависят от общего числа розыгрышей.
+    Хранилище события открывается при первом обращении (open_backend(event_id))
+    и закрывается после idle_timeout секунд простоя или когда загружено
+    больше max_loaded событий (выгружаются давно не использованные).
+    Все SQLite-хранилища обслуживает один общий поток.
+    persistent=False — хранилище в памяти: такие события не выгружаются.
+    store — общее состояние рабочих процессов (cluster.SqliteStore): при
+    каждом обращении сверяются версии каталога и события (store держит их
+    в памяти и перечитывает раз в poll_interval), и если их изменил другой
+    процесс, каталог и данные события перечитываются.
+    """
+
+    def __init__(self, catalog, open_backend, persistent=True,
+                 max_loaded=MAX_LOADED_EVENTS, idle_timeout=EVENT_IDLE_TIMEOUT, min_idle=EVENT_MIN_IDLE,
+                 store=None):
+        self.catalog = catalog
+        self.store = store
+        self.catalog_version = store.version(CATALOG_SCOPE) if store else 0
+        self.open_backend = open_backend
+        self.persistent = persistent
+        self.max_loaded = max_loaded
+        self.idle_timeout = idle_timeout
+        self.min_idle = min_idle
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage') if persistent else None
+        self.loaded = OrderedDict()  # event_id -> Event, от давно использованных к недавним
+        self.load_lock = asyncio.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    async def get(self, event_id):
+        """Событие по ID (загружается при первом обращении) или None, если его нет"""
+        version = None
+        if self.store:
+            catalog_version, version = self.store.versions(CATALOG_SCOPE, event_id)
+            if catalog_version != self.catalog_version:
+                self.catalog_version = catalog_version
+                await self._catalog(self.catalog.reload)
+
+        event = self.loaded.get(event_id)
+        if event is None:
+            if not self.catalog.exists(event_id):
+                return None
+            async with self.load_lock:
+                event = self.loaded.get(event_id)
+                if event is None:
+                    event = await self._load(event_id)
+                    event.synced = version
+                else:
+                    self._pin(event)
+        else:
+            self._pin(event)
+        if version is not None and event.synced != version:
+            # Распределение, сброс или импорт в другом процессе
+            await event.db.refresh()
+            event.cards.clear()
+            event.synced = version
+        self.loaded.move_to_end(event_id)
+        event.last_used = time.monotonic()
+        return event
+
+    def _pin(self, event):
+        held = pinned_events.get()
+        if held is not None:
+            event.pins += 1
+            held.append(event)
+
+    @contextmanager
+    def pinning(self):
+        """
+        Обработка одного обновления: события, полученные внутри (get, for_user,
+        join), не выгружаются, пока обработчик не завершится.
+        """
+        held = []
+        token = pinned_events.set(held)
+        try:
+            yield
+        finally:
+            pinned_events.reset(token)
+            for event in held:
+                event.pins -= 1
+
+    def changed(self, scope):
+        """Сообщить другим процессам, что событие (или каталог — CATALOG_SCOPE) изменилось"""
+        if self.store:
+            self.store.bump(scope)
+
+    async def _catalog(self, func, *args):
+        """Вызов каталога: запросы к SQLite — в потоке хранилищ, как у AsyncStorage"""
+        if self.executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def event_of(self, user_id):
+        """ID текущего события пользователя или None (промах кэша читается из каталога)"""
+        members = self.catalog.members
+        if user_id in members:
+            return members[user_id]
+        return await self._catalog(self.catalog.event_of, user_id)
+
+    async def for_user(self, user_id):
+        """Текущее событие пользователя (по умолчанию — DEFAULT_EVENT)"""
+        event = await self.get(await self.event_of(user_id) or DEFAULT_EVENT)
+        return event or await self.get(DEFAULT_EVENT)
+
+    async def join(self, user_id, event_id):
+        await self._catalog(self.catalog.join, user_id, event_id)
+        return await self.get(event_id)
+
+    async def join_many(self, user_ids, event_id):
+        await self._catalog(self.catalog.join_many, user_ids, event_id)
+
+    async def add_organizer(self, event_id, user_id):
+        await self._catalog(self.catalog.add_organizer, event_id, user_id)
+
+    async def create(self, title, organizer):
+        event_id = await self._catalog(self.catalog.create, title, organizer)
+        self.changed(CATALOG_SCOPE)
+        return await self.join(organizer, event_id)
+
+    async def _load(self, event_id):
+        if self.executor:
+            loop = asyncio.get_running_loop()
+            backend = await loop.run_in_executor(self.executor, self.open_backend, event_id)
+        else:
+            backend = self.open_backend(event_id)
+        db = AsyncStorage(backend, blocking=self.persistent, executor=self.executor)
+        event = Event(event_id, self.catalog.titles[event_id], db,
+                      self.catalog.organizers.setdefault(event_id, set()))
+        self.loaded[event_id] = event
+        self.loads += 1
+        # Закрепляем до выгрузки лишних, чтобы не выгрузить только что загруженное
+        self._pin(event)
+        await self._evict_over_limit()
+        return event
+
+    async def evict(self, event_id):
+        """Записать изменения события и закрыть его хранилище; занятое событие остаётся"""
+        event = self.loaded.get(event_id)
+        if event is None or event.in_use:
+            return False
+        del self.loaded[event_id]
+        await event.db.release()
+        self.evictions += 1
+        return True
+
+    async def _evict_over_limit(self):
+        if not self.persistent:
+            return
+        border = time.monotonic() - self.min_idle
+        for event_id, event in list(self.loaded.items()):
+            if len(self.loaded) <= self.max_loaded:
+                break
+            if event.last_used > border:
+                break  # дальше только ещё более свежие
+            # Занятость проверяет evict: пока выгружалось предыдущее, событие могли взять
+            await self.evict(event_id)
+
+    async def evict_idle(self):
+        if not self.persistent:
+            return
+        border = time.monotonic() - self.idle_timeout
+        for event_id, event in list(self.loaded.items()):
+            if event.last_used > border:
+                break
+            await self.evict(event_id)
+
+    async def flush(self):
+        for event in list(self.loaded.values()):
+            await event.db.flush()
+
+    async def flush_periodically(self, interval):
+        """Фоновая запись накопленных изменений и выгрузка простаивающих событий"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания событий: {e}")
+
+    def close(self):
+        for event in self.loaded.values():
+            event.db.close()
+        self.loaded.clear()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        self.catalog.close()
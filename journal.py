@@ -0,0 +1,177 @@
+"""Журнал операций и снимки для хранилища участников в памяти"""
+import logging
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Как часто делать fsync журнала: записи за интервал сбрасываются на диск одной пачкой
+SYNC_INTERVAL = float(os.environ.get('JOURNAL_SYNC_INTERVAL', '0.2'))
+# Через сколько записей журнала писать новый снимок и обрезать журнал
+SNAPSHOT_EVERY = int(os.environ.get('JOURNAL_SNAPSHOT_EVERY', '100000'))
+
+# Запись журнала: длина и crc32 данных, затем marshal кортежа (seq, операция, аргументы...)
+RECORD_HEADER = struct.Struct('<II')
+# Снимок: метка формата, seq последней вошедшей в него записи, crc32 и длина данных
+SNAPSHOT_HEADER = struct.Struct('<8sQII')
+SNAPSHOT_MAGIC = b'SANTAS01'
+# Фиксированная версия marshal, чтобы файлы читались и после обновления Python
+MARSHAL_VERSION = 4
+
+
+def _fsync_dir(path):
+    """fsync каталога, чтобы переименование файла пережило сбой питания"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """
+    Журнал изменений base_path.journal и снимок base_path.snapshot.
+
+    append пишет запись в файл сразу (переживает падение процесса), а fsync
+    делает таймер через sync_interval после первой записи без fsync — так
+    несколько изменений подряд стоят одного fsync (групповая фиксация), и
+    затихший бот тоже не оставляет записей без fsync. При сбое питания
+    теряется не больше sync_interval секунд изменений.
+
+    Снимок пишется во временный файл и атомарно подменяет старый, после
+    чего журнал обрезается. У каждой записи свой seq, а снимок помнит
+    последний вошедший в него, поэтому сбой между подменой снимка и
+    обрезкой журнала не приведёт к повторному применению записей.
+    Оборванная последняя запись (сбой посреди write) отбрасывается при
+    восстановлении.
+    """
+
+    def __init__(self, base_path, sync_interval=SYNC_INTERVAL, snapshot_every=SNAPSHOT_EVERY):
+        self.path = base_path + '.journal'
+        self.snapshot_path = base_path + '.snapshot'
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        self.file = None
+        self.seq = 0
+        self.since_snapshot = 0  # записей в журнале после снимка
+        self.dirty = False  # есть записи без fsync
+        self.timer = None  # отложенный sync для записей без fsync
+        self.lock = threading.Lock()  # запись в файл и флаг dirty
+        self.sync_lock = threading.Lock()  # fsync и закрытие файла (таймер — в своём потоке)
+        self.last_sync = time.monotonic()
+        self.appends = 0
+        self.syncs = 0
+        self.snapshots = 0
+
+    def recover(self):
+        """
+        Прочитать снимок и хвост журнала и открыть журнал на дозапись.
+        Возвращает (состояние из снимка или None, записи после снимка).
+        """
+        state, snapshot_seq = self._read_snapshot()
+        self.seq = snapshot_seq
+        records = []
+        good = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(data):
+                length, crc = RECORD_HEADER.unpack_from(data, offset)
+                start = offset + RECORD_HEADER.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                seq, *record = marshal.loads(payload)
+                if seq > snapshot_seq:
+                    records.append(record)
+                    self.seq = seq
+                offset = good = start + length
+            if good < len(data):
+                logger.warning(f"{self.path}: отброшен оборванный хвост журнала, {len(data) - good} байт")
+                with open(self.path, 'r+b') as f:
+                    f.truncate(good)
+
+        self.file = open(self.path, 'ab', buffering=0)
+        self.since_snapshot = len(records)
+        return state, records
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None, 0
+        with open(self.snapshot_path, 'rb') as f:
+            data = f.read()
+        magic, seq, crc, length = SNAPSHOT_HEADER.unpack_from(data)
+        payload = data[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + length]
+        if magic != SNAPSHOT_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+            # Журнал до снимка уже обрезан: без снимка данные не восстановить
+            raise ValueError(f"{self.snapshot_path}: снимок повреждён")
+        return marshal.loads(payload), seq
+
+    def append(self, record):
+        """Дописать операцию: кортеж (имя, аргументы...) из чисел, строк и None"""
+        self.seq += 1
+        payload = marshal.dumps((self.seq,) + record, MARSHAL_VERSION)
+        with self.lock:
+            self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.appends += 1
+            self.since_snapshot += 1
+            self.dirty = True
+            if self.sync_interval > 0 and self.timer is None:
+                self.timer = threading.Timer(self.sync_interval, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+        if self.sync_interval <= 0:
+            self.sync()
+
+    def sync(self):
+        """fsync всех дописанных записей одной операцией"""
+        with self.sync_lock:
+            with self.lock:
+                dirty, self.dirty = self.dirty, False
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            # Запись, пришедшая после сброса флага, заведёт новый таймер
+            if dirty and self.file is not None:
+                os.fsync(self.file.fileno())
+                self.syncs += 1
+            self.last_sync = time.monotonic()
+
+    def needs_snapshot(self):
+        return self.since_snapshot >= self.snapshot_every
+
+    def write_snapshot(self, state):
+        """Сохранить полное состояние и обрезать журнал"""
+        payload = marshal.dumps(state, MARSHAL_VERSION)
+        temporary = self.snapshot_path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.seq, zlib.crc32(payload), len(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        _fsync_dir(self.snapshot_path)
+
+        with self.sync_lock, self.lock:
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+            self.dirty = False
+            self.since_snapshot = 0
+        self.snapshots += 1
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            with self.sync_lock:
+                self.file.close()
+                self.file = None
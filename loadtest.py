@@ -0,0 +1,411 @@
+"""
+Нагрузочный тест бота без выхода в интернет.
+
+FakeBotApi — локальная заглушка Bot API (getUpdates, sendMessage и т.п.)
+с искусственной задержкой и ответами 429. Рой пользователей проходит
+сценарий /start → ФИО → пожелания → «не дарить» → '🎁 Кому я дарю подарок?'
+(между регистрацией и вопросом организатор выполняет распределение),
+каждый шаг ждёт ответов бота. Отчёт: пропускная способность, перцентили
+задержки по шагам, потерянные ответы и память процесса.
+
+    python loadtest.py polling 500
+    python loadtest.py webhook --users 5000 --rate 200 --latency 50 --rate-limit 0.01
+    python loadtest.py webhook --save baseline.json
+    python loadtest.py webhook --baseline baseline.json   # код 1 при регрессии
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+from metrics import percentile
+
+TOKEN = '123456:LOADTEST'
+
+# Шаги сценария: (название, текст, сколько ответов бота ждать)
+REGISTRATION = [
+    ('start', '/start', 1),
+    ('name', None, 1),  # ФИО подставляется для каждого пользователя
+    ('wish', 'книга', 1),
+    ('not_wish', 'нет', 2),  # «регистрация завершена» + меню
+]
+GIFT = [('gift', '🎁 Кому я дарю подарок?', 1)]
+
+# Допустимое ухудшение относительно --baseline
+MAX_THROUGHPUT_DROP = 0.2
+MAX_P99_GROWTH = 0.5
+
+
+class FakeBotApi:
+    """
+    Заглушка Bot API: отдаёт поставленные в очередь обновления и записывает ответы бота.
+    latency — задержка каждого запроса (кроме getUpdates), rate_limit — доля
+    отправок, на которые вместо ответа приходит 429 Too Many Requests.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.0, rate_limit=0.0, retry_after=1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.updates = []
+        self.offset = 0
+        self.new_updates = asyncio.Event()
+        self.sent = []  # (время, chat_id, text)
+        self.sent_event = asyncio.Event()
+        self.replies = {}  # chat_id -> очередь ответов бота этому чату
+        self.requests = {}  # метод -> число запросов
+        self.throttled = 0
+        self.runner = None
+
+        self.app = web.Application()
+        self.app.router.add_route('*', '/bot{token}/{method}', self.handle)
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/bot'
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def push_update(self, update):
+        self.updates.append(update)
+        self.new_updates.set()
+
+    def inbox(self, chat_id):
+        return self.replies.setdefault(chat_id, asyncio.Queue())
+
+    async def wait_for_replies(self, count):
+        while len(self.sent) < count:
+            self.sent_event.clear()
+            await self.sent_event.wait()
+
+    async def _params(self, request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = dict(await request.post())
+        # PTB кодирует сложные параметры в JSON
+        for key, value in params.items():
+            if isinstance(value, str) and value[:1] in '[{':
+                params[key] = json.loads(value)
+        return params
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        self.requests[method] = self.requests.get(method, 0) + 1
+
+        if method != 'getUpdates':
+            if self.latency:
+                # Задержка с разбросом ±50%, как у настоящей сети
+                await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+            if method in ('sendMessage', 'editMessageText') and random.random() < self.rate_limit:
+                self.throttled += 1
+                return web.json_response({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after}
+                }, status=429)
+
+        handler = getattr(self, 'api_' + method, None)
+        result = await handler(params) if handler else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def api_getMe(self, params):
+        return {'id': 123456, 'is_bot': True, 'first_name': 'Santa', 'username': 'santa_loadtest_bot'}
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        if offset < 0:
+            # Как в Bot API: последние -offset обновлений, более старые забываются
+            self.updates = self.updates[offset:]
+        else:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def api_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        self.sent.append((time.monotonic(), chat_id, params.get('text')))
+        self.sent_event.set()
+        if chat_id in self.replies:
+            self.replies[chat_id].put_nowait(params.get('text'))
+        return message_json(len(self.sent), chat_id, params.get('text'), from_bot=True)
+
+    async def api_editMessageText(self, params):
+        return message_json(int(params.get('message_id') or 0), int(params['chat_id']), params.get('text'), from_bot=True)
+
+
+def message_json(message_id, chat_id, text, from_bot=False):
+    sender = {'id': 123456, 'is_bot': True, 'first_name': 'Santa'} if from_bot else \
+        {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}', 'username': f'user{chat_id}'}
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': sender,
+        'text': text
+    }
+    if text and text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return message
+
+
+def synthetic_update(update_id, user_id, text):
+    return {'update_id': update_id, 'message': message_json(update_id, user_id, text)}
+
+
+def memory_usage():
+    """Пиковый RSS процесса в МБ (None, если платформа не сообщает)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux считает в КБ, macOS — в байтах
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class Swarm:
+    """Рой пользователей: каждый проходит шаги сценария и ждёт ответов бота"""
+
+    def __init__(self, api, deliver, timeout=10.0):
+        self.api = api
+        self.deliver = deliver  # корутина (update) -> None: polling или webhook
+        self.timeout = timeout
+        self.update_id = 0
+        self.latencies = {}  # шаг -> список задержек
+        self.lost = {}  # шаг -> сколько раз ответа не дождались
+        self.updates = 0
+
+    async def step(self, user_id, name, text, expected):
+        """Отправить сообщение и дождаться expected ответов; False — не дождались"""
+        inbox = self.api.inbox(user_id)
+        # Опоздавшие ответы на прошлые шаги и сообщения организатору не в счёт
+        while not inbox.empty():
+            inbox.get_nowait()
+        self.update_id += 1
+        self.updates += 1
+        started = time.monotonic()
+        await self.deliver(synthetic_update(self.update_id, user_id, text))
+        try:
+            for _ in range(expected):
+                await asyncio.wait_for(inbox.get(), self.timeout)
+        except asyncio.TimeoutError:
+            self.lost[name] = self.lost.get(name, 0) + 1
+            return False
+        self.latencies.setdefault(name, []).append(time.monotonic() - started)
+        return True
+
+    async def session(self, user_id, script):
+        for name, text, expected in script:
+            text = text or f"Участник Нагрузочный {user_id}"
+            if not await self.step(user_id, name, text, expected):
+                return False
+        return True
+
+    async def run(self, users, script, rate):
+        """Все пользователи проходят script; новые приходят с частотой rate в секунду"""
+        started = time.monotonic()
+        tasks = []
+        for number, user_id in enumerate(users):
+            delay = started + number / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.session(user_id, script)))
+        results = await asyncio.gather(*tasks)
+        return time.monotonic() - started, sum(results)
+
+
+async def run(mode, users, rate=200.0, latency=0.0, rate_limit=0.0, storage='memory', timeout=10.0,
+              outbound_rate=0.0):
+    # Хранилище и лимит исходящих задаются до импорта бота; Bot API — локальная заглушка
+    os.environ['STORAGE'] = storage
+    # outbound_rate — лимит OutboundQueue, единственного ограничителя запросов бота;
+    # 0 — не ограничивать: замеряем сам бот, а 429 отвечает заглушка (rate_limit)
+    os.environ['OUTBOUND_RATE'] = str(outbound_rate or 1e6)
+    if storage != 'memory':
+        directory = tempfile.mkdtemp()
+        os.environ['DATABASE_PATH'] = os.path.join(directory, 'santa.db')
+        os.environ['EVENTS_DIR'] = os.path.join(directory, 'events')
+        os.environ['BROADCAST_STATE_PATH'] = os.path.join(directory, 'broadcast_job.json')
+    import bot
+    from webhook import WebhookServer
+    # Логи каждого запроса и регистрации сами стали бы узким местом
+    logging.getLogger().setLevel(logging.WARNING)
+
+    api = FakeBotApi(latency=latency, rate_limit=rate_limit)
+    await api.start()
+    application = bot.build_application(TOKEN, base_url=api.base_url)
+    await application.initialize()
+    await application.start()
+
+    server = None
+    session = None
+    if mode == 'polling':
+        await application.updater.start_polling(timeout=bot.POLL_TIMEOUT, poll_interval=bot.POLL_INTERVAL)
+
+        async def deliver(update):
+            api.push_update(update)
+    else:
+        server = WebhookServer(application, host='127.0.0.1', port=8082, secret_token='loadtest')
+        await server.start()
+        await server.set_webhook('http://127.0.0.1:8082')
+        session = ClientSession()
+
+        async def deliver(update):
+            async with session.post(f'http://127.0.0.1:8082{server.path}', json=update,
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': 'loadtest'}) as response:
+                assert response.status == 200, response.status
+
+    swarm = Swarm(api, deliver, timeout=timeout)
+    user_ids = range(10_000, 10_000 + users)
+    phases = {}
+
+    # 1. Регистрация после анонса
+    phases['registration'] = await swarm.run(user_ids, REGISTRATION, rate)
+
+    # 2. Организатор распределяет подарки
+    started = time.monotonic()
+    await swarm.step(bot.ADMIN_ID, 'admin', '🎁 Распределить подарки', 1)
+    await swarm.step(bot.ADMIN_ID, 'distribute', '✅ Да, распределить', 2)
+    phases['distribution'] = (time.monotonic() - started, 1)
+
+    # 3. Все узнают, кому дарить
+    phases['gift'] = await swarm.run(user_ids, GIFT, rate)
+
+    if mode == 'polling':
+        await application.updater.stop()
+    else:
+        await session.close()
+        await server.stop()
+    await application.stop()
+    await application.shutdown()
+    await api.stop()
+    bot.close_storage()
+
+    elapsed = sum(duration for duration, _ in phases.values())
+    report = {
+        'mode': mode,
+        'storage': storage,
+        'users': users,
+        'rate': rate,
+        'latency_ms': latency * 1000,
+        'rate_limit': rate_limit,
+        'outbound_rate': outbound_rate,
+        'updates': swarm.updates,
+        'throughput': swarm.updates / elapsed,
+        'phases': {name: {'seconds': duration, 'completed': completed} for name, (duration, completed) in phases.items()},
+        'steps': {},
+        'lost': swarm.lost,
+        'throttled': api.throttled,
+        'api_requests': api.requests,
+        'memory_mb': memory_usage(),
+    }
+    for name, values in swarm.latencies.items():
+        values.sort()
+        report['steps'][name] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': values[-1],
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['mode']}, хранилище {report['storage']}: {report['users']} пользователей, "
+          f"приходят {report['rate']:.0f}/сек, задержка API {report['latency_ms']:.0f} мс, "
+          f"429 на {report['rate_limit']:.1%} отправок")
+    for name, phase in report['phases'].items():
+        print(f"  {name:>12}: {phase['seconds']:6.2f} сек, завершили {phase['completed']}")
+    print(f"  обновлений: {report['updates']}, {report['throughput']:.0f}/сек")
+    print(f"  {'шаг':>12}  {'p50':>7}  {'p95':>7}  {'p99':>7}  {'max':>7}  (мс)")
+    for name, step in report['steps'].items():
+        print(f"  {name:>12}  {step['p50'] * 1000:7.1f}  {step['p95'] * 1000:7.1f}  "
+              f"{step['p99'] * 1000:7.1f}  {step['max'] * 1000:7.1f}")
+    if report['lost']:
+        print(f"  ответ не пришёл: {report['lost']}")
+    print(f"  ответов 429: {report['throttled']}, запросов к API: {sum(report['api_requests'].values())}")
+    if report['memory_mb'] is not None:
+        print(f"  пиковая память процесса: {report['memory_mb']:.0f} МБ")
+
+
+def compare(report, baseline):
+    """Регрессии относительно сохранённого отчёта (пустой список — всё в норме)"""
+    problems = []
+    if report['throughput'] < baseline['throughput'] * (1 - MAX_THROUGHPUT_DROP):
+        problems.append(f"пропускная способность {report['throughput']:.0f}/сек, "
+                        f"было {baseline['throughput']:.0f}/сек")
+    for name, step in report['steps'].items():
+        before = baseline['steps'].get(name)
+        if before and step['p99'] > before['p99'] * (1 + MAX_P99_GROWTH):
+            problems.append(f"{name}: p99 {step['p99'] * 1000:.1f} мс, было {before['p99'] * 1000:.1f} мс")
+    if sum(report['lost'].values()) > sum(baseline['lost'].values()):
+        problems.append(f"потеряно ответов: {report['lost']}, было {baseline['lost']}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Bot API")
+    parser.add_argument('mode', nargs='?', default='webhook', choices=('webhook', 'polling'))
+    parser.add_argument('users', nargs='?', type=int, default=500, help="число пользователей")
+    parser.add_argument('--users', dest='users_option', type=int, help="число пользователей")
+    parser.add_argument('--rate', type=float, default=200, help="новых пользователей в секунду")
+    parser.add_argument('--latency', type=float, default=0, help="задержка Bot API, мс")
+    parser.add_argument('--rate-limit', type=float, default=0, help="доля отправок с ответом 429")
+    parser.add_argument('--outbound-rate', type=float, default=0,
+                        help="лимит исходящих запросов бота в секунду (0 — без лимита)")
+    parser.add_argument('--storage', default='memory', choices=('memory', 'sqlite', 'journal'))
+    parser.add_argument('--timeout', type=float, default=10, help="сколько ждать ответа бота, сек")
+    parser.add_argument('--save', help="сохранить отчёт в JSON")
+    parser.add_argument('--baseline', help="сравнить с сохранённым отчётом")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(
+        args.mode,
+        args.users_option or args.users,
+        rate=args.rate,
+        latency=args.latency / 1000,
+        rate_limit=args.rate_limit,
+        storage=args.storage,
+        timeout=args.timeout,
+        outbound_rate=args.outbound_rate
+    ))
+    print_report(report)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(report, json.load(f))
+        for problem in problems:
+            print(f"❌ Регрессия: {problem}")
+        if problems:
+            sys.exit(1)
+        print("✅ Регрессий нет")
@@ -0,0 +1,289 @@
+"""Распределение пар Тайного Санты"""
+import logging
+import random
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько случайных кандидатов пробуем, прежде чем перейти к полному поиску
+GREEDY_TRIES = 32
+MERGE_TRIES = 256
+
+
+class UnsatisfiableError(Exception):
+    """Ограничения не позволяют распределить подарки"""
+
+
+class Assignment:
+    """Результат распределения: кто кому дарит и кто дарит кому"""
+
+    def __init__(self, giver_to_receiver):
+        self.giver_to_receiver = giver_to_receiver
+        self.receiver_to_giver = {receiver: giver for giver, receiver in giver_to_receiver.items()}
+
+    def __len__(self):
+        return len(self.giver_to_receiver)
+
+    def receiver_of(self, giver_id):
+        return self.giver_to_receiver.get(giver_id)
+
+    def giver_of(self, receiver_id):
+        return self.receiver_to_giver.get(receiver_id)
+
+    def cycles(self):
+        """Разбить распределение на циклы"""
+        seen = set()
+        result = []
+        for start in self.giver_to_receiver:
+            if start in seen:
+                continue
+            cycle = []
+            current = start
+            while current not in seen:
+                seen.add(current)
+                cycle.append(current)
+                current = self.giver_to_receiver[current]
+            result.append(cycle)
+        return result
+
+
+class Constraints:
+    """
+    Ограничения распределения: личные исключения (супруги, прошлогодняя пара)
+    и группы (одна команда), внутри которых дарить нельзя.
+    """
+
+    def __init__(self):
+        self.exclusions = {}  # giver_id -> set(receiver_id), кому этот человек дарить не может
+        self.groups = {}  # user_id -> тег группы
+
+    def __bool__(self):
+        return bool(self.exclusions or self.groups)
+
+    def exclude(self, giver_id, receiver_id, mutual=True):
+        """Запретить giver_id дарить receiver_id (и наоборот, если mutual)"""
+        self.exclusions.setdefault(giver_id, set()).add(receiver_id)
+        if mutual:
+            self.exclusions.setdefault(receiver_id, set()).add(giver_id)
+
+    def set_group(self, user_id, tag):
+        if tag is None:
+            self.groups.pop(user_id, None)
+        else:
+            self.groups[user_id] = tag
+
+    def clear(self):
+        self.exclusions.clear()
+        self.groups.clear()
+
+    def allows(self, giver_id, receiver_id):
+        if giver_id == receiver_id:
+            return False
+        if receiver_id in self.exclusions.get(giver_id, ()):
+            return False
+        tag = self.groups.get(giver_id)
+        return tag is None or tag != self.groups.get(receiver_id)
+
+
+def random_cycle(participants, rng=random):
+    """
+    Один случайный цикл через всех участников: каждый дарит следующему.
+    Никто не дарит сам себе и нет замкнутых подгрупп. O(n) времени и памяти.
+    """
+    order = list(participants)
+    if len(order) < 2:
+        raise ValueError("Нужно минимум 2 участника")
+
+    rng.shuffle(order)
+    pairs = dict(zip(order, order[1:]))
+    pairs[order[-1]] = order[0]  # Замыкаем цикл
+    return Assignment(pairs)
+
+
+def random_derangement(participants, rng=random):
+    """
+    Равномерно случайная перестановка без неподвижных точек
+    (циклов может быть несколько). Отбрасываем перестановки с неподвижными
+    точками: в среднем нужно e ≈ 2.7 попыток, то есть O(n) в среднем.
+    """
+    givers = list(participants)
+    if len(givers) < 2:
+        raise ValueError("Нужно минимум 2 участника")
+
+    receivers = givers.copy()
+    while True:
+        rng.shuffle(receivers)
+        if all(giver != receiver for giver, receiver in zip(givers, receivers)):
+            return Assignment(dict(zip(givers, receivers)))
+
+
+def constrained_cycle(participants, constraints, rng=random):
+    """
+    Распределение с ограничениями.
+
+    1. Жадно строим паросочетание даритель -> получатель на графе разрешённых пар,
+       пробуя случайных кандидатов.
+    2. Оставшихся дарителей добираем увеличивающими путями (BFS по дополнению
+       графа запретов: каждый получатель просматривается один раз на поиск).
+       Если путь не найден — совершенного паросочетания нет, и мы сразу
+       сообщаем, что ограничения невыполнимы.
+    3. Получившееся покрытие циклами сливаем в один цикл обменом получателей
+       между циклами, пока это позволяют ограничения.
+    """
+    givers = list(participants)
+    n = len(givers)
+    if n < 2:
+        raise ValueError("Нужно минимум 2 участника")
+
+    allows = constraints.allows
+
+    # Быстрая проверка условия Холла для групп: никакая группа не больше половины
+    sizes = Counter(constraints.groups[user_id] for user_id in givers if user_id in constraints.groups)
+    if sizes:
+        tag, size = sizes.most_common(1)[0]
+        if size > n - size:
+            raise UnsatisfiableError(f"в группе «{tag}» {size} из {n} участников, им некому дарить")
+
+    rng.shuffle(givers)
+    match_giver = {}  # giver -> receiver
+    match_receiver = {}  # receiver -> giver
+
+    # 1. Жадное паросочетание: случайный свободный получатель из пула
+    pool = givers.copy()
+    position = {user_id: i for i, user_id in enumerate(pool)}
+
+    def take(receiver_id):
+        i = position.pop(receiver_id)
+        last = pool.pop()
+        if last != receiver_id:
+            pool[i] = last
+            position[last] = i
+
+    free = []
+    for giver_id in givers:
+        for _ in range(min(GREEDY_TRIES, len(pool))):
+            receiver_id = pool[rng.randrange(len(pool))]
+            if allows(giver_id, receiver_id):
+                match_giver[giver_id] = receiver_id
+                match_receiver[receiver_id] = giver_id
+                take(receiver_id)
+                break
+        else:
+            free.append(giver_id)
+
+    # 2. Увеличивающие пути для тех, кому не хватило получателя
+    for giver_id in free:
+        if not _augment(giver_id, givers, match_giver, match_receiver, constraints):
+            raise UnsatisfiableError(f"участнику {giver_id} невозможно подобрать получателя")
+
+    # 3. Сливаем циклы в один
+    assignment = Assignment(match_giver)
+    cycles = _merge_cycles(assignment.cycles(), match_giver, constraints, rng)
+    if len(cycles) > 1:
+        logger.warning(f"Ограничения не позволяют один общий цикл, распределение из {len(cycles)} циклов")
+    return Assignment(match_giver)
+
+
+def _augment(start, receivers, match_giver, match_receiver, constraints):
+    """Найти увеличивающий путь от свободного дарителя start и применить его"""
+    # Непосещённые получатели по группам: члены своей группы пропускаются целиком,
+    # поэтому каждый даритель платит только за свои личные исключения
+    unvisited = {}
+    for receiver_id in receivers:
+        unvisited.setdefault(constraints.groups.get(receiver_id), set()).add(receiver_id)
+
+    parent = {}  # receiver -> даритель, из которого мы к нему пришли
+    queue = deque([start])
+
+    while queue:
+        giver_id = queue.popleft()
+        tag = constraints.groups.get(giver_id)
+        excluded = constraints.exclusions.get(giver_id, ())
+        for bucket_tag in list(unvisited):
+            if tag is not None and bucket_tag == tag:
+                continue
+            # Непосещёнными остаются только запрещённые этому дарителю (и он сам):
+            # их ищем по его исключениям, остальные получатели корзины посещены
+            bucket = unvisited[bucket_tag]
+            kept = {receiver_id for receiver_id in excluded if receiver_id in bucket}
+            if giver_id in bucket:
+                kept.add(giver_id)
+            if kept:
+                unvisited[bucket_tag] = kept
+            else:
+                del unvisited[bucket_tag]
+
+            for receiver_id in bucket:
+                if receiver_id in kept:
+                    continue
+                parent[receiver_id] = giver_id
+
+                if receiver_id not in match_receiver:
+                    # Переворачиваем путь до start
+                    while True:
+                        giver_id = parent[receiver_id]
+                        previous = match_giver.get(giver_id)
+                        match_giver[giver_id] = receiver_id
+                        match_receiver[receiver_id] = giver_id
+                        if giver_id == start:
+                            return True
+                        receiver_id = previous
+
+                queue.append(match_receiver[receiver_id])
+
+    return False
+
+
+def _merge_cycles(cycles, match_giver, constraints, rng):
+    """
+    Слить циклы: если a из первого цикла и b из второго могут обменяться
+    получателями, два цикла становятся одним.
+    """
+    cycles.sort(key=len, reverse=True)
+    main = cycles[0]
+    rest = cycles[1:]
+
+    while rest:
+        stuck = []
+        for cycle in rest:
+            if _merge_into(main, cycle, match_giver, constraints, rng):
+                main.extend(cycle)
+            else:
+                stuck.append(cycle)
+        if len(stuck) == len(rest):
+            break
+        rest = stuck
+
+    return [main] + rest
+
+
+def _merge_into(main, cycle, match_giver, constraints, rng):
+    allows = constraints.allows
+    groups = constraints.groups
+
+    def swap(a, b):
+        ra, rb = match_giver[a], match_giver[b]
+        if allows(a, rb) and allows(b, ra):
+            match_giver[a], match_giver[b] = rb, ra
+            return True
+        return False
+
+    for _ in range(MERGE_TRIES):
+        if swap(main[rng.randrange(len(main))], cycle[rng.randrange(len(cycle))]):
+            return True
+
+    # Случайные попытки не помогли: кандидатов из main раскладываем по группам
+    # (даритель, его получатель) и пропускаем корзины, запрещённые группами целиком.
+    # В остальных обмену мешают только личные исключения
+    by_tags = {}
+    for a in main:
+        by_tags.setdefault((groups.get(a), groups.get(match_giver[a])), []).append(a)
+    for b in cycle:
+        b_tag, rb_tag = groups.get(b), groups.get(match_giver[b])
+        for (a_tag, ra_tag), members in by_tags.items():
+            if (a_tag is not None and a_tag == rb_tag) or (b_tag is not None and ra_tag == b_tag):
+                continue
+            for a in members:
+                if swap(a, b):
+                    return True
+    return False
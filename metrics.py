@@ -0,0 +1,184 @@
+"""Метрики бота: счётчики и гистограммы в памяти, выдача в формате Prometheus"""
+import bisect
+import time
+
+from telegram.request import HTTPXRequest
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def percentile(values, q):
+    """Перцентиль q (0..100) по уже отсортированному списку"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Счётчик, растёт только вверх; значения меток передаются позиционно"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}  # кортеж значений меток -> число
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    """Текущее значение: может расти и уменьшаться"""
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами: observe — двоичный поиск корзины
+    и два сложения, без выделения памяти после первого наблюдения ряда.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # кортеж значений меток -> [счётчики корзин..., +Inf], сумма
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels):
+        series = self.series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def quantile(self, q, *labels):
+        """Оценка квантиля q (0..1) по корзинам, как histogram_quantile в Prometheus"""
+        series = self.series.get(labels)
+        if not series:
+            return 0.0
+        counts = series[0]
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def render(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                label_text = _labels(self.labels + ('le',), labels + (bound,))
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.add(Histogram(
+    'santa_handler_seconds', 'Время обработки обновления по маршрутам', ('route',)))
+STORAGE_SECONDS = REGISTRY.add(Histogram(
+    'santa_storage_seconds', 'Время вызова хранилища, включая ожидание потока', ('method',)))
+STORAGE_QUEUE_SECONDS = REGISTRY.add(Histogram(
+    'santa_storage_queue_seconds', 'Ожидание потока хранилища'))
+API_SECONDS = REGISTRY.add(Histogram(
+    'santa_api_seconds', 'Время запроса к Bot API', ('method',)))
+UPDATE_QUEUE_SECONDS = REGISTRY.add(Histogram(
+    'santa_update_queue_seconds', 'Ожидание обновления в очереди пользователя и общего лимита'))
+UPDATES_IN_FLIGHT = REGISTRY.add(Gauge(
+    'santa_updates_in_flight', 'Обновления в обработке: всего (total) и выполняются сейчас (running)', ('stage',)))
+ERRORS = REGISTRY.add(Counter(
+    'santa_errors_total', 'Ошибки по месту и типу', ('source', 'type')))
+OUTBOUND_QUEUE_SECONDS = REGISTRY.add(Histogram(
+    'santa_outbound_queue_seconds', 'Ожидание в очереди исходящих запросов по классам', ('priority',)))
+OUTBOUND_WAITING = REGISTRY.add(Gauge(
+    'santa_outbound_waiting', 'Запросов ждут токена, по классам (на момент записи пачки)', ('priority',)))
+DIGEST_EVENTS = REGISTRY.add(Counter(
+    'santa_digest_total', 'Сводки организаторам: события (event), отправки (sent) и 429 (throttled)', ('outcome',)))
+RELAY_MESSAGES = REGISTRY.add(Counter(
+    'santa_relay_total', 'Анонимные сообщения: принятые (accepted), отправки (sent), 429 (throttled), потерянные (failed), отклонённые как слишком частые (limited)',
+    ('outcome',)))
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый запрос к Bot API"""
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        except Exception as e:
+            ERRORS.inc('api', type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            ERRORS.inc('api', f'http_{code}')
+        return code, payload
+
+
+def summary():
+    """Краткая сводка для команды /metrics: строки (ряд, число, p50, p99)"""
+    rows = []
+    for metric in (HANDLER_SECONDS, STORAGE_SECONDS, API_SECONDS, STORAGE_QUEUE_SECONDS, UPDATE_QUEUE_SECONDS,
+                   OUTBOUND_QUEUE_SECONDS):
+        for labels in metric.series:
+            name = metric.name.replace('santa_', '').replace('_seconds', '')
+            if labels:
+                name += f" {labels[0]}"
+            rows.append((name, metric.count(*labels), metric.quantile(0.5, *labels), metric.quantile(0.99, *labels)))
+    return rows
@@ -0,0 +1,164 @@
+"""Общая очередь исходящих запросов к Bot API с классами приоритета"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+
+from metrics import OUTBOUND_QUEUE_SECONDS, OUTBOUND_WAITING, InstrumentedRequest
+
+# Классы приоритета: меньше — раньше
+INTERACTIVE, ADMIN, BULK = range(3)
+PRIORITY_NAMES = ('interactive', 'admin', 'bulk')
+
+# Сколько замеров ожидания копить перед записью в метрики
+METRICS_BATCH = 64
+
+# Класс запросов текущей задачи: рассылка и сводки выставляют его в начале своей задачи
+current_priority = contextvars.ContextVar('outbound_priority', default=INTERACTIVE)
+
+
+class OutboundQueue:
+    """
+    Все исходящие запросы процесса проходят через slot. Общее ведро
+    токенов держит не больше rate запросов в секунду; когда токенов нет,
+    следующим проходит самый старый запрос самого срочного класса, так что
+    ответы пользователям обгоняют рассылку. В один чат одновременно идёт
+    один запрос: остальные запросы в этот чат ждут в общей очереди, и когда
+    чат освобождается, первым выбирается самый срочный из них — ответ
+    пользователю не стоит за рассылкой и в своём чате. Внутри класса
+    порядок сообщений в чате сохраняется.
+    Время ожидания пишется в метрики пачками по METRICS_BATCH замеров.
+    """
+
+    def __init__(self, rate, capacity=5, metrics_batch=METRICS_BATCH):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.ready = []  # куча (класс, номер, future, chat_id) ожидающих токена
+        self.parked = {}  # chat_id -> записи кучи, ждущие окончания запроса в чат
+        self.active = set()  # чаты, в которые сейчас идёт запрос
+        self.waiting = [0] * len(PRIORITY_NAMES)  # ожидающих по классам
+        self.sequence = itertools.count()
+        self.pump = None
+        self.metrics_batch = metrics_batch
+        self.samples = tuple([] for _ in PRIORITY_NAMES)
+        self.stats = {name: 0 for name in PRIORITY_NAMES}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _pop(self):
+        while self.ready:
+            entry = heapq.heappop(self.ready)
+            priority, _, future, chat_id = entry
+            if future.done():
+                # Ожидающий отменён
+                self.waiting[priority] -= 1
+                continue
+            if chat_id is not None and chat_id in self.active:
+                # В чат уже идёт запрос: выберем из ожидающих, когда он закончится
+                self.parked.setdefault(chat_id, []).append(entry)
+                continue
+            self.waiting[priority] -= 1
+            return entry
+        return None
+
+    def _start_pump(self):
+        if self.pump is None or self.pump.done():
+            self.pump = asyncio.create_task(self._pump())
+
+    def _release(self, chat_id):
+        """Запрос в чат закончился: его ожидающие снова участвуют в выборе"""
+        if chat_id is None:
+            return
+        self.active.discard(chat_id)
+        parked = self.parked.pop(chat_id, None)
+        if parked:
+            for entry in parked:
+                heapq.heappush(self.ready, entry)
+            self._start_pump()
+
+    async def _pump(self):
+        # Раздаёт токены ожидающим, пока очереди не опустеют
+        while True:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            entry = self._pop()
+            if entry is None:
+                # Пусто или все ждут своих чатов: _release запустит раздачу снова
+                self.flush_metrics()
+                return
+            self.tokens -= 1
+            if entry[3] is not None:
+                self.active.add(entry[3])
+            entry[2].set_result(None)
+
+    async def _acquire(self, priority, chat_id):
+        self._refill()
+        if self.tokens >= 1 and not self.ready and chat_id not in self.active:
+            self.tokens -= 1
+            if chat_id is not None:
+                self.active.add(chat_id)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.ready, (priority, next(self.sequence), future, chat_id))
+        self.waiting[priority] += 1
+        self._start_pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен и чат уже выданы, а запрос не пойдёт
+                self._release(chat_id)
+            raise
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=None, chat_id=None):
+        """Дождаться токена и своей очереди в чате; priority=None — класс текущей задачи"""
+        if priority is None:
+            priority = current_priority.get()
+        started = time.monotonic()
+        await self._acquire(priority, chat_id)
+        self._sample(priority, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release(chat_id)
+
+    def _sample(self, priority, wait):
+        self.stats[PRIORITY_NAMES[priority]] += 1
+        samples = self.samples[priority]
+        samples.append(wait)
+        if len(samples) >= self.metrics_batch:
+            self.flush_metrics()
+
+    def flush_metrics(self):
+        """Перенести накопленные замеры ожидания и длину очередей в метрики"""
+        for priority, name in enumerate(PRIORITY_NAMES):
+            for wait in self.samples[priority]:
+                OUTBOUND_QUEUE_SECONDS.observe(wait, name)
+            self.samples[priority].clear()
+            OUTBOUND_WAITING.set(self.waiting[priority], name)
+
+
+class OutboundRequest(InstrumentedRequest):
+    """Запросы бота идут через OutboundQueue: приоритет — из current_priority, чат — из chat_id запроса"""
+
+    def __init__(self, queue, **kwargs):
+        super().__init__(**kwargs)
+        self.queue = queue
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        chat_id = request_data.parameters.get('chat_id') if request_data is not None else None
+        async with self.queue.slot(chat_id=chat_id):
+            return await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
@@ -0,0 +1,245 @@
+"""Компактное хранение участников в памяти для больших розыгрышей"""
+import sys
+from array import array
+from collections.abc import Mapping
+
+# Нет пары (в массивах получателей и дарителей)
+NO_SLOT = -1
+
+# Строки участника в общей таблице: по FIELDS_PER_SLOT на слот
+NAME, WISH, NOT_WISH, USERNAME = range(4)
+FIELDS_PER_SLOT = 4
+
+
+class Bitset:
+    """Флаг на каждый слот: один бит вместо объекта bool в словаре"""
+    __slots__ = ('bits',)
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def __getitem__(self, slot):
+        byte = slot >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] >> (slot & 7) & 1)
+
+    def set(self, slot, value=True):
+        byte = slot >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte - len(self.bits) + 1))
+        if value:
+            self.bits[byte] |= 1 << (slot & 7)
+        else:
+            self.bits[byte] &= ~(1 << (slot & 7)) & 0xFF
+
+    def count(self):
+        return bin(int.from_bytes(self.bits, 'little')).count('1')
+
+    def clear(self):
+        self.bits = bytearray()
+
+
+class ParticipantStore:
+    """
+    Участники в плотных слотах вместо словаря словарей. user_id получает
+    номер слота при первой регистрации; по слоту лежат user_id в массиве,
+    строки анкеты в общей таблице texts, флаги в битовых наборах, пары —
+    номерами слотов в двух массивах. Повторные пожелания («нет», «-»)
+    интернируются и хранятся одной строкой. Слоты не освобождаются до clear:
+    участника можно только перерегистрировать или сбросить всех сразу.
+    Массивы — 'q' (8 байт на любой платформе): они попадают в снимки журнала.
+    """
+    __slots__ = ('slots', 'usernames', 'ids', 'texts', 'has_receiver', 'is_giver', 'notified',
+                 'receivers', 'givers', 'pair_count')
+
+    def __init__(self):
+        self.slots = {}  # user_id -> номер слота
+        self.usernames = {}  # username в нижнем регистре -> номер слота
+        self.ids = array('q')  # слот -> user_id
+        self.texts = []  # слот * FIELDS_PER_SLOT + поле -> строка или None
+        self.has_receiver = Bitset()
+        self.is_giver = Bitset()
+        self.notified = Bitset()
+        self.receivers = array('q')  # слот дарителя -> слот получателя
+        self.givers = array('q')  # слот получателя -> слот дарителя
+        self.pair_count = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, user_id):
+        return user_id in self.slots
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def put(self, user_id, username, full_name, wish=None, not_wish=None):
+        """
+        Записать анкету и сбросить флаги участника. Возвращает прежние
+        (notified, is_giver) для повторной регистрации или None для нового.
+        """
+        wish = wish and sys.intern(wish)
+        not_wish = not_wish and sys.intern(not_wish)
+        slot = self.slots.get(user_id)
+        if slot is None:
+            slot = self.slots[user_id] = len(self.ids)
+            self.ids.append(user_id)
+            self.texts.extend((full_name, wish, not_wish, username))
+            self.receivers.append(NO_SLOT)
+            self.givers.append(NO_SLOT)
+            if username:
+                self.usernames[username.lower()] = slot
+            return None
+
+        previous = (self.notified[slot], self.is_giver[slot])
+        base = slot * FIELDS_PER_SLOT
+        old = self.texts[base + USERNAME]
+        if old and self.usernames.get(old.lower()) == slot:
+            del self.usernames[old.lower()]
+        if username:
+            self.usernames[username.lower()] = slot
+        self.texts[base:base + FIELDS_PER_SLOT] = (full_name, wish, not_wish, username)
+        for flags in (self.has_receiver, self.is_giver, self.notified):
+            flags.set(slot, False)
+        return previous
+
+    def profile(self, user_id):
+        """(name, wish, not_wish) или None"""
+        slot = self.slots.get(user_id)
+        if slot is None:
+            return None
+        base = slot * FIELDS_PER_SLOT
+        return (self.texts[base + NAME], self.texts[base + WISH], self.texts[base + NOT_WISH])
+
+    def get(self, user_id):
+        """Данные участника в прежнем виде словаря (строится при каждом вызове) или None"""
+        slot = self.slots.get(user_id)
+        if slot is None:
+            return None
+        base = slot * FIELDS_PER_SLOT
+        return {
+            'name': self.texts[base + NAME],
+            'wish': self.texts[base + WISH],
+            'not_wish': self.texts[base + NOT_WISH],
+            'username': self.texts[base + USERNAME],
+            'has_receiver': self.has_receiver[slot],
+            'is_giver': self.is_giver[slot],
+            'notified': self.notified[slot]
+        }
+
+    def find_username(self, username):
+        """user_id по username без учёта регистра"""
+        slot = self.usernames.get(username.lower())
+        return None if slot is None else self.ids[slot]
+
+    def assign(self, giver_to_receiver):
+        """Записать распределение: флаги всех участников выставляются заново"""
+        size = len(self.ids)
+        self.receivers = array('q', [NO_SLOT]) * size
+        self.givers = array('q', [NO_SLOT]) * size
+        for flags in (self.has_receiver, self.is_giver, self.notified):
+            flags.clear()
+        slots = self.slots
+        for giver_id, receiver_id in giver_to_receiver.items():
+            giver, receiver = slots[giver_id], slots[receiver_id]
+            self.receivers[giver] = receiver
+            self.givers[receiver] = giver
+            self.is_giver.set(giver)
+            self.has_receiver.set(receiver)
+        self.pair_count = len(giver_to_receiver)
+
+    def receiver_of(self, giver_id):
+        slot = self.slots.get(giver_id)
+        if slot is None or self.receivers[slot] == NO_SLOT:
+            return None
+        return self.ids[self.receivers[slot]]
+
+    def giver_of(self, receiver_id):
+        slot = self.slots.get(receiver_id)
+        if slot is None or self.givers[slot] == NO_SLOT:
+            return None
+        return self.ids[self.givers[slot]]
+
+    def pairs(self):
+        """Все пары: giver_id -> receiver_id (новый словарь)"""
+        ids = self.ids
+        return {ids[giver]: ids[receiver] for giver, receiver in enumerate(self.receivers) if receiver != NO_SLOT}
+
+    def export_rows(self, start, stop):
+        """Строки выгрузки слотов start..stop: анкета, флаг уведомления и получатель"""
+        texts = self.texts
+        for slot in range(start, stop):
+            base = slot * FIELDS_PER_SLOT
+            receiver = self.receivers[slot]
+            yield (self.ids[slot], texts[base + USERNAME], texts[base + NAME], texts[base + WISH],
+                   texts[base + NOT_WISH], self.notified[slot],
+                   None if receiver == NO_SLOT else self.ids[receiver],
+                   None if receiver == NO_SLOT else texts[receiver * FIELDS_PER_SLOT + NAME])
+
+    def mark_notified(self, user_id):
+        """Поставить флаг уведомления; True, если он изменился"""
+        slot = self.slots.get(user_id)
+        if slot is None or self.notified[slot]:
+            return False
+        self.notified.set(slot)
+        return True
+
+    def is_notified(self, user_id):
+        slot = self.slots.get(user_id)
+        return slot is not None and self.notified[slot]
+
+    def dump(self):
+        """Состояние для снимка: только байты, строки и числа"""
+        return (self.ids.tobytes(), self.texts, bytes(self.has_receiver.bits), bytes(self.is_giver.bits),
+                bytes(self.notified.bits), self.receivers.tobytes(), self.givers.tobytes(), self.pair_count)
+
+    def load(self, state):
+        ids, texts, has_receiver, is_giver, notified, receivers, givers, pair_count = state
+        self.ids = array('q')
+        self.ids.frombytes(ids)
+        self.slots = dict(zip(self.ids, range(len(self.ids))))
+        self.texts = texts
+        self.usernames = {}
+        for slot in range(len(self.ids)):
+            username = texts[slot * FIELDS_PER_SLOT + USERNAME]
+            if username:
+                self.usernames[username.lower()] = slot
+        for flags, bits in ((self.has_receiver, has_receiver), (self.is_giver, is_giver), (self.notified, notified)):
+            flags.bits = bytearray(bits)
+        self.receivers = array('q')
+        self.receivers.frombytes(receivers)
+        self.givers = array('q')
+        self.givers.frombytes(givers)
+        self.pair_count = pair_count
+
+    def clear(self):
+        self.slots.clear()
+        self.usernames.clear()
+        self.ids = array('q')
+        self.texts = []
+        for flags in (self.has_receiver, self.is_giver, self.notified):
+            flags.clear()
+        self.receivers = array('q')
+        self.givers = array('q')
+        self.pair_count = 0
+
+
+class ParticipantsView(Mapping):
+    """
+    Участники только для чтения в виде user_id -> данные, как раньше
+    возвращал get_all. Словари строятся при обращении и не хранятся.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, user_id):
+        data = self.store.get(user_id)
+        if data is None:
+            raise KeyError(user_id)
+        return data
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
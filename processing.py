@@ -0,0 +1,74 @@
+"""Параллельная обработка обновлений с сохранением порядка для каждого пользователя"""
+import asyncio
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import UPDATE_QUEUE_SECONDS, UPDATES_IN_FLIGHT
+
+# Сколько обновлений может ждать своей очереди. Держим с запасом, чтобы
+# семафор PTB не блокировал задачи раньше наших замков: иначе один
+# пользователь, приславший много сообщений, занял бы все слоты
+MAX_PENDING_UPDATES = 10_000
+
+
+def update_key(update):
+    """Ключ очереди: ID пользователя, для обновлений без пользователя — ID чата"""
+    user = getattr(update, 'effective_user', None)
+    if user:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    return chat.id if chat else None
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent одновременно), а обновления одного пользователя — строго
+    по очереди: шаги регистрации в handle_message не перемешиваются.
+    """
+
+    def __init__(self, max_concurrent=32):
+        super().__init__(MAX_PENDING_UPDATES)
+        self.active = asyncio.Semaphore(max_concurrent)
+        self.locks = {}  # ключ -> [замок, сколько обновлений его ждут]
+
+    async def do_process_update(self, update, coroutine):
+        queued = time.perf_counter()
+        UPDATES_IN_FLIGHT.inc('total')
+        try:
+            key = update_key(update)
+            if key is None:
+                async with self.active:
+                    await self._run(coroutine, queued)
+                return
+
+            entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                # asyncio.Lock отдаёт замок в порядке очереди, а задачи доходят
+                # до него в порядке поступления обновлений
+                async with entry[0]:
+                    async with self.active:
+                        await self._run(coroutine, queued)
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+        finally:
+            UPDATES_IN_FLIGHT.dec('total')
+
+    async def _run(self, coroutine, queued):
+        """Очередь пользователя и общий лимит пройдены — обрабатываем"""
+        UPDATE_QUEUE_SECONDS.observe(time.perf_counter() - queued)
+        UPDATES_IN_FLIGHT.inc('running')
+        try:
+            await coroutine
+        finally:
+            UPDATES_IN_FLIGHT.dec('running')
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
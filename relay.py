@@ -0,0 +1,256 @@
+"""Анонимная переписка Санты и получателя: сообщения копятся по чатам и доставляются пачками"""
+import asyncio
+import heapq
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import NetworkError, RetryAfter, TelegramError
+
+from broadcast import PER_CHAT_INTERVAL
+from metrics import ERRORS, RELAY_MESSAGES
+from outbound import ADMIN, current_priority
+
+logger = logging.getLogger(__name__)
+
+# Длина одного сообщения участника
+RELAY_MAX_LENGTH = 1000
+# Сообщение Telegram ограничено 4096 символами
+MAX_MESSAGE_LENGTH = 4000
+# Сколько чатов доставляется одновременно (общий лимит запросов держит OutboundQueue)
+RELAY_WORKERS = 8
+# Не чаще одного сообщения от участника за столько секунд: один не завалит другого
+RELAY_SENDER_INTERVAL = 3.0
+# Как часто чистить истёкшие отметки времени чатов и отправителей
+RELAY_SWEEP_INTERVAL = 60.0
+
+SQL_OUTBOX = '''
+    CREATE TABLE IF NOT EXISTS relay_messages (
+        message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+'''
+SQL_ADD = "INSERT INTO relay_messages (chat_id, text, created_at) VALUES (?, ?, ?)"
+SQL_PENDING = "SELECT message_id, chat_id, text FROM relay_messages ORDER BY message_id"
+SQL_DELIVERED = "DELETE FROM relay_messages WHERE message_id = ?"
+
+
+class RelayOutbox:
+    """Недоставленные сообщения в SQLite: запись при приёме, удаление после доставки"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQL_OUTBOX)
+
+    def add(self, chat_id, text):
+        with self.conn:
+            return self.conn.execute(SQL_ADD, (chat_id, text, time.time())).lastrowid
+
+    def delivered(self, message_ids):
+        with self.conn:
+            self.conn.executemany(SQL_DELIVERED, ((message_id,) for message_id in message_ids))
+
+    def pending(self):
+        return self.conn.execute(SQL_PENDING).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def render(messages):
+    """Текст пачки: сколько влезет в одно сообщение Telegram, минимум одно"""
+    size = 0
+    taken = 0
+    for _, text in messages:
+        if taken and size + len(text) + 2 > MAX_MESSAGE_LENGTH:
+            break
+        size += len(text) + 2
+        taken += 1
+    return "\n\n".join(text for _, text in messages[:taken])[:MAX_MESSAGE_LENGTH], taken
+
+
+class AnonymousRelay:
+    """
+    Анонимные сообщения между Сантой и получателем. add сохраняет
+    сообщение в outbox (запись — в своём потоке, цикл событий не ждёт
+    диск) и сразу возвращается; run доставляет: всё, что
+    накопилось для чата, уходит одним сообщением, и между сообщениями
+    в один чат не меньше per_chat_interval. Чаты ждут своей очереди в куче
+    по времени, поэтому цикл не перебирает тысячи чатов. RetryAfter и
+    сетевые ошибки откладывают чат, остальные ошибки (бот заблокирован)
+    пишутся в лог, и сообщения чата отбрасываются. Недоставленное
+    переживает перезапуск: при создании оно поднимается из outbox.
+    Отправитель пишет не чаще раза в sender_interval, иначе add отказывает.
+    """
+
+    def __init__(self, outbox, workers=RELAY_WORKERS, per_chat_interval=PER_CHAT_INTERVAL,
+                 sender_interval=RELAY_SENDER_INTERVAL):
+        self.outbox = outbox
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.sender_interval = sender_interval
+        self.chats = {}  # chat_id -> [(message_id, текст)] в порядке приёма
+        self.due = []  # куча (monotonic-время, chat_id) чатов, ждущих доставки
+        self.scheduled = set()  # чаты в куче или в доставке
+        self.next_send = {}  # chat_id -> monotonic-время, раньше которого в чат не пишем
+        self.next_accept = {}  # sender_id -> monotonic-время, раньше которого сообщения не принимаем
+        self.sweep_at = time.monotonic() + RELAY_SWEEP_INTERVAL
+        self.ready = asyncio.Queue()
+        self.wakeup = asyncio.Event()
+        # Один поток: запись и удаление в outbox идут по очереди
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='relay')
+        self.stats = {'messages': 0, 'sent': 0, 'delivered': 0, 'throttled': 0, 'failed': 0,
+                      'limited': 0}
+
+        restored = outbox.pending()
+        for message_id, chat_id, text in restored:
+            self._queue(chat_id, message_id, text)
+        if restored:
+            logger.info(f"Недоставленных анонимных сообщений: {len(restored)}")
+
+    async def _outbox(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def sender_wait(self, sender_id):
+        """Сколько секунд sender_id ещё ждать, прежде чем add примет его сообщение"""
+        return max(0.0, self.next_accept.get(sender_id, 0) - time.monotonic())
+
+    async def add(self, chat_id, text, sender_id=None):
+        """Принять сообщение для chat_id; False — слишком часто или не удалось сохранить"""
+        if sender_id is not None:
+            if self.sender_wait(sender_id):
+                self.stats['limited'] += 1
+                RELAY_MESSAGES.inc('limited')
+                return False
+            self.next_accept[sender_id] = time.monotonic() + self.sender_interval
+        try:
+            message_id = await self._outbox(self.outbox.add, chat_id, text)
+        except sqlite3.Error as e:
+            ERRORS.inc('relay', type(e).__name__)
+            logger.error(f"Сообщение для {chat_id} не сохранено: {e}")
+            # Не принятое сообщение не считается: можно сразу повторить
+            self.next_accept.pop(sender_id, None)
+            return False
+        self.stats['messages'] += 1
+        RELAY_MESSAGES.inc('accepted')
+        self._queue(chat_id, message_id, text)
+        return True
+
+    def _queue(self, chat_id, message_id, text):
+        messages = self.chats.get(chat_id)
+        if messages is None:
+            messages = self.chats[chat_id] = []
+        messages.append((message_id, text))
+        if chat_id not in self.scheduled:
+            self._schedule(chat_id, self.next_send.pop(chat_id, 0))
+
+    def _schedule(self, chat_id, when):
+        self.scheduled.add(chat_id)
+        heapq.heappush(self.due, (when, chat_id))
+        self.wakeup.set()
+
+    async def run(self, bot):
+        """Цикл доставки (до отмены задачи)"""
+        # Между ответами пользователям и рассылкой
+        current_priority.set(ADMIN)
+        workers = [asyncio.create_task(self._deliver(bot)) for _ in range(self.workers)]
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= self.sweep_at:
+                    self._sweep(now)
+                while self.due and self.due[0][0] <= now:
+                    self.ready.put_nowait(heapq.heappop(self.due)[1])
+                timeout = self.due[0][0] - now if self.due else None
+                if self.next_send or self.next_accept:
+                    sweep = self.sweep_at - now
+                    timeout = sweep if timeout is None else min(timeout, sweep)
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def _deliver(self, bot):
+        while True:
+            chat_id = await self.ready.get()
+            await self._send(bot, chat_id)
+
+    async def _send(self, bot, chat_id):
+        messages = self.chats[chat_id]
+        text, taken = render(messages)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+
+        except RetryAfter as e:
+            self.stats['throttled'] += 1
+            RELAY_MESSAGES.inc('throttled')
+            logger.warning(f"Анонимные сообщения для {chat_id} отложены на {e.retry_after} с")
+            self._retry(chat_id, e.retry_after)
+            return
+
+        except NetworkError as e:
+            ERRORS.inc('relay', type(e).__name__)
+            logger.warning(f"Анонимные сообщения для {chat_id} не отправлены ({e}), повторю позже")
+            self._retry(chat_id, self.per_chat_interval)
+            return
+
+        except TelegramError as e:
+            # Получатель заблокировал бота и т. п.: повтор не поможет
+            ERRORS.inc('relay', type(e).__name__)
+            self.stats['failed'] += len(messages)
+            RELAY_MESSAGES.inc('failed', amount=len(messages))
+            logger.error(f"Анонимные сообщения для {chat_id} потеряны ({len(messages)}): {e}")
+            del self.chats[chat_id]
+            self.scheduled.discard(chat_id)
+            await self._forget(messages)
+            return
+
+        self.stats['sent'] += 1
+        self.stats['delivered'] += taken
+        RELAY_MESSAGES.inc('sent')
+        delivered = messages[:taken]
+        del messages[:taken]
+        if messages:
+            self._retry(chat_id, self.per_chat_interval)
+        else:
+            del self.chats[chat_id]
+            self.scheduled.discard(chat_id)
+            self.next_send[chat_id] = time.monotonic() + self.per_chat_interval
+        await self._forget(delivered)
+
+    def _sweep(self, now):
+        # Отметки, время которых прошло, ничего не ограничивают: без чистки словари растут
+        # с каждым новым чатом и отправителем
+        self.next_send = {chat_id: when for chat_id, when in self.next_send.items() if when > now}
+        self.next_accept = {sender_id: when for sender_id, when in self.next_accept.items() if when > now}
+        self.sweep_at = now + RELAY_SWEEP_INTERVAL
+
+    def _retry(self, chat_id, delay):
+        # Чат остаётся в scheduled: новые сообщения дождутся этой доставки
+        heapq.heappush(self.due, (time.monotonic() + delay, chat_id))
+        self.wakeup.set()
+
+    async def _forget(self, messages):
+        try:
+            await self._outbox(self.outbox.delivered, [message_id for message_id, _ in messages])
+        except sqlite3.Error as e:
+            # Доставленное останется в outbox и после перезапуска придёт ещё раз
+            ERRORS.inc('relay', type(e).__name__)
+            logger.error(f"Outbox: {e}")
+
+    def pending(self):
+        return sum(len(messages) for messages in self.chats.values())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.outbox.close()
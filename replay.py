@@ -0,0 +1,98 @@
+"""Обновления, пришедшие во время перезапуска: забрать, отфильтровать и обработать"""
+import logging
+import os
+import time
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних обновлений очереди Telegram обработать после перезапуска
+REPLAY_LIMIT = int(os.environ.get('REPLAY_LIMIT', '300'))
+# Сообщения старше стольких секунд не обрабатываем: пользователь уже не ждёт ответа
+REPLAY_MAX_AGE = float(os.environ.get('REPLAY_MAX_AGE', '600'))
+# getUpdates отдаёт не больше 100 обновлений за запрос
+GET_UPDATES_LIMIT = 100
+
+
+def replay_key(update):
+    """
+    Ключ повтора: одинаковые команды и нажатия инлайн-кнопок одного
+    пользователя — одно действие. Обычный текст ключа не имеет: это ответ
+    на шаг диалога, и одинаковые ответы подряд («нет», «нет») — разные шаги.
+    """
+    user = update.effective_user
+    if user is None:
+        return None
+    if update.message is not None and update.message.text is not None:
+        if not update.message.text.startswith('/'):
+            return None
+        return user.id, 'command', update.message.text
+    if update.callback_query is not None:
+        return user.id, 'callback', update.callback_query.data
+    return None
+
+
+def select(updates, now, max_age=REPLAY_MAX_AGE):
+    """
+    Что обработать из накопившихся обновлений: без устаревших сообщений
+    и без повторов подряд (пять «/start» подряд — один «/start»), в исходном
+    порядке. Повтор — та же команда или кнопка сразу после предыдущей от того
+    же пользователя; ответы на шаги анкеты не отбрасываются никогда.
+    Возвращает (обновления, отчёт).
+    """
+    report = {'received': len(updates), 'stale': 0, 'duplicates': 0}
+    last = {}  # user_id -> ключ последнего обновления пользователя
+    selected = []
+    for update in updates:
+        message = update.message or update.edited_message
+        if message is not None and now - message.date.timestamp() > max_age:
+            report['stale'] += 1
+            continue
+        key = replay_key(update)
+        user = update.effective_user
+        if user is not None:
+            if key is not None and last.get(user.id) == key:
+                report['duplicates'] += 1
+                continue
+            last[user.id] = key
+        selected.append(update)
+    report['replayed'] = len(selected)
+    return selected, report
+
+
+async def fetch_pending(bot, limit=REPLAY_LIMIT):
+    """
+    Забрать не больше limit последних ожидающих обновлений и подтвердить
+    их Telegram. Более старые Telegram забывает сам (отрицательный offset).
+    Webhook снимается без сброса очереди: пока он стоит, getUpdates не работает.
+    """
+    await bot.delete_webhook(drop_pending_updates=False)
+    updates = []
+    offset = -limit
+    while len(updates) < limit:
+        batch = await bot.get_updates(
+            offset=offset, limit=min(GET_UPDATES_LIMIT, limit - len(updates)), timeout=0,
+            allowed_updates=Update.ALL_TYPES
+        )
+        if not batch:
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    if updates:
+        # Запрос со следующим offset подтверждает полученные; то, что он вернёт, придёт ещё раз
+        await bot.get_updates(offset=updates[-1].update_id + 1, limit=1, timeout=0)
+    return updates
+
+
+async def replay_pending(application, limit=REPLAY_LIMIT, max_age=REPLAY_MAX_AGE):
+    """Поставить в очередь приложения то, что пользователи прислали, пока бот лежал"""
+    updates = await fetch_pending(application.bot, limit)
+    selected, report = select(updates, time.time(), max_age)
+    for update in selected:
+        await application.update_queue.put(update)
+    logger.info(
+        f"После перезапуска: получено {report['received']}, обработано {report['replayed']}, "
+        f"устаревших {report['stale']}, повторов {report['duplicates']}"
+    )
+    return report
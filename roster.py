@@ -0,0 +1,202 @@
+"""Массовый импорт участников из CSV/JSONL и выгрузка пар и статусов"""
+import csv
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк регистрировать одной транзакцией и выгружать за один запрос
+IMPORT_BATCH = 1000
+EXPORT_PAGE = 1000
+# Сколько ошибок показывать организатору (считаются все)
+MAX_REPORTED_ERRORS = 20
+# Ограничения полей, как при регистрации в чате
+MIN_NAME_LENGTH = 5
+MAX_FIELD_LENGTH = 1000
+
+EXPORT_COLUMNS = ('user_id', 'username', 'full_name', 'wish', 'not_wish', 'notified', 'receiver_id', 'receiver_name')
+# Заголовки колонок, которые принимаем за full_name
+NAME_ALIASES = ('full_name', 'name', 'фио')
+
+
+def roster_format(path):
+    """'csv' или 'jsonl' по расширению файла, None — неизвестный формат"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.csv', '.txt'):
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    return None
+
+
+def parse_rows(stream, kind):
+    """
+    Строки файла по одной: (номер строки, словарь полей или None при
+    ошибке разбора). Файл не читается целиком.
+    """
+    if kind == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                fields = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, None
+                continue
+            yield line_number, fields if isinstance(fields, dict) else None
+        return
+
+    header = stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    columns = [column.strip().lower() for column in next(csv.reader([header], dialect), [])]
+    reader = csv.reader(stream, dialect)
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        # reader.line_num считает от второй строки файла: заголовок прочитан отдельно
+        yield reader.line_num + 1, dict(zip(columns, values))
+
+
+def _text(fields, *names):
+    for name in names:
+        value = fields.get(name)
+        if value is not None:
+            value = str(value).strip()
+            return value or None
+    return None
+
+
+def validate(fields):
+    """Кортеж для register_many: (user_id, username, full_name, wish, not_wish); ValueError — строка с ошибкой"""
+    if fields is None:
+        raise ValueError("строку не удалось разобрать")
+    try:
+        user_id = int(_text(fields, 'user_id', 'id') or '')
+    except ValueError:
+        raise ValueError("нет числового user_id") from None
+    if user_id <= 0:
+        raise ValueError("user_id должен быть положительным")
+
+    full_name = _text(fields, *NAME_ALIASES)
+    if not full_name or len(full_name) < MIN_NAME_LENGTH:
+        raise ValueError("слишком короткое ФИО")
+    username = _text(fields, 'username')
+    wish = _text(fields, 'wish')
+    not_wish = _text(fields, 'not_wish')
+    if any(value and len(value) > MAX_FIELD_LENGTH for value in (full_name, username, wish, not_wish)):
+        raise ValueError(f"поле длиннее {MAX_FIELD_LENGTH} символов")
+
+    # 'нет' в пожеланиях — как при регистрации в чате
+    wish = None if wish and wish.lower() == 'нет' else wish
+    not_wish = None if not_wish and not_wish.lower() == 'нет' else not_wish
+    return (user_id, username.lstrip('@') if username else None, full_name, wish, not_wish)
+
+
+async def import_roster(db, path, batch_size=IMPORT_BATCH, on_batch=None):
+    """
+    Зарегистрировать участников из файла пачками через register_many.
+    Корутина on_batch(user_ids) ожидается после каждой записанной пачки.
+    В памяти только текущая пачка; возвращает отчёт:
+    imported, error_count и первые MAX_REPORTED_ERRORS ошибок (строка, текст).
+    """
+    report = {'imported': 0, 'error_count': 0, 'errors': []}
+    kind = roster_format(path)
+    if kind is None:
+        report['error_count'] = 1
+        report['errors'].append((0, "нужен файл .csv или .jsonl"))
+        return report
+
+    def error(line_number, message):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append((line_number, message))
+
+    async def write(batch):
+        if await db.register_many(batch):
+            report['imported'] += len(batch)
+            if on_batch is not None:
+                await on_batch([row[0] for row in batch])
+        else:
+            error(0, f"не удалось записать пачку из {len(batch)} строк")
+
+    batch = []
+    # utf-8-sig: Excel сохраняет CSV с BOM
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        for line_number, fields in parse_rows(stream, kind):
+            try:
+                batch.append(validate(fields))
+            except ValueError as e:
+                error(line_number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                await write(batch)
+                batch = []
+    if batch:
+        await write(batch)
+
+    logger.info(f"Импорт {path}: {report['imported']} участников, ошибок: {report['error_count']}")
+    return report
+
+
+async def export_roster(db, path, page_size=EXPORT_PAGE):
+    """Выгрузить участников, получателей и статус уведомления постранично; возвращает число строк"""
+    kind = roster_format(path) or 'csv'
+    count = 0
+    cursor = None
+    with open(path, 'w', encoding='utf-8-sig' if kind == 'csv' else 'utf-8', newline='') as stream:
+        writer = csv.writer(stream)
+        if kind == 'csv':
+            writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows, cursor = await db.export_page(cursor, page_size)
+            for row in rows:
+                row = (*row[:5], bool(row[5]), *row[6:])
+                if kind == 'csv':
+                    writer.writerow(row)
+                else:
+                    stream.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+            count += len(rows)
+            if cursor is None:
+                return count
+
+
+def format_report(report):
+    """Отчёт импорта для организатора"""
+    text = f"📥 Импортировано участников: {report['imported']}\n"
+    if report['error_count']:
+        text += f"⚠️ Строк с ошибками: {report['error_count']}\n"
+        for line_number, message in report['errors']:
+            text += f"• строка {line_number}: {message}\n" if line_number else f"• {message}\n"
+    return text
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    import database
+    from database import AsyncStorage
+
+    parser = argparse.ArgumentParser(description="Импорт и выгрузка участников для SQLite-хранилища")
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'santa.db'), help="файл базы розыгрыша")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('import', help="зарегистрировать участников из .csv/.jsonl").add_argument('path')
+    commands.add_parser('export', help="выгрузить участников и пары в .csv/.jsonl").add_argument('path')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    async def run_command(db_path):
+        db = AsyncStorage(database.SantaDatabase(db_path))
+        try:
+            if args.command == 'import':
+                print(format_report(await import_roster(db, args.path)))
+            else:
+                print(f"Выгружено строк: {await export_roster(db, args.path)}")
+        finally:
+            db.close()
+
+    asyncio.run(run_command(args.db))
@@ -0,0 +1,139 @@
+"""Маршрутизация текстовых сообщений по таблице: кнопки меню и шаги диалога"""
+import contextlib
+import time
+from collections import deque
+
+from metrics import ERRORS, HANDLER_SECONDS, percentile
+
+# Маршрут состояния, который принимает любой текст (ввод ФИО, пожеланий)
+ANY_TEXT = object()
+
+# Сколько последних замеров хранить для перцентилей
+LATENCY_WINDOW = 1000
+
+
+def get_state(context):
+    """Состояние диалога пользователя (None — обычное меню)"""
+    return context.user_data.get('state')
+
+
+def set_state(context, state):
+    if state is None:
+        context.user_data.pop('state', None)
+    else:
+        context.user_data['state'] = state
+
+
+class RouteStats:
+    """Время обработки одного маршрута"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, elapsed, failed=False):
+        self.count += 1
+        self.errors += failed
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.recent.append(elapsed)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': percentile(recent, 50),
+            'p99': percentile(recent, 99),
+            'max': self.max
+        }
+
+
+class Router:
+    """
+    Таблица маршрутов: ключ — (состояние диалога, текст кнопки).
+    Для пользователя в состоянии сначала ищется маршрут этого состояния
+    (точный текст, затем ANY_TEXT), потом обычная кнопка; не нашлось —
+    fallback. Поиск — несколько обращений к словарю, сколько бы ни было кнопок.
+    admin=True — маршрут только для организаторов (is_admin(update)),
+    остальным отвечает fallback. menu_first=True у маршрута ANY_TEXT —
+    в этом состоянии кнопки меню важнее произвольного текста, и нажатие
+    кнопки выводит из состояния. Каждый маршрут замеряет время обработки.
+    scope() — контекст на всё время обработки обновления (например,
+    закрепление событий, с которыми работает обработчик).
+    """
+
+    def __init__(self, is_admin, fallback=None, scope=contextlib.nullcontext):
+        self.is_admin = is_admin
+        self.fallback = fallback
+        self.scope = scope
+        self.routes = {}  # (state, text) -> (имя маршрута, обработчик, admin)
+        self.menu_first = set()  # состояния, в которых кнопки меню важнее ANY_TEXT
+        self.stats = {}  # имя маршрута -> RouteStats
+
+    def add(self, text, handler, state=None, admin=False, menu_first=False):
+        self.routes[(state, text)] = (handler.__name__, handler, admin)
+        if menu_first:
+            self.menu_first.add(state)
+
+    def find(self, state, text):
+        route = self.routes.get((state, text))
+        if route is None and state is not None:
+            button = self.routes.get((None, text))
+            if button is not None and state in self.menu_first:
+                return button
+            route = self.routes.get((state, ANY_TEXT)) or button
+        return route
+
+    async def dispatch(self, update, context):
+        """Обработчик всех текстовых сообщений"""
+        with self.scope():
+            state = get_state(context)
+            route = self.find(state, update.message.text)
+            if route is not None and route[2] and not await self.is_admin(update):
+                route = None
+            if route is None:
+                route = ('fallback', self.fallback, False)
+            elif state in self.menu_first and route is self.routes.get((None, update.message.text)):
+                # Кнопка меню вместо ввода: выходим из состояния
+                set_state(context, None)
+            name, handler, _ = route
+            await self.run(name, handler, update, context)
+
+    def timed(self, handler, name=None):
+        """Обёртка для CommandHandler и CallbackQueryHandler с замером времени"""
+        name = name or handler.__name__
+
+        async def wrapper(update, context):
+            with self.scope():
+                await self.run(name, handler, update, context)
+        return wrapper
+
+    async def run(self, name, handler, update, context):
+        started = time.perf_counter()
+        failed = True
+        try:
+            await handler(update, context)
+            failed = False
+        except Exception as e:
+            ERRORS.inc('handler', type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = RouteStats()
+            stats.add(elapsed, failed)
+            HANDLER_SECONDS.observe(elapsed, name)
+
+    def report(self):
+        """Сводка по маршрутам, самые затратные — первыми"""
+        return sorted(
+            ((name, stats.summary()) for name, stats in self.stats.items()),
+            key=lambda item: item[1]['avg'] * item[1]['count'],
+            reverse=True
+        )
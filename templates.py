@@ -0,0 +1,91 @@
+"""Шаблоны сообщений: собираются один раз, карточки получателей кэшируются"""
+import string
+
+
+class MessageTemplate:
+    """
+    Шаблон из заголовка, необязательных блоков и подвала. При создании для
+    каждого сочетания заполненных блоков текст собирается в строку формата
+    с номерами значений, поэтому render только выбирает вариант по маске
+    заполненных блоков и вызывает str.format. Блок выводится, только если
+    его значение не пустое. Значения передаются позиционно, в порядке fields.
+    """
+
+    def __init__(self, fields, header, blocks=(), footer=""):
+        self.fields = fields
+        position = {name: index for index, name in enumerate(fields)}
+        self.blocks = tuple((1 << bit, position[key]) for bit, (key, _) in enumerate(blocks))
+        self.variants = []  # маска заполненных блоков -> строка формата с номерами значений
+        for mask in range(2 ** len(blocks)):
+            text = header + "".join(block for bit, (_, block) in enumerate(blocks) if mask >> bit & 1) + footer
+            parts = []
+            for literal, field, _, _ in string.Formatter().parse(text):
+                parts.append(literal.replace("{", "{{").replace("}", "}}"))
+                if field is not None:
+                    parts.append(f"{{{position[field]}}}")
+            self.variants.append("".join(parts))
+
+    def render(self, *values):
+        mask = 0
+        for bit, index in self.blocks:
+            if values[index]:
+                mask |= bit
+        return self.variants[mask].format(*values)
+
+
+# Карточка получателя: одна и та же в ответе на кнопку и в рассылке
+GIFT_CARD = MessageTemplate(
+    fields=('name', 'wish', 'not_wish'),
+    header=(
+        "🎅 **Твой Тайный Санта назначен!** 🎅\n\n"
+        "👤 **Ты даришь подарок:** {name}\n"
+    ),
+    blocks=(
+        ('wish', "\n✅ **Что хочет получить:**\n{wish}\n"),
+        ('not_wish', "\n❌ **Что НЕ хочет получать:**\n{not_wish}\n"),
+    ),
+    footer=(
+        "\n⚠️ **Важно:**\n"
+        "• Этот выбор окончательный\n"
+        "• Изменить получателя нельзя\n"
+        "• Сохраните это сообщение\n\n"
+        "🎄 **Счастливого Нового года!** 🎄"
+    )
+)
+
+
+class CardCache:
+    """
+    Готовые карточки получателей: receiver_id -> (анкета, текст).
+    Карточка отдаётся из кэша, только если анкета не изменилась, так что
+    устаревший текст не попадёт к дарителю даже без invalidate; invalidate
+    и clear освобождают память при изменении анкеты и сбросе.
+    """
+
+    def __init__(self, template=GIFT_CARD, max_size=10_000):
+        self.template = template
+        self.max_size = max_size
+        self.cards = {}
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, receiver_id, name, wish, not_wish):
+        profile = (name, wish, not_wish)
+        entry = self.cards.get(receiver_id)
+        if entry is not None and entry[0] == profile:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        text = self.template.render(name, wish, not_wish)
+        if entry is None and len(self.cards) >= self.max_size:
+            # Вытесняем самую старую карточку (словарь хранит порядок вставки)
+            del self.cards[next(iter(self.cards))]
+        self.cards[receiver_id] = (profile, text)
+        return text
+
+    def invalidate(self, receiver_id):
+        self.cards.pop(receiver_id, None)
+
+    def clear(self):
+        self.cards.clear()
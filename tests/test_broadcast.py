@@ -0,0 +1,107 @@
+"""Рассылка: повторы после 429 и сетевых ошибок, сохранение недоставленных"""
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+from broadcast import BroadcastEngine, BroadcastJob
+
+
+class FlakyBot:
+    """Бот, который для заданных чатов всегда отвечает ошибкой"""
+
+    def __init__(self, errors):
+        self.errors = errors  # chat_id -> фабрика исключения
+        self.calls = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls[chat_id] = self.calls.get(chat_id, 0) + 1
+        if chat_id in self.errors:
+            raise self.errors[chat_id]()
+        return SimpleNamespace(message_id=1, text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return True
+
+
+def test_retry_after_is_capped():
+    async def scenario():
+        bot = FlakyBot({1: lambda: RetryAfter(0)})
+        engine = BroadcastEngine(bot, rate=1000, per_chat_interval=0, max_throttled=3)
+        failed = []
+        report = await asyncio.wait_for(
+            engine.run([(1, "a"), (2, "b")], on_failed=lambda chat_id, e: failed.append(chat_id)), 5
+        )
+        assert report['sent'] == 1
+        assert report['failed'] == 1
+        assert failed == [1]
+        # Первая попытка и три повтора
+        assert bot.calls[1] == 4
+
+    asyncio.run(scenario())
+
+
+def test_job_keeps_retryable_failures(tmp_path):
+    state_path = os.path.join(tmp_path, 'job.json')
+
+    async def scenario():
+        bot = FlakyBot({2: lambda: NetworkError("timeout"), 3: lambda: Forbidden("blocked")})
+        notified = []
+        job = BroadcastJob(bot, chat_id=100, pending=[1, 2, 3], render=lambda user_id: f"для {user_id}",
+                           on_sent=notified.append, state_path=state_path)
+        job.engine.base_delay = 0
+        await asyncio.wait_for(job.start(), 10)
+        assert notified == [1]
+        assert job.failed == 1
+        assert job.retry == {2}
+
+        # Сетевая ошибка осталась в файле состояния, заблокировавший бота — нет
+        with open(state_path, encoding='utf-8') as f:
+            assert json.load(f)['retry'] == [2]
+
+        restored = await BroadcastJob.restore(bot, render=lambda user_id: f"для {user_id}",
+                                              on_sent=notified.append, is_pending=lambda user_id: True,
+                                              state_path=state_path)
+        assert restored.pending == {2}
+        assert restored.failed == 1
+
+    asyncio.run(scenario())
+
+
+def test_state_removed_when_everything_delivered(tmp_path):
+    state_path = os.path.join(tmp_path, 'job.json')
+
+    async def scenario():
+        job = BroadcastJob(FlakyBot({}), chat_id=100, pending=[1, 2], render=lambda user_id: "текст",
+                           on_sent=lambda user_id: None, state_path=state_path)
+        await asyncio.wait_for(job.start(), 10)
+        assert job.sent == 2
+        assert not os.path.exists(state_path)
+
+    asyncio.run(scenario())
+
+
+def test_restore_from_read_state_skips_file(tmp_path):
+    state_path = os.path.join(tmp_path, 'job.json')
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump({'chat_id': 7, 'pending': [1, 2]}, f)
+
+    state = BroadcastJob.read_state(state_path)
+    assert state['chat_id'] == 7
+    assert BroadcastJob.read_state(os.path.join(tmp_path, 'missing.json')) is None
+
+    async def scenario():
+        # Состояние передано готовым — файл повторно не читается
+        os.remove(state_path)
+        checked = []
+        job = await BroadcastJob.restore(FlakyBot({}), render=lambda user_id: "текст",
+                                         on_sent=lambda user_id: None,
+                                         is_pending=lambda user_id: checked.append(user_id) or True,
+                                         state_path=state_path, state=state)
+        assert job.chat_id == 7
+        assert job.pending == {1, 2}
+        assert checked == [1, 2]
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+"""Общее состояние рабочих процессов: блокировки, версии, раздача обновлений"""
+import os
+import time
+
+import pytest
+from telegram import Update
+
+from cluster import CATALOG_SCOPE, MemoryStore, SqliteStore, shard_of
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        store = MemoryStore()
+    else:
+        store = SqliteStore(os.path.join(tmp_path, 'cluster.db'), poll_interval=0)
+    yield store
+    store.close()
+
+
+def test_lock_is_exclusive(store):
+    assert store.try_lock('broadcast:a', owner='w1')
+    assert not store.try_lock('broadcast:a', owner='w2')
+    # Занятую блокировку не получает и сам владелец
+    assert not store.try_lock('broadcast:a', owner='w1')
+    # Другие имена независимы
+    assert store.try_lock('broadcast:b', owner='w2')
+
+
+def test_lock_expires(store):
+    assert store.try_lock('distribute:a', owner='w1', ttl=0.05)
+    assert not store.try_lock('distribute:a', owner='w2')
+    time.sleep(0.1)
+    assert store.try_lock('distribute:a', owner='w2')
+    # Прежний владелец больше не может её продлить
+    assert not store.renew('distribute:a', owner='w1')
+
+
+def test_renew(store):
+    assert store.try_lock('broadcast:a', owner='w1', ttl=0.05)
+    time.sleep(0.03)
+    assert store.renew('broadcast:a', owner='w1', ttl=1)
+    time.sleep(0.05)
+    assert not store.try_lock('broadcast:a', owner='w2')
+    assert not store.renew('broadcast:a', owner='w2')
+
+
+def test_unlock(store):
+    assert store.try_lock('broadcast:a', owner='w1')
+    # Чужая блокировка не снимается
+    store.unlock('broadcast:a', owner='w2')
+    assert not store.try_lock('broadcast:a', owner='w2')
+    store.unlock('broadcast:a', owner='w1')
+    assert store.try_lock('broadcast:a', owner='w2')
+
+
+def test_release_all(store):
+    store.try_lock('broadcast:a', owner='w1')
+    store.try_lock('distribute:a', owner='w1')
+    store.try_lock('broadcast:b', owner='w2')
+    store.release_all(owner='w1')
+    assert store.try_lock('broadcast:a', owner='w3')
+    assert store.try_lock('distribute:a', owner='w3')
+    assert not store.try_lock('broadcast:b', owner='w3')
+
+
+def test_versions(store):
+    assert store.versions(CATALOG_SCOPE, 'a') == (0, 0)
+    store.bump('a')
+    store.bump('a')
+    store.bump(CATALOG_SCOPE)
+    assert store.versions(CATALOG_SCOPE, 'a', 'b') == (1, 2, 0)
+    assert store.version('a') == 2
+
+
+def test_versions_shared_between_processes(tmp_path):
+    path = os.path.join(tmp_path, 'cluster.db')
+    writer = SqliteStore(path)
+    reader = SqliteStore(path, poll_interval=0.05)
+    assert reader.versions('a') == (0,)
+    writer.bump('a')
+    # Свой bump виден сразу, чужой — после следующего опроса
+    assert writer.versions('a') == (1,)
+    assert reader.versions('a') == (0,)
+    time.sleep(0.1)
+    assert reader.versions('a') == (1,)
+    writer.close()
+    reader.close()
+
+
+def message(user_id, chat_id=None):
+    return Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': chat_id or user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+            'text': 'привет',
+        },
+    }, None)
+
+
+def test_shard_by_user():
+    workers = 4
+    for user_id in range(1000, 1100):
+        assert shard_of(message(user_id), workers) == user_id % workers
+    # Пользователь в групповом чате попадает туда же, куда и в личке
+    assert shard_of(message(1001, chat_id=-500), workers) == shard_of(message(1001), workers)
+
+
+def test_shard_without_user():
+    update = Update.de_json({'update_id': 1}, None)
+    assert shard_of(update, 4) == 0
@@ -0,0 +1,48 @@
+"""CachedDatabase: буфер записей перед SQLite"""
+import os
+
+from database import CachedDatabase, SantaDatabase
+
+
+def test_buffered_writes_flushed_on_close(tmp_path):
+    path = os.path.join(tmp_path, 'santa.db')
+    db = CachedDatabase(SantaDatabase(path), max_pending=100)
+    db.register(1, 'anna', "Анна Иванова", "книга")
+    db.register(2, None, "Пётр Петров")
+    db.mark_as_notified(1)
+    # Из кэша — сразу, в базе — ещё нет
+    assert db.get_info(1)[0] == "Анна Иванова"
+    assert db.is_notified(1)
+    assert db.cache_stats()['pending'] == 3
+    backend = SantaDatabase(path)
+    assert backend.get_info(1) is None
+    db.close()
+
+    assert backend.get_info(1)[0] == "Анна Иванова"
+    assert backend.get_info(2)[0] == "Пётр Петров"
+    assert backend.is_notified(1)
+    assert not backend.is_notified(2)
+    backend.close()
+
+
+def test_full_buffer_is_flushed(tmp_path):
+    path = os.path.join(tmp_path, 'santa.db')
+    db = CachedDatabase(SantaDatabase(path), max_pending=3)
+    for user_id in range(1, 4):
+        db.register(user_id, None, f"Участник {user_id}")
+    assert db.cache_stats()['pending'] == 0
+    backend = SantaDatabase(path)
+    assert backend.get_info(3)[0] == "Участник 3"
+    backend.close()
+    db.close()
+
+
+def test_bulk_operations_see_buffered_registrations(tmp_path):
+    db = CachedDatabase(SantaDatabase(os.path.join(tmp_path, 'santa.db')))
+    db.register(1, None, "Участник 1")
+    db.register(2, None, "Участник 2")
+    assert db.get_stats()['total'] == 2
+    assert db.distribute_gifts()
+    assert db.get_pairs() == {1: 2, 2: 1}
+    assert db.get_receiver_for_giver(1)[0] == 2
+    db.close()
@@ -0,0 +1,74 @@
+"""Сводки организаторам: события копятся и уходят одним сообщением на чат"""
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+from digest import AdminDigest
+
+
+class RecordingBot:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+EVENT = SimpleNamespace(id='default', title="Офис", organizers=(1, 2))
+
+
+def test_events_coalesce_into_one_message_per_chat():
+    async def scenario():
+        digest = AdminDigest(interval=60, max_events=100)
+        for number in range(5):
+            digest.add(EVENT, f"Зарегистрирован участник {number}", footer=f"Всего участников: {number + 1}")
+        assert digest.pending() == 10  # пять событий у каждого из двух организаторов
+        bot = RecordingBot()
+        await digest.flush(bot)
+        assert [chat_id for chat_id, _ in bot.sent] == [1, 2]
+        text = bot.sent[0][1]
+        assert "событий 5" in text
+        assert "участник 4" in text
+        # Итоговая строка — только последняя
+        assert text.endswith("Всего участников: 5")
+        assert "Всего участников: 4" not in text
+        assert digest.pending() == 0
+        assert digest.stats['events'] == 5
+        assert digest.stats['sent'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_keeps_events_for_later():
+    async def scenario():
+        digest = AdminDigest(interval=60, max_events=100)
+        event = SimpleNamespace(id='default', title="Офис", organizers=(1,))
+        digest.add(event, "первое")
+        bot = RecordingBot([RetryAfter(30)])
+        await digest.flush(bot)
+        assert bot.sent == []
+        assert digest.stats['throttled'] == 1
+        # Пока чат отложен, события копятся в той же сводке
+        digest.add(event, "второе")
+        await digest.flush(bot)
+        assert bot.sent == []
+        digest.blocked[1] = 0
+        await digest.flush(bot)
+        assert len(bot.sent) == 1
+        assert "первое" in bot.sent[0][1] and "второе" in bot.sent[0][1]
+
+    asyncio.run(scenario())
+
+
+def test_full_buffer_wakes_sender():
+    digest = AdminDigest(interval=60, max_events=3)
+    event = SimpleNamespace(id='default', title="Офис", organizers=(1,))
+    digest.add(event, "1")
+    digest.add(event, "2")
+    assert not digest.wakeup.is_set()
+    digest.add(event, "3")
+    assert digest.wakeup.is_set()
@@ -0,0 +1,114 @@
+"""Реестр и каталог событий: закрепление за обработчиком, выгрузка, перечитывание каталога"""
+import asyncio
+import os
+import threading
+
+from database import SantaDatabase
+from events import EventCatalog, EventRegistry
+
+
+def make_registry(directory, max_loaded):
+    catalog = EventCatalog(os.path.join(directory, 'catalog.db'))
+    for event_id in ('a', 'b', 'c'):
+        catalog.add(event_id, f"Событие {event_id}")
+    return EventRegistry(
+        catalog, lambda event_id: SantaDatabase(os.path.join(directory, f'{event_id}.db')),
+        max_loaded=max_loaded, min_idle=0
+    )
+
+
+def test_pinned_event_is_not_evicted(tmp_path):
+    async def scenario():
+        registry = make_registry(str(tmp_path), max_loaded=1)
+        with registry.pinning():
+            first = await registry.get('a')
+            assert first.pins == 1
+            # Загрузка второго события сверх лимита не выгружает закреплённое
+            await registry.get('b')
+            assert 'a' in registry.loaded
+            assert not await registry.evict('a')
+            await registry.evict_idle()
+            assert registry.loaded['a'] is first
+        assert first.pins == 0
+
+        # Обработчик завершился: теперь событие выгружается как обычно
+        await registry.get('c')
+        assert 'a' not in registry.loaded
+        registry.close()
+
+    asyncio.run(scenario())
+
+
+def test_pins_released_on_error(tmp_path):
+    async def scenario():
+        registry = make_registry(str(tmp_path), max_loaded=10)
+        try:
+            with registry.pinning():
+                event = await registry.get('a')
+                await registry.get('a')
+                assert event.pins == 2
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert event.pins == 0
+        assert await registry.evict('a')
+        registry.close()
+
+    asyncio.run(scenario())
+
+
+def test_background_access_does_not_pin(tmp_path):
+    async def scenario():
+        registry = make_registry(str(tmp_path), max_loaded=10)
+        event = await registry.get('a')
+        assert event.pins == 0
+        registry.close()
+
+    asyncio.run(scenario())
+
+
+def test_reload_updates_only_changed_members(tmp_path):
+    path = os.path.join(tmp_path, 'catalog.db')
+    writer = EventCatalog(path)
+    reader = EventCatalog(path)
+    writer.add('a', "Событие a", organizer=1)
+    writer.add('b', "Событие b")
+    writer.join(10, 'a')
+    writer.join(11, 'a')
+    reader.reload()
+    assert reader.event_of(10) == 'a'
+    assert reader.event_of(11) == 'a'
+    assert reader.event_of(12) is None
+    organizers = reader.organizers['a']
+
+    # Другой процесс перевёл пользователей и добавил организатора
+    writer.join_many([10, 12], 'b')
+    writer.add_organizer('a', 2)
+    reader.reload()
+    assert reader.members == {10: 'b', 11: 'a', 12: 'b'}
+    # Множество организаторов то же (его держат загруженные события), содержимое новое
+    assert reader.organizers['a'] is organizers
+    assert organizers == {1, 2}
+    writer.close()
+    reader.close()
+
+
+def test_catalog_calls_run_in_storage_thread(tmp_path, monkeypatch):
+    async def scenario():
+        registry = make_registry(str(tmp_path), max_loaded=10)
+        threads = []
+        event_of = registry.catalog.event_of
+
+        def tracked(user_id):
+            threads.append(threading.current_thread().name)
+            return event_of(user_id)
+
+        monkeypatch.setattr(registry.catalog, 'event_of', tracked)
+        await registry.join(5, 'b')
+        assert (await registry.for_user(5)).id == 'b'
+        # Пользователя 6 нет в кэше: каталог читается в потоке хранилищ
+        assert await registry.event_of(6) is None
+        assert threads == ['storage_0']
+        registry.close()
+
+    asyncio.run(scenario())
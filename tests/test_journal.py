@@ -0,0 +1,72 @@
+"""Хранилище в памяти с журналом: восстановление из снимка и хвоста журнала"""
+import os
+
+from database import MemoryDatabase
+from journal import Journal
+
+
+def open_db(base_path, **kwargs):
+    db = MemoryDatabase()
+    db.attach_journal(Journal(base_path, sync_interval=0, **kwargs))
+    return db
+
+
+def test_recover_from_journal_after_crash(tmp_path):
+    base_path = os.path.join(tmp_path, 'santa')
+    db = open_db(base_path)
+    for user_id in range(1, 6):
+        db.register(user_id, None, f"Участник {user_id}", "книга")
+    assert db.distribute_gifts()
+    db.mark_as_notified(1)
+    # Процесс упал: снимка нет, только журнал
+    db.journal.file.close()
+
+    restored = open_db(base_path)
+    assert len(restored.participants) == 5
+    assert restored.get_info(3)[0] == "Участник 3"
+    assert restored.distribution_done
+    assert restored.get_pairs() == db.get_pairs()
+    assert restored.is_notified(1)
+    assert not restored.is_notified(2)
+    restored.close()
+
+
+def test_snapshot_then_journal_tail(tmp_path):
+    base_path = os.path.join(tmp_path, 'santa')
+    db = open_db(base_path)
+    for user_id in range(1, 4):
+        db.register(user_id, None, f"Участник {user_id}")
+    db.close()
+    # Штатная остановка: всё в снимке, журнал пуст
+    assert os.path.getsize(base_path + '.snapshot') > 0
+    assert os.path.getsize(base_path + '.journal') == 0
+
+    db = open_db(base_path)
+    db.register(4, None, "Участник 4")
+    db.journal.file.close()
+
+    restored = open_db(base_path)
+    assert sorted(restored.participants) == [1, 2, 3, 4]
+    assert restored.get_stats()['total'] == 4
+    restored.close()
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    base_path = os.path.join(tmp_path, 'santa')
+    db = open_db(base_path)
+    db.register(1, None, "Участник 1")
+    db.register(2, None, "Участник 2")
+    db.journal.file.close()
+    # Сбой посреди записи: последняя запись оборвана
+    with open(base_path + '.journal', 'r+b') as f:
+        f.truncate(os.path.getsize(base_path + '.journal') - 3)
+
+    restored = open_db(base_path)
+    assert restored.is_registered(1)
+    assert not restored.is_registered(2)
+    # Журнал обрезан до целых записей: новые записи читаются после перезапуска
+    restored.register(3, None, "Участник 3")
+    restored.journal.file.close()
+    final = open_db(base_path)
+    assert final.is_registered(3)
+    final.close()
@@ -0,0 +1,63 @@
+"""Распределение пар: один цикл, ограничения, невыполнимые случаи"""
+import random
+
+import pytest
+
+from matching import Constraints, UnsatisfiableError, constrained_cycle, random_cycle, random_derangement
+
+
+def check_assignment(assignment, participants):
+    assert sorted(assignment.giver_to_receiver) == sorted(participants)
+    assert sorted(assignment.giver_to_receiver.values()) == sorted(participants)
+    assert all(giver != receiver for giver, receiver in assignment.giver_to_receiver.items())
+
+
+def test_random_cycle_is_one_cycle():
+    participants = list(range(100))
+    assignment = random_cycle(participants, rng=random.Random(1))
+    check_assignment(assignment, participants)
+    assert len(assignment.cycles()) == 1
+    for giver in participants:
+        assert assignment.giver_of(assignment.receiver_of(giver)) == giver
+
+
+def test_random_derangement_has_no_fixed_points():
+    participants = list(range(50))
+    check_assignment(random_derangement(participants, rng=random.Random(2)), participants)
+
+
+def test_too_few_participants():
+    with pytest.raises(ValueError):
+        random_cycle([1])
+    with pytest.raises(ValueError):
+        constrained_cycle([1], Constraints())
+
+
+def test_constraints_respected():
+    participants = list(range(40))
+    constraints = Constraints()
+    for user_id in participants:
+        constraints.set_group(user_id, user_id % 4)
+    constraints.exclude(0, 1)
+    assignment = constrained_cycle(participants, constraints, rng=random.Random(3))
+    check_assignment(assignment, participants)
+    for giver, receiver in assignment.giver_to_receiver.items():
+        assert constraints.allows(giver, receiver)
+    assert assignment.receiver_of(0) != 1
+    assert assignment.receiver_of(1) != 0
+
+
+def test_oversized_group_is_unsatisfiable():
+    constraints = Constraints()
+    for user_id in range(3):
+        constraints.set_group(user_id, 'команда')
+    with pytest.raises(UnsatisfiableError):
+        constrained_cycle(range(5), constraints)
+
+
+def test_isolated_participant_is_unsatisfiable():
+    constraints = Constraints()
+    for user_id in range(1, 6):
+        constraints.exclude(0, user_id)
+    with pytest.raises(UnsatisfiableError):
+        constrained_cycle(range(6), constraints)
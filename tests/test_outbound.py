@@ -0,0 +1,107 @@
+"""Очередь исходящих запросов: приоритеты, порядок в чате, лимит"""
+import asyncio
+import time
+
+from outbound import BULK, INTERACTIVE, OutboundQueue
+
+
+def test_interactive_overtakes_bulk_in_same_chat():
+    async def scenario():
+        queue = OutboundQueue(rate=1000)
+        order = []
+        release = asyncio.Event()
+
+        async def request(name, priority, hold=None):
+            async with queue.slot(priority, chat_id=1):
+                order.append(name)
+                if hold:
+                    await hold.wait()
+
+        first = asyncio.create_task(request('bulk-1', BULK, release))
+        await asyncio.sleep(0.01)
+        # Пока идёт первый запрос, в чат встают рассылка и ответ пользователю
+        second = asyncio.create_task(request('bulk-2', BULK))
+        await asyncio.sleep(0.01)
+        reply = asyncio.create_task(request('reply', INTERACTIVE))
+        await asyncio.sleep(0.01)
+        assert order == ['bulk-1']
+        release.set()
+        await asyncio.gather(first, second, reply)
+        assert order == ['bulk-1', 'reply', 'bulk-2']
+
+    asyncio.run(scenario())
+
+
+def test_one_request_per_chat():
+    async def scenario():
+        queue = OutboundQueue(rate=1000)
+        in_flight = {}
+        peak = {}
+
+        async def request(chat_id):
+            async with queue.slot(BULK, chat_id=chat_id):
+                in_flight[chat_id] = in_flight.get(chat_id, 0) + 1
+                peak[chat_id] = max(peak.get(chat_id, 0), in_flight[chat_id])
+                await asyncio.sleep(0.005)
+                in_flight[chat_id] -= 1
+
+        await asyncio.gather(*(request(chat_id % 3) for chat_id in range(30)))
+        assert peak == {0: 1, 1: 1, 2: 1}
+        assert not queue.active and not queue.parked and queue.waiting == [0, 0, 0]
+
+    asyncio.run(scenario())
+
+
+def test_order_within_class_kept():
+    async def scenario():
+        queue = OutboundQueue(rate=1000)
+        order = []
+
+        async def request(number):
+            async with queue.slot(BULK, chat_id=7):
+                order.append(number)
+                await asyncio.sleep(0.001)
+
+        await asyncio.gather(*(request(number) for number in range(10)))
+        assert order == list(range(10))
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit():
+    async def scenario():
+        queue = OutboundQueue(rate=100, capacity=5)
+
+        async def request(chat_id):
+            async with queue.slot(BULK, chat_id=chat_id):
+                pass
+
+        started = time.monotonic()
+        await asyncio.gather(*(request(chat_id) for chat_id in range(25)))
+        # Пять запросов из запаса ведра, остальные двадцать — по 10 мс
+        assert time.monotonic() - started >= 0.18
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_frees_chat():
+    async def scenario():
+        queue = OutboundQueue(rate=1000)
+        release = asyncio.Event()
+
+        async def request(hold=None):
+            async with queue.slot(BULK, chat_id=1):
+                if hold:
+                    await hold.wait()
+
+        first = asyncio.create_task(request(release))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(request())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        release.set()
+        await first
+        await asyncio.wait_for(request(), 1)
+        assert not queue.active
+
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+"""Параллельная обработка обновлений: порядок одного пользователя и параллелизм разных"""
+import asyncio
+from types import SimpleNamespace
+
+from processing import UserOrderedUpdateProcessor, update_key
+
+
+def update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+
+def test_update_key():
+    assert update_key(update(5)) == 5
+    assert update_key(SimpleNamespace(effective_user=None, effective_chat=SimpleNamespace(id=-7))) == -7
+    assert update_key(SimpleNamespace(effective_user=None, effective_chat=None)) is None
+
+
+def test_same_user_in_order_different_users_in_parallel():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent=8)
+        handled = []
+        running = 0
+        peak = 0
+
+        async def handle(user_id, step):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            # Первые шаги дольше: без замка пользователя они бы обогнали следующие
+            await asyncio.sleep(0.02 if step == 0 else 0.001)
+            handled.append((user_id, step))
+            running -= 1
+
+        await asyncio.gather(*(
+            processor.process_update(update(user_id), handle(user_id, step))
+            for step in range(3) for user_id in range(4)
+        ))
+        for user_id in range(4):
+            assert [step for user, step in handled if user == user_id] == [0, 1, 2]
+        assert peak > 1
+        # Замки пользователей не копятся
+        assert processor.locks == {}
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_limit():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent=2)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(update(user_id), handle()) for user_id in range(10)))
+        assert peak == 2
+
+    asyncio.run(scenario())
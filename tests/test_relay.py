@@ -0,0 +1,92 @@
+"""Анонимные сообщения: outbox и доставка пачками"""
+import asyncio
+import os
+
+from broadcast import FakeBot
+from relay import AnonymousRelay, RelayOutbox
+
+
+def test_add_and_deliver(tmp_path):
+    path = os.path.join(tmp_path, 'relay.db')
+
+    async def scenario():
+        relay = AnonymousRelay(RelayOutbox(path), per_chat_interval=0.05)
+        bot = FakeBot(latency=0, global_limit=1000, chat_interval=0)
+        assert await relay.add(1, "первое")
+        assert await relay.add(1, "второе")
+        assert await relay.add(2, "третье")
+        assert relay.pending() == 3
+        task = asyncio.create_task(relay.run(bot))
+        for _ in range(100):
+            if not relay.pending() and not relay.outbox.pending():
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        assert relay.stats['delivered'] == 3
+        # Два сообщения в один чат ушли одним
+        assert relay.stats['sent'] == 2
+        # Доставленное удалено из outbox
+        assert relay.outbox.pending() == []
+        relay.close()
+
+    asyncio.run(scenario())
+
+
+def test_undelivered_survive_restart(tmp_path):
+    path = os.path.join(tmp_path, 'relay.db')
+
+    async def scenario():
+        relay = AnonymousRelay(RelayOutbox(path))
+        for chat_id in range(5):
+            await relay.add(chat_id, "до перезапуска")
+        relay.close()
+        relay = AnonymousRelay(RelayOutbox(path))
+        assert relay.pending() == 5
+        relay.close()
+
+    asyncio.run(scenario())
+
+
+def test_sender_interval(tmp_path):
+    path = os.path.join(tmp_path, 'relay.db')
+
+    async def scenario():
+        relay = AnonymousRelay(RelayOutbox(path), sender_interval=0.05)
+        assert await relay.add(1, "первое", sender_id=10)
+        # Второе сообщение того же отправителя сразу — отклонено, другого — принято
+        assert not await relay.add(2, "второе", sender_id=10)
+        assert relay.sender_wait(10) > 0
+        assert await relay.add(1, "третье", sender_id=11)
+        await asyncio.sleep(0.06)
+        assert await relay.add(2, "четвёртое", sender_id=10)
+        assert relay.stats['limited'] == 1
+        assert relay.pending() == 3
+        relay.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_timestamps_are_swept(tmp_path):
+    path = os.path.join(tmp_path, 'relay.db')
+
+    async def scenario():
+        relay = AnonymousRelay(RelayOutbox(path), per_chat_interval=0.01, sender_interval=0.01)
+        bot = FakeBot(latency=0, global_limit=1000, chat_interval=0)
+        for chat_id in range(10):
+            await relay.add(chat_id, "привет", sender_id=100 + chat_id)
+        task = asyncio.create_task(relay.run(bot))
+        for _ in range(100):
+            if not relay.pending() and relay.next_send:
+                break
+            await asyncio.sleep(0.01)
+        assert len(relay.next_send) == 10
+        await asyncio.sleep(0.02)
+        relay.sweep_at = 0
+        relay.wakeup.set()
+        await asyncio.sleep(0.01)
+        task.cancel()
+        assert relay.next_send == {}
+        assert relay.next_accept == {}
+        relay.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,93 @@
+"""Отбор обновлений, накопившихся за перезапуск"""
+from telegram import Update
+
+from replay import select
+
+NOW = 1_700_000_000
+
+
+def message(update_id, user_id, text, age=0):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': NOW - age,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+            'text': text,
+        },
+    }, None)
+
+
+def texts(updates):
+    return [(update.effective_user.id, update.message.text) for update in updates]
+
+
+def test_consecutive_repeats_collapse():
+    updates = [message(1, 10, '/start'), message(2, 10, '/start'), message(3, 10, '/start')]
+    selected, report = select(updates, NOW)
+    assert texts(selected) == [(10, '/start')]
+    assert report['duplicates'] == 2
+    assert report['replayed'] == 1
+
+
+def test_same_answer_on_different_steps_is_kept():
+    # Пожелания — «нет», затем «нет» на следующий шаг анкеты: оба ответа нужны
+    updates = [
+        message(1, 10, 'Анна'),
+        message(2, 10, 'нет'),
+        message(3, 20, 'нет'),
+        message(4, 10, 'книга'),
+        message(5, 10, 'нет'),
+    ]
+    selected, report = select(updates, NOW)
+    assert texts(selected) == [(10, 'Анна'), (10, 'нет'), (20, 'нет'), (10, 'книга'), (10, 'нет')]
+    assert report['duplicates'] == 0
+
+
+def test_same_answer_twice_in_a_row_is_kept():
+    # «нет» на пожелания и сразу «нет» на анти-пожелания: без второго ответа
+    # пользователь остался бы на шаге WAITING_FOR_NOT_WISH
+    updates = [message(1, 10, 'Анна Иванова'), message(2, 10, 'нет'), message(3, 10, 'нет')]
+    selected, report = select(updates, NOW)
+    assert texts(selected) == [(10, 'Анна Иванова'), (10, 'нет'), (10, 'нет')]
+    assert report['duplicates'] == 0
+
+
+def test_repeats_of_other_users_do_not_interleave():
+    # Повтор считается по обновлениям того же пользователя, чужие между ними не мешают
+    updates = [message(1, 10, '/start'), message(2, 20, '/start'), message(3, 10, '/start')]
+    selected, _ = select(updates, NOW)
+    assert texts(selected) == [(10, '/start'), (20, '/start')]
+
+
+def test_answer_between_commands_breaks_repeat():
+    updates = [message(1, 10, '/start'), message(2, 10, 'Анна'), message(3, 10, '/start')]
+    selected, _ = select(updates, NOW)
+    assert len(selected) == 3
+
+
+def test_stale_messages_dropped():
+    updates = [message(1, 10, '/start', age=3600), message(2, 10, 'привет', age=5)]
+    selected, report = select(updates, NOW, max_age=600)
+    assert texts(selected) == [(10, 'привет')]
+    assert report['stale'] == 1
+
+
+def callback(update_id, user_id, data):
+    return Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': 'c',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+            'data': data,
+        },
+    }, None)
+
+
+def test_repeated_button_presses_collapse():
+    updates = [callback(1, 10, 'stats:1'), callback(2, 10, 'stats:1'), callback(3, 10, 'stats:2')]
+    selected, report = select(updates, NOW)
+    assert [update.callback_query.data for update in selected] == ['stats:1', 'stats:2']
+    assert report['duplicates'] == 1
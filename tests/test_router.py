@@ -0,0 +1,69 @@
+"""Таблица маршрутов: состояния диалога и кнопки меню"""
+import asyncio
+from types import SimpleNamespace
+
+from router import ANY_TEXT, Router, get_state, set_state
+
+TYPING = 1
+MESSAGE = 2
+
+
+def make_router():
+    calls = []
+
+    def handler(name):
+        async def handle(update, context):
+            calls.append(name)
+        handle.__name__ = name
+        return handle
+
+    async def is_admin(update):
+        return False
+
+    router = Router(is_admin=is_admin, fallback=handler('fallback'))
+    router.add('📝 Моя анкета', handler('profile'))
+    router.add('📊 Статистика', handler('stats'), admin=True)
+    router.add(ANY_TEXT, handler('name'), state=TYPING)
+    router.add('❌ Отменить сообщение', handler('cancel'), state=MESSAGE)
+    router.add(ANY_TEXT, handler('message'), state=MESSAGE, menu_first=True)
+    return router, calls
+
+
+def send(router, context, text):
+    update = SimpleNamespace(message=SimpleNamespace(text=text))
+    asyncio.run(router.dispatch(update, context))
+
+
+def test_state_text_goes_to_state_route():
+    router, calls = make_router()
+    context = SimpleNamespace(user_data={})
+    set_state(context, TYPING)
+    # При вводе имени текст кнопки — это тоже ввод
+    send(router, context, '📝 Моя анкета')
+    assert calls == ['name']
+    assert get_state(context) == TYPING
+
+
+def test_menu_button_leaves_menu_first_state():
+    router, calls = make_router()
+    context = SimpleNamespace(user_data={})
+    set_state(context, MESSAGE)
+    send(router, context, '📝 Моя анкета')
+    assert calls == ['profile']
+    assert get_state(context) is None
+
+
+def test_menu_first_state_keeps_own_routes_and_text():
+    router, calls = make_router()
+    context = SimpleNamespace(user_data={})
+    set_state(context, MESSAGE)
+    send(router, context, 'Привет!')
+    send(router, context, '❌ Отменить сообщение')
+    assert calls == ['message', 'cancel']
+
+
+def test_admin_route_for_non_admin():
+    router, calls = make_router()
+    context = SimpleNamespace(user_data={})
+    send(router, context, '📊 Статистика')
+    assert calls == ['fallback']
@@ -0,0 +1,127 @@
+"""Счётчики get_stats совпадают с пересчётом с нуля (check_stats) на всех хранилищах"""
+import os
+import random
+
+import pytest
+
+from database import CachedDatabase, MemoryDatabase, SantaDatabase
+from journal import Journal
+
+
+def open_memory(directory):
+    return MemoryDatabase()
+
+
+def open_journal(directory):
+    db = MemoryDatabase()
+    db.attach_journal(Journal(os.path.join(directory, 'event')))
+    return db
+
+
+def open_sqlite(directory):
+    return SantaDatabase(os.path.join(directory, 'santa.db'))
+
+
+def open_cached(directory):
+    # max_pending=7: часть изменений ещё в буфере, часть уже записана
+    return CachedDatabase(SantaDatabase(os.path.join(directory, 'santa.db')), max_pending=7)
+
+
+BACKENDS = {
+    'memory': open_memory,
+    'journal': open_journal,
+    'sqlite': open_sqlite,
+    'cached': open_cached,
+}
+# Хранилища, которые переживают перезапуск
+PERSISTENT = ('journal', 'sqlite', 'cached')
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request, tmp_path):
+    return request.param, BACKENDS[request.param], str(tmp_path)
+
+
+def register(db, user_id):
+    db.register(user_id, f"user{user_id}", f"Участник {user_id}", "книга", None)
+
+
+def test_sequence(backend):
+    _, open_db, directory = backend
+    db = open_db(directory)
+    users = list(range(1, 21))
+
+    for user_id in users:
+        register(db, user_id)
+    assert db.check_stats() == {}
+    assert db.get_stats()['total'] == 20
+
+    # Повторная регистрация не добавляет участника
+    register(db, 5)
+    assert db.check_stats() == {}
+    assert db.get_stats()['total'] == 20
+
+    assert db.distribute_gifts()
+    assert db.check_stats() == {}
+    assert db.get_stats()['givers'] == 20
+
+    for user_id in users[:8]:
+        db.mark_as_notified(user_id)
+    # Повторная отметка и отметка незарегистрированного ничего не меняют
+    db.mark_as_notified(1)
+    db.mark_as_notified(999)
+    assert db.check_stats() == {}
+    assert db.get_stats()['notified'] == 8
+    assert db.get_stats()['remaining'] == 12
+
+    # Повторная регистрация после распределения сбрасывает флаги участника
+    register(db, 1)
+    register(db, 30)
+    assert db.check_stats() == {}
+
+    db.reset_all()
+    assert db.check_stats() == {}
+    assert db.get_stats()['total'] == 0
+
+    register(db, 40)
+    assert db.check_stats() == {}
+    db.close()
+
+
+def test_random_operations(backend):
+    _, open_db, directory = backend
+    db = open_db(directory)
+    rng = random.Random(2024)
+
+    for step in range(400):
+        operation = rng.random()
+        if operation < 0.5:
+            register(db, rng.randrange(1, 60))
+        elif operation < 0.85:
+            db.mark_as_notified(rng.randrange(1, 70))
+        elif operation < 0.97:
+            db.distribute_gifts()
+        else:
+            db.reset_all()
+        assert db.check_stats() == {}, f"шаг {step}"
+    db.close()
+
+
+def test_counters_survive_restart(backend):
+    name, open_db, directory = backend
+    if name not in PERSISTENT:
+        pytest.skip("хранилище только в памяти")
+
+    db = open_db(directory)
+    for user_id in range(1, 31):
+        register(db, user_id)
+    db.distribute_gifts()
+    for user_id in range(1, 11):
+        db.mark_as_notified(user_id)
+    expected = db.get_stats()
+    db.close()
+
+    db = open_db(directory)
+    assert db.check_stats() == {}
+    assert db.get_stats() == expected
+    db.close()
@@ -0,0 +1,74 @@
+"""HTTP-сервер бота: /health, /ready, доступ к /metrics и секрет webhook"""
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook
+from webhook import WebhookServer
+
+
+def serve(scenario, **kwargs):
+    async def run():
+        application = SimpleNamespace(running=True, bot=None, update_queue=asyncio.Queue())
+        server = WebhookServer(application, **kwargs)
+        async with TestClient(TestServer(server.app)) as client:
+            await scenario(client, server, application)
+
+    asyncio.run(run())
+
+
+def test_health_and_ready():
+    async def scenario(client, server, application):
+        response = await client.get('/health')
+        assert response.status == 200
+        assert await response.text() == 'ok'
+        response = await client.get('/ready')
+        assert (await response.json())['status'] == 'ready'
+        application.running = False
+        response = await client.get('/ready')
+        assert response.status == 503
+
+    serve(scenario)
+
+
+def test_metrics_with_token():
+    async def scenario(client, server, application):
+        assert (await client.get('/metrics')).status == 403
+        assert (await client.get('/metrics', headers={'Authorization': 'Bearer wrong'})).status == 403
+        response = await client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+        assert response.status == 200
+        assert response.content_type == 'text/plain'
+
+    serve(scenario, metrics_token='s3cret')
+
+
+def test_metrics_without_token_only_local(monkeypatch):
+    async def scenario(client, server, application):
+        assert (await client.get('/metrics')).status == 200
+        # Тот же запрос «не с localhost»
+        monkeypatch.setattr(webhook, 'LOCAL_ADDRESSES', ())
+        assert (await client.get('/metrics')).status == 404
+
+    serve(scenario)
+
+
+def test_webhook_requires_secret():
+    update = {'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'text': '/start',
+        'chat': {'id': 10, 'type': 'private'},
+        'from': {'id': 10, 'is_bot': False, 'first_name': 'U'},
+    }}
+
+    async def scenario(client, server, application):
+        # Webhook ещё не установлен
+        assert (await client.post('/webhook', json=update)).status == 404
+        server.webhook_enabled = True
+        assert (await client.post('/webhook', json=update)).status == 403
+        headers = {'X-Telegram-Bot-Api-Secret-Token': 'token'}
+        assert (await client.post('/webhook', data='{', headers=headers)).status == 400
+        assert (await client.post('/webhook', json=update, headers=headers)).status == 200
+        assert application.update_queue.get_nowait().update_id == 1
+        assert server.rejected == 2
+
+    serve(scenario, secret_token='token')
@@ -0,0 +1,112 @@
+"""Приём обновлений через webhook: встроенный aiohttp-сервер и health-эндпоинты"""
+import hmac
+import json
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+from metrics import ERRORS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Без metrics_token /metrics отвечает только запросам с этого же хоста
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def same_secret(value, expected):
+    """Сравнение секретов за постоянное время; заголовки с не-ASCII — просто неверный секрет"""
+    return hmac.compare_digest(value.encode('utf-8', 'surrogateescape'), expected.encode('utf-8'))
+
+
+class WebhookServer:
+    """
+    HTTP-сервер бота.
+    POST <path> принимает обновления от Telegram (только с верным секретным токеном)
+    и кладёт их в очередь приложения. GET /health и /ready — для проверок Railway,
+    GET /metrics — метрики в формате Prometheus: с metrics_token — только
+    с заголовком Authorization: Bearer <metrics_token>, без него — только
+    с localhost (порт сервера публичный, метрики раскрывают розыгрыши и маршруты).
+    В режиме polling сервер поднимается только ради /health, /ready и /metrics.
+    """
+
+    def __init__(self, application, host='0.0.0.0', port=8080, path='/webhook', secret_token=None,
+                 metrics_token=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.metrics_token = metrics_token
+        self.webhook_enabled = False
+        self.runner = None
+        self.received = 0
+        self.rejected = 0
+
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self.handle_update)
+        self.app.router.add_get('/health', self.health)
+        self.app.router.add_get('/ready', self.ready)
+        self.app.router.add_get('/metrics', self.metrics)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"HTTP-сервер слушает {self.host}:{self.port}")
+
+    async def set_webhook(self, base_url, drop_pending_updates=False):
+        """Сообщить Telegram адрес webhook (base_url — публичный адрес сервиса)"""
+        await self.application.bot.set_webhook(
+            url=base_url.rstrip('/') + self.path,
+            secret_token=self.secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=drop_pending_updates
+        )
+        self.webhook_enabled = True
+        logger.info(f"Webhook установлен: {base_url.rstrip('/')}{self.path}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_update(self, request):
+        if not self.webhook_enabled:
+            return web.Response(status=404)
+
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if self.secret_token and not same_secret(token, self.secret_token):
+            self.rejected += 1
+            ERRORS.inc('webhook', 'forbidden')
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            self.rejected += 1
+            ERRORS.inc('webhook', 'bad_json')
+            return web.Response(status=400)
+
+        # Отвечаем сразу: обработка идёт в приложении, Telegram не ждёт
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return web.Response()
+
+    async def health(self, request):
+        return web.Response(text='ok')
+
+    async def ready(self, request):
+        if self.application.running:
+            return web.json_response({'status': 'ready', 'webhook': self.webhook_enabled})
+        return web.json_response({'status': 'starting'}, status=503)
+
+    async def metrics(self, request):
+        if self.metrics_token:
+            token = request.headers.get('Authorization', '')
+            if not same_secret(token, f'Bearer {self.metrics_token}'):
+                return web.Response(status=403)
+        elif request.remote not in LOCAL_ADDRESSES:
+            return web.Response(status=404)
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')